@@ -0,0 +1,171 @@
+"""
+Compiled network artifact: a directory of raw .npy arrays which can be memory-mapped read-only and shared by many processes
+
+1. Each column of the bus/line/trafo/load/sgen/ext_grid tables is one array, the string columns are saved as integer codes with their categories in the manifest.
+2. The internal ppc arrays of the power flow (Ybus in CSR form, Sbus, V, ref/pv/pq, the bus lookup, the bus/branch matrices and the line ratings) are precomputed once.
+3. The zone index arrays give the rows of net.bus of each zone.
+4. The full pandapower net is kept as json and is only rebuilt when artifact.net is requested.
+The manifest records the format version, the pandapower version and the dtype/shape of every array.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import pandapower as pp
+from scipy.sparse import csr_matrix
+from power_flow import ppc_arrays, PowerFlowRunner
+
+FORMAT_VERSION = 5
+TABLES = ['bus', 'line', 'trafo', 'load', 'sgen', 'ext_grid']
+PPC_KEYS = ['ref', 'pv', 'pq', 'V', 'Sbus', 'bus_lookup', 'bus_ppc', 'bus', 'branch', 'line_branch', 'line_i_max_ka',
+            'trafo_branch', 'trafo_i_max_hv_ka', 'trafo_i_max_lv_ka']
+
+"""
+Functions
+"""
+
+def export_network(net, path, max_iteration = 30):
+    """
+    TARGET:
+        Write the network into the artifact directory path (e.g. bus322.net)
+    """
+    os.makedirs(path, exist_ok = True)
+    manifest = {'format_version': FORMAT_VERSION, 'pandapower_version': pp.__version__, 'arrays': {}, 'tables': {}}
+
+    def save(name, array):
+        array = np.ascontiguousarray(array)
+        np.save(os.path.join(path, f'{name}.npy'), array, allow_pickle = False)
+        manifest['arrays'][name] = {'dtype': str(array.dtype), 'shape': list(array.shape)}
+
+    # tables: one array per column
+    for table in TABLES:
+        columns = {}
+        save(f'{table}.index', net[table].index.values.astype(np.int64))
+        for column in net[table].columns:
+            values = net[table][column].values
+            if values.dtype == object:
+                categorical = pd.Categorical(net[table][column])
+                save(f'{table}.{column}', categorical.codes)
+                columns[column] = {'categories': categorical.categories.tolist()}
+            else:
+                save(f'{table}.{column}', values)
+                columns[column] = {}
+        manifest['tables'][table] = columns
+
+    # ppc: the Ybus is saved in CSR form
+    ppc = ppc_arrays(net, max_iteration)
+    Ybus = ppc['Ybus']
+    save('Ybus.data', Ybus.data)
+    save('Ybus.indices', Ybus.indices)
+    save('Ybus.indptr', Ybus.indptr)
+    manifest['Ybus_shape'] = list(Ybus.shape)
+    manifest['baseMVA'] = float(ppc['baseMVA'])
+    for key in PPC_KEYS:
+        save(f'ppc.{key}', ppc[key])
+
+    # zone index: the bus rows sorted by zone, the rows of zones[k] are zone.bus[zone.ptr[k]:zone.ptr[k+1]]
+    zone = pd.Categorical(net.bus['zone'])
+    order = np.argsort(zone.codes, kind = 'stable')
+    save('zone.bus', order)
+    save('zone.ptr', np.searchsorted(zone.codes[order], np.arange(len(zone.categories) + 1)))
+    manifest['zones'] = zone.categories.tolist()
+
+    pp.to_json(net, os.path.join(path, 'net.json'))
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 1)
+
+class NetworkArtifact:
+    """
+    TARGET:
+        Read-only view of an artifact directory, every array is memory-mapped on its first use
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        assert self.manifest['format_version'] == FORMAT_VERSION, f"artifact format {self.manifest['format_version']} is not supported"
+        self.zones = self.manifest['zones']
+        self._arrays = {}
+        self._tables = {}
+        self._net = None
+
+    def array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode = 'r')
+        return self._arrays[name]
+
+    def column(self, table, column):
+        """
+        TARGET:
+            Return one column of a table as an array, the string columns are decoded from their codes
+        """
+        values = self.array(f'{table}.{column}')
+        categories = self.manifest['tables'][table][column].get('categories')
+        if categories is None:
+            return values
+        return pd.Categorical.from_codes(values, categories = categories).astype(object)
+
+    def table(self, table):
+        """
+        TARGET:
+            Return the pandas table, built on the first request
+        """
+        if table not in self._tables:
+            columns = self.manifest['tables'][table]
+            data = {column: self.column(table, column) for column in columns}
+            self._tables[table] = pd.DataFrame(data, index = pd.Index(self.array(f'{table}.index')), columns = list(columns))
+        return self._tables[table]
+
+    @property
+    def Ybus(self):
+        return csr_matrix((self.array('Ybus.data'), self.array('Ybus.indices'), self.array('Ybus.indptr')),
+                          shape = tuple(self.manifest['Ybus_shape']), copy = False)
+
+    def ppc(self):
+        ppc = {key: self.array(f'ppc.{key}') for key in PPC_KEYS}
+        ppc['Ybus'] = self.Ybus
+        ppc['baseMVA'] = self.manifest['baseMVA']
+        return ppc
+
+    def zone_bus(self, zone):
+        """
+        TARGET:
+            Return the rows of net.bus in the zone
+        """
+        k = self.zones.index(zone)
+        ptr = self.array('zone.ptr')
+        return self.array('zone.bus')[ptr[k]:ptr[k+1]]
+
+    def runner(self, **kwargs):
+        """
+        TARGET:
+            Return a PowerFlowRunner on the precomputed ppc arrays (no pandapower conversion)
+        """
+        return PowerFlowRunner.from_arrays(self.ppc(), self.table('sgen'), self.table('load'), **kwargs)
+
+    @property
+    def net(self):
+        """
+        TARGET:
+            Return the full pandapower net, rebuilt from json on the first request
+        """
+        if self._net is None:
+            self._net = pp.from_json(os.path.join(self.path, 'net.json'))
+        return self._net
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name to export")
+    args = parser.parse_args()
+
+    export_network(pp.from_pickle(f'{args.bus}.p'), f'{args.bus}.net')
+    artifact = NetworkArtifact(f'{args.bus}.net')
+    print(f"exported {args.bus}.net: {len(artifact.manifest['arrays'])} arrays, zones: {artifact.zones}")
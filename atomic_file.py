@@ -0,0 +1,27 @@
+"""
+Atomic file writes shared by the dataset shards and the scenario cache
+
+1. The file is written into a temporary file of the same directory and renamed to its path (os.replace is atomic),
+   so a reader (another worker, a restarted job) never sees a partial file.
+"""
+
+import os
+import tempfile
+
+"""
+Functions
+"""
+
+def write_atomic(path, write):
+    """
+    TARGET:
+        Write a file by write(file object) into a temporary file of the same directory and rename it to path
+    """
+    handle, tmp = tempfile.mkstemp(dir = os.path.dirname(path) or '.', suffix = '.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
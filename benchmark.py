@@ -0,0 +1,175 @@
+"""
+Benchmark the network generation and the power flow, the results are written as json to compare between releases
+
+1. build: wall time and peak memory of bus33bw.py, bus141.py, generate_lv_net.py and bus322.py (run in a temporary copy of the repo, --no_html).
+2. power flow: on each saved case under randomized PV/load scenarios,
+    - single: pp.runpp latency, Newton-Raphson iterations and convergence
+    - repeated: PowerFlowRunner latency per timestep, iterations and convergence rate
+3. scaling: generation time and power flow latency of synthetic networks (generate_large_net.py) of increasing size.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from copy import deepcopy
+import pandapower as pp
+from power_flow import PowerFlowRunner
+from scenarios import random_scenarios
+
+CASES = ['bus33bw', 'bus141', 'bus322']
+BUILD_SCRIPTS = ['bus33bw.py', 'bus141.py', 'generate_lv_net.py', 'bus322.py']
+
+"""
+Functions
+"""
+
+def summary(values):
+    values = np.asarray(values, dtype = float)
+    return {'mean': float(values.mean()), 'std': float(values.std()), 'min': float(values.min()),
+            'median': float(np.median(values)), 'p95': float(np.percentile(values, 95)), 'max': float(values.max())}
+
+def bench_build(scripts):
+    """
+    TARGET:
+        Run each generation script in a temporary copy of the repo and record its wall time and peak memory
+    """
+    results = {}
+    env = dict(os.environ, SIMBENCH_CACHE = os.path.abspath(os.environ.get('SIMBENCH_CACHE', '.simbench_cache')))
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in os.listdir('.'):
+            if name.endswith('.py') or name.endswith('.mat') or name.endswith('.p'):
+                shutil.copy(name, workdir)
+        shutil.copytree('lv_network', os.path.join(workdir, 'lv_network'))
+
+        for script in scripts:
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, script, '--no_html'], cwd = workdir, env = env,
+                                       stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+            _, status, usage = os.wait4(process.pid, 0)
+            elapsed = time.perf_counter() - start
+            # ru_maxrss is in kB on linux
+            results[script] = {'time_s': elapsed, 'peak_memory_mb': usage.ru_maxrss / 1024, 'success': status == 0}
+            print(f'build {script}: {elapsed:.2f}s, {usage.ru_maxrss / 1024:.1f}MB')
+    return results
+
+def bench_power_flow(net, n_single, n_repeat, rng):
+    """
+    TARGET:
+        Return the latency, iterations and convergence of single pp.runpp calls and of repeated PowerFlowRunner steps
+    """
+    sgen_p, sgen_q, load_p, load_q = random_scenarios(net, max(n_single, n_repeat), rng)
+
+    # single: the full pandapower power flow, on a copy so the runner below starts from the setpoints of the case
+    single_net = deepcopy(net)
+    latency, iterations, converged = [], [], []
+    for k in range(n_single):
+        single_net.sgen['p_mw'], single_net.sgen['q_mvar'] = sgen_p[k], sgen_q[k]
+        single_net.load['p_mw'], single_net.load['q_mvar'] = load_p[k], load_q[k]
+        start = time.perf_counter()
+        try:
+            pp.runpp(single_net, max_iteration = 30)
+        except pp.LoadflowNotConverged:
+            pass
+        latency.append(time.perf_counter() - start)
+        converged.append(bool(single_net.converged))
+        iterations.append(int(single_net._ppc['iterations']) if single_net.converged else 30)
+
+    single = {'latency_s': summary(latency), 'iterations': summary(iterations), 'convergence_rate': float(np.mean(converged))}
+
+    # repeated: the runner with the cached Ybus and warm start
+    start = time.perf_counter()
+    runner = PowerFlowRunner(net)
+    setup = time.perf_counter() - start
+    Sbus = runner.Sbus(sgen_p[:n_repeat], sgen_q[:n_repeat], load_p[:n_repeat], load_q[:n_repeat])
+    latency, iterations, converged = [], [], []
+    V = runner.V_base
+    for k in range(n_repeat):
+        start = time.perf_counter()
+        V_k, converged_k, iteration = runner.solve(Sbus[k], V)
+        latency.append(time.perf_counter() - start)
+        iterations.append(iteration)
+        converged.append(bool(converged_k))
+        if converged_k:
+            V = V_k
+
+    repeated = {'setup_s': setup, 'latency_s': summary(latency), 'iterations': summary(iterations),
+                'convergence_rate': float(np.mean(converged))}
+    return {'bus_no': net.bus.shape[0], 'single': single, 'repeated': repeated}
+
+def bench_scaling(sizes, n_repeat, rng):
+    """
+    TARGET:
+        Return the generation time and power flow latency of synthetic networks with the target bus numbers
+    """
+    from generate_large_net import generate_network
+
+    LV_nets = [pp.from_pickle(f'lv_network/LV{i}.p') for i in range(6)]
+    bus322 = pp.from_pickle('bus322.p')
+    MV_load = bus322.load[bus322.bus.loc[bus322.load['bus'], 'vn_kv'].values == 20]
+    load_pool = MV_load[['p_mw', 'q_mvar']].values
+
+    results = []
+    for n_bus in sizes:
+        start = time.perf_counter()
+        net = generate_network(n_bus, no_bus_MV = 25, n_ccp = 10, seed = 0, LV_nets = LV_nets, load_pool = load_pool)
+        generation = time.perf_counter() - start
+
+        result = bench_power_flow(net, n_single = 3, n_repeat = n_repeat, rng = rng)
+        result.update({'target_bus_no': n_bus, 'generation_s': generation})
+        results.append(result)
+        print(f"scaling {net.bus.shape[0]} buses: generation {generation:.2f}s, "
+              f"step {1000 * result['repeated']['latency_s']['mean']:.2f}ms")
+    return results
+
+def environment():
+    from importlib import metadata
+    versions = {}
+    for lib in ['pandapower', 'pandas', 'numpy', 'scipy', 'networkx', 'simbench']:
+        try:
+            versions[lib] = metadata.version(lib)
+        except metadata.PackageNotFoundError:
+            versions[lib] = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'libraries': versions, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--build", action = 'store_true', help = "benchmark the generation scripts")
+    parser.add_argument("--scaling", type = int, nargs = '*', default = [], help = "target bus numbers of the scaling curve, e.g. 1000 3000 10000")
+    parser.add_argument("--single", type = int, default = 20, help = "number of single pp.runpp calls per case")
+    parser.add_argument("--repeat", type = int, default = 500, help = "number of repeated runner steps per case")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed of the scenarios")
+    parser.add_argument("--output", default = 'benchmark.json', help = "json result file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = {'environment': environment(), 'settings': vars(args)}
+
+    if args.build:
+        results['build'] = bench_build(BUILD_SCRIPTS)
+
+    results['power_flow'] = {}
+    for case in CASES:
+        results['power_flow'][case] = bench_power_flow(pp.from_pickle(f'{case}.p'), args.single, args.repeat, rng)
+        repeated = results['power_flow'][case]['repeated']
+        print(f"{case}: runpp {1000 * results['power_flow'][case]['single']['latency_s']['mean']:.2f}ms, "
+              f"runner step {1000 * repeated['latency_s']['mean']:.3f}ms, convergence {repeated['convergence_rate']:.3f}")
+
+    if args.scaling:
+        results['scaling'] = bench_scaling(args.scaling, args.repeat, rng)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 1)
+    print(f'results saved to {args.output}')
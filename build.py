@@ -0,0 +1,253 @@
+"""
+Incremental build of all the generated networks
+
+1. Each target lists its outputs, the source files it reads, the targets it depends on, its parameters and the libraries it uses.
+   The source files of a script are the repo modules it imports, followed recursively (script_inputs), so a new import is never missed.
+2. The key of a target is the hash of the source files, the outputs of its dependencies, the parameters, the command and the library versions.
+3. A target is rebuilt only when its key changed or an output is missing/modified, the keys are kept in .build/state.json.
+4. The html plots are optional targets (--html) which depend on the saved pickles, so they never force a rebuild of a network.
+
+The dependencies:
+    SimBench LV_list -> LV (lv_network/LV{i}.p, the feeders are generated in parallel by generate_lv_net.py) -> bus322
+    case33bw (pandapower) -> bus33bw
+    case141.mat -> bus141
+"""
+
+import os
+import ast
+import sys
+import json
+import hashlib
+import argparse
+import subprocess
+from importlib import metadata
+
+STATE_FILE = '.build/state.json'
+LV_NO = 6
+
+"""
+Targets
+"""
+
+def render_html(pickle_files, html_files):
+    """
+    TARGET:
+        Plot the saved networks to html
+    """
+    import pandapower as pp
+    for pickle_file, html_file in zip(pickle_files, html_files):
+        pp.plotting.to_html(pp.from_pickle(pickle_file), filename = html_file, show_tables=(False))
+
+def render_mv_html(html_file):
+    """
+    TARGET:
+        Plot the SimBench MV network whose loads are used in bus322
+    """
+    import pandapower as pp
+    from simbench_cache import get_simbench_net
+    MV_net = get_simbench_net('1-MV-rural--0-sw')
+    pp.runpp(MV_net)
+    pp.plotting.to_html(MV_net, filename = html_file, show_tables=(False))
+
+def script_inputs(script, data = ()):
+    """
+    TARGET:
+        Return the script, the repo modules it imports (recursively, including the imports inside functions) and the data files
+    """
+    inputs, todo = [], [script]
+    while todo:
+        path = todo.pop()
+        if path in inputs:
+            continue
+        inputs.append(path)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename = path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            todo += [f'{name}.py' for name in names if os.path.exists(f'{name}.py')]
+    return sorted(inputs) + list(data)
+
+def define_targets():
+    """
+    TARGET:
+        Return the build graph {name: target}
+        A target runs either a command (subprocess) or a python function with arguments
+    """
+    python = sys.executable
+    targets = {}
+    # one target for all the feeders: generate_lv_net.py runs them on its process pool
+    targets['LV'] = {'outputs': [f'lv_network/LV{i}.p' for i in range(LV_NO)],
+                     'inputs': script_inputs('generate_lv_net.py'),
+                     'deps': [],
+                     'params': {'index': list(range(LV_NO))},
+                     'libraries': ['pandapower', 'simbench', 'pandas', 'numpy', 'scipy'],
+                     'command': [python, 'generate_lv_net.py', '--index'] + [str(i) for i in range(LV_NO)] + ['--no_html']}
+    targets['bus322'] = {'outputs': ['bus322.p'],
+                         'inputs': script_inputs('bus322.py'),
+                         'deps': ['LV'],
+                         'params': {},
+                         'libraries': ['pandapower', 'simbench', 'pandas', 'numpy'],
+                         'command': [python, 'bus322.py', '--no_html']}
+    targets['bus33bw'] = {'outputs': ['bus33bw.p'],
+                          'inputs': script_inputs('bus33bw.py'),
+                          'deps': [],
+                          'params': {},
+                          'libraries': ['pandapower', 'pandas'],
+                          'command': [python, 'bus33bw.py', '--no_html']}
+    targets['bus141'] = {'outputs': ['bus141.p'],
+                         'inputs': script_inputs('bus141.py', ['case141.mat']),
+                         'deps': [],
+                         'params': {},
+                         'libraries': ['pandapower', 'pandas', 'numpy', 'networkx'],
+                         'command': [python, 'bus141.py', '--no_html']}
+
+    # optional html plots
+    for name in list(targets):
+        pickle_files = targets[name]['outputs']
+        html_files = [pickle_file[:-2] + '.html' for pickle_file in pickle_files]
+        targets[f'html:{name}'] = {'outputs': html_files,
+                                   'inputs': [],
+                                   'deps': [name],
+                                   'params': {},
+                                   'libraries': ['pandapower'],
+                                   'function': (render_html, (pickle_files, html_files)),
+                                   'optional': True}
+    targets['html:MV'] = {'outputs': ['MV.html'],
+                          'inputs': [],
+                          'deps': [],
+                          'params': {'MV': '1-MV-rural--0-sw'},
+                          'libraries': ['pandapower', 'simbench'],
+                          'function': (render_mv_html, ('MV.html',)),
+                          'optional': True}
+    return targets
+
+"""
+Functions
+"""
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def library_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+def target_key(name, target, state):
+    """
+    TARGET:
+        Return the content hash of everything the target depends on
+        The dependencies are hashed by the recorded hashes of their outputs
+    """
+    record = {'name': name,
+              'inputs': {path: file_hash(path) for path in target['inputs']},
+              'deps': {dep: state[dep]['outputs'] for dep in target['deps']},
+              'params': target['params'],
+              'command': target['command'][1:] if 'command' in target else target['function'][0].__name__,
+              'libraries': {lib: library_version(lib) for lib in target['libraries']},
+              'python': sys.version_info[:2]}
+    return hashlib.sha256(json.dumps(record, sort_keys = True).encode()).hexdigest()
+
+def is_stale(target, key, record):
+    if record is None or record['key'] != key:
+        return True
+    for path in target['outputs']:
+        if not os.path.exists(path) or file_hash(path) != record['outputs'].get(path):
+            return True
+    return False
+
+def build_order(targets, names):
+    """
+    TARGET:
+        Return the requested targets and their dependencies in topological order
+    """
+    order, visited = [], set()
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+        for dep in targets[name]['deps']:
+            visit(dep)
+        order.append(name)
+    for name in names:
+        visit(name)
+    return order
+
+def run_target(target):
+    if 'command' in target:
+        subprocess.run(target['command'], check = True)
+    else:
+        function, args = target['function']
+        function(*args)
+
+def build(names, force = False, dry_run = False):
+    """
+    TARGET:
+        Rebuild the stale targets in names (and their dependencies), return the list of the rebuilt targets
+    """
+    targets = define_targets()
+    state = {}
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+
+    rebuilt = []
+    for name in build_order(targets, names):
+        target = targets[name]
+        # a dependency which was never built by this script is recorded by its current outputs
+        for dep in target['deps']:
+            if dep not in state:
+                state[dep] = {'key': None, 'outputs': {path: file_hash(path) for path in targets[dep]['outputs'] if os.path.exists(path)}}
+        key = target_key(name, target, state)
+        # in a dry run a stale dependency is not rebuilt, so its dependents would be hashed against its old outputs
+        dep_stale = dry_run and any(dep in rebuilt for dep in target['deps'])
+        if not force and not dep_stale and not is_stale(target, key, state.get(name)):
+            print(f'{name}: up to date')
+            continue
+
+        print(f"{name}: {'stale' if dry_run else 'building'}")
+        rebuilt.append(name)
+        if dry_run:
+            continue
+        run_target(target)
+        state[name] = {'key': key, 'outputs': {path: file_hash(path) for path in target['outputs']}}
+
+        # save after each target, so an interrupted build keeps the finished ones
+        os.makedirs(os.path.dirname(STATE_FILE), exist_ok = True)
+        with open(STATE_FILE, 'w') as f:
+            json.dump(state, f, indent = 1)
+
+    return rebuilt
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs = '*', help = "targets to build, default: all the networks")
+    parser.add_argument("--html", action = 'store_true', help = "also build the html plots")
+    parser.add_argument("--force", action = 'store_true', help = "rebuild even if up to date")
+    parser.add_argument("--dry_run", action = 'store_true', help = "only print the stale targets")
+    args = parser.parse_args()
+
+    targets = define_targets()
+    names = args.targets or [name for name in targets if not targets[name].get('optional')]
+    if args.html:
+        names = names + [f'html:{name}' for name in names if f'html:{name}' in targets]
+        if 'bus322' in names:
+            names.append('html:MV')
+
+    rebuilt = build(names, force = args.force, dry_run = args.dry_run)
+    print(f"{len(rebuilt)} target(s) {'stale' if args.dry_run else 'rebuilt'}: {rebuilt}")
@@ -3,14 +3,17 @@ Modify bus141 from pandapower
 test on pandapower version: 2.9.0
 """
 
+import argparse
 import pandapower as pp
 from pandapower import networks, plotting
-import networkx as nx
-import pandapower.topology as top
-import numpy as np
+from validate import validate_network
 
 print(f'pandapower version: {pp.__version__}')
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--no_html", action = 'store_true', help = "do not plot the network to html")
+args = parser.parse_args()
+
 # load default case
 net = pp.converter.from_mpc('case141.mat', f_hz=50, casename_mpc_file='case141', validate_conversion=False)
 net.ext_grid['max_p_mw'] = 100 # add some limits in case we want to run opf, dont need it for pf
@@ -53,24 +56,6 @@ net.bus.loc[main_index, 'zone'] = 'main'
 net.bus.loc[1:,'max_vm_pu'] = 1.05
 net.bus.loc[1:,'min_vm_pu'] = 0.95
 
-bus = net.bus
-line = net.line
-# check connectivity: the buses in a zone should at least connected to a bus in the same zone
-mg = top.create_nxgraph(net)
-incidence_matrix = nx.incidence_matrix(mg).toarray().T # incidence matrix
-
-for i in range(incidence_matrix.shape[0]):
-    # read branch and bus
-    bus_pair = np.nonzero(incidence_matrix[i])[0]
-    flag = 0
-    bus1_zone = net.bus['zone'].iloc[bus_pair[0]]
-    bus2_zoen = net.bus['zone'].iloc[bus_pair[1]]
-    
-    if (bus1_zone == 'main' and bus1_zone != 'main') or (bus1_zone != 'main' and bus1_zone == 'main') or (bus1_zone == bus1_zone):
-        pass
-    else:
-        print('wrong connection!!')
-        
 # set the sgen at the PV_bus_index
 # we define new PVs in bus141 system
 for i in range(1,len(PV_bus_index)+1):
@@ -83,7 +68,12 @@ sgen = net.sgen
 load = net.load
 ext_grid = net.ext_grid
 
+# check the topology, the zones and the sgens
+for issue in validate_network(net):
+    print(f'wrong network: {issue}')
+
 # save net
 pp.to_pickle(net, "bus141.p")  # relative path
-plotting.to_html(net,filename='bus141.html', show_tables=(False))
+if not args.no_html:
+    plotting.to_html(net,filename='bus141.html', show_tables=(False))
 # %%
@@ -3,11 +3,16 @@ Modify bus33bw from pandapower
 test on pandapower version: 2.9.0
 """
 
+import argparse
 import pandapower as pp
 from pandapower import networks, plotting
 
 print(f'pandapower version: {pp.__version__}')
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--no_html", action = 'store_true', help = "do not plot the network to html")
+args = parser.parse_args()
+
 # Load default network
 net = networks.case33bw()
 net.ext_grid['max_p_mw'] = 100 # add some limits in case we want to run opf, dont need it for pf
@@ -74,6 +79,7 @@ ext_grid = net.ext_grid
 
 # save net
 pp.to_pickle(net, "bus33bw.p") 
-plotting.to_html(net,filename='bus33bw.html', show_tables=(False))
+if not args.no_html:
+    plotting.to_html(net,filename='bus33bw.html', show_tables=(False))
 
 
@@ -0,0 +1,204 @@
+"""
+Memory-compact network instances: one shared read-only network and small per-instance state
+
+1. SharedNetwork holds everything which does not change between the instances: the tables with the string columns (name, zone, type, ...)
+   as pandas categoricals, the ppc/Ybus of a PowerFlowRunner and the zone index. Its arrays are marked read-only.
+2. NetworkState is one instance: the sgen/load setpoints start as the shared defaults and are only copied on their first write (copy-on-write),
+   the results (vm_pu, va_degree, loading_percent) and the warm-start voltage are per-instance arrays.
+3. StateBatch keeps the setpoints and results of n instances in dense (n x n_sgen/n_load/n_bus) blocks, each NetworkState of the batch is a row view,
+   so the memory of an extra instance is a few vectors of the size of the injections and results instead of a deep copy of the net.
+"""
+
+import numpy as np
+from power_flow import PowerFlowRunner
+from zone_index import ZoneIndex
+
+TABLES = ['bus', 'line', 'trafo', 'load', 'sgen', 'ext_grid']
+SETPOINTS = ['sgen_p', 'sgen_q', 'load_p', 'load_q']
+
+"""
+Functions
+"""
+
+def compact_table(table):
+    """
+    TARGET:
+        Return a copy of the table with the object columns as categoricals
+    """
+    table = table.copy()
+    for column in table.columns:
+        if table[column].dtype == object:
+            table[column] = table[column].astype('category')
+    return table
+
+def freeze(array):
+    """
+    TARGET:
+        Mark a numpy array read-only (the shared arrays must not be changed by an instance)
+    """
+    array = np.asarray(array)
+    array.flags.writeable = False
+    return array
+
+def table_nbytes(table):
+    return int(table.memory_usage(index = True, deep = True).sum())
+
+"""
+Shared network
+"""
+
+class SharedNetwork:
+    """
+    TARGET:
+        The immutable part of a network shared by all its instances
+    """
+    def __init__(self, net, **kwargs):
+        self.tables = {table: compact_table(net[table]) for table in TABLES}
+        self.runner = PowerFlowRunner(net, **kwargs)
+        self.runner.net = None    # the pandapower net is not kept
+        self.index = ZoneIndex.from_net(net)
+        self.defaults = {name: freeze(getattr(self.runner, name)) for name in SETPOINTS}
+        self.V_base = freeze(self.runner.V_base)
+        self.n_bus = len(self.runner.bus_ppc)
+        self.n_line = len(self.runner.line_i_max_ka)
+
+    def state(self):
+        return NetworkState(self)
+
+    def batch(self, n):
+        return StateBatch(self, n)
+
+    def nbytes(self):
+        return sum(table_nbytes(table) for table in self.tables.values()) + self.runner.Ybus.data.nbytes
+
+"""
+Instances
+"""
+
+class NetworkState:
+    """
+    TARGET:
+        One instance of a SharedNetwork: copy-on-write setpoints, per-instance results and warm start
+        buffers: optional dict of writable arrays (row views of a StateBatch) used instead of new allocations
+    """
+    __slots__ = ['shared', 'setpoints', 'buffers', 'V', 'vm_pu', 'va_degree', 'loading_percent', 'converged']
+
+    def __init__(self, shared, buffers = None):
+        self.shared = shared
+        self.buffers = {} if buffers is None else buffers
+        self.reset()
+        self.vm_pu = self.buffers.get('vm_pu')
+        self.va_degree = self.buffers.get('va_degree')
+        self.loading_percent = self.buffers.get('loading_percent')
+        self.converged = False
+
+    def __getitem__(self, name):
+        return self.setpoints[name]
+
+    def __setitem__(self, name, values):
+        """
+        TARGET:
+            Write a setpoint (sgen_p, sgen_q, load_p, load_q), the shared default is copied on the first write
+        """
+        array = self.setpoints[name]
+        if array is self.shared.defaults[name]:
+            array = self.shared.defaults[name].copy()
+            self.setpoints[name] = array
+        array[:] = values
+
+    def reset(self):
+        """
+        TARGET:
+            Return to the default setpoints and the base warm start
+            Without buffers, the setpoints point to the shared defaults until they are written
+        """
+        self.setpoints = {}
+        for name, default in self.shared.defaults.items():
+            buffer = self.buffers.get(name)
+            if buffer is not None:
+                buffer[:] = default
+                self.setpoints[name] = buffer
+            else:
+                self.setpoints[name] = default
+        self.V = self.shared.V_base
+
+    def solve(self):
+        """
+        TARGET:
+            Solve the power flow of the instance, warm-started from its last converged solution
+        """
+        runner = self.shared.runner
+        setpoints = self.setpoints
+        Sbus = runner.Sbus(setpoints['sgen_p'], setpoints['sgen_q'], setpoints['load_p'], setpoints['load_q'])
+        V, converged, _ = runner.solve(Sbus, self.V)
+        if converged:
+            self.V = V
+        if self.vm_pu is None:
+            self.vm_pu = np.empty(self.shared.n_bus)
+            self.va_degree = np.empty(self.shared.n_bus)
+            self.loading_percent = np.empty(self.shared.n_line)
+        self.vm_pu[:] = np.abs(V[runner.bus_ppc])
+        self.va_degree[:] = np.angle(V[runner.bus_ppc], deg = True)
+        self.loading_percent[:] = runner.line_loading(V)
+        self.converged = converged
+        return converged
+
+class StateBatch:
+    """
+    TARGET:
+        n instances of a SharedNetwork with their setpoints and results in dense blocks (instance x element)
+    """
+    def __init__(self, shared, n):
+        self.shared = shared
+        self.blocks = {name: np.empty((n, len(shared.defaults[name]))) for name in SETPOINTS}
+        self.blocks['vm_pu'] = np.empty((n, shared.n_bus))
+        self.blocks['va_degree'] = np.empty((n, shared.n_bus))
+        self.blocks['loading_percent'] = np.empty((n, shared.n_line))
+        # the setpoints and results of each state are the rows of the blocks
+        self.states = [NetworkState(shared, {name: block[i] for name, block in self.blocks.items()}) for i in range(n)]
+
+    def __len__(self):
+        return len(self.states)
+
+    def __getitem__(self, i):
+        return self.states[i]
+
+    def solve(self):
+        """
+        TARGET:
+            Solve all the instances, return the convergence flags
+        """
+        return np.array([state.solve() for state in self.states])
+
+    def nbytes(self):
+        return sum(block.nbytes for block in self.blocks.values()) + sum(state.V.nbytes for state in self.states)
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pickle
+    import pandapower as pp
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name under test")
+    parser.add_argument("--instances", type = int, default = 1000, help = "number of instances")
+    args = parser.parse_args()
+
+    net = pp.from_pickle(f'{args.bus}.p')
+    net_bytes = len(pickle.dumps(net))
+    shared = SharedNetwork(net)
+    batch = shared.batch(args.instances)
+
+    rng = np.random.default_rng(0)
+    for state in batch:
+        state['sgen_p'] = shared.defaults['sgen_p'] * rng.uniform(0, 1)
+    start = time.time()
+    converged = batch.solve()
+    print(f'{args.instances} instances solved in {time.time() - start:.2f}s, converged: {converged.sum()}')
+    print(f'shared network: {shared.nbytes() / 1e6:.2f} MB, per instance: {batch.nbytes() / args.instances / 1e3:.1f} kB '
+          f'(pickled net: {net_bytes / 1e3:.1f} kB per copy)')
@@ -0,0 +1,190 @@
+"""
+Compose a large network by attaching low-voltage feeders (lv_network/LV*.p) to a mid-voltage backbone
+
+1. The LV buses are renumbered after the buses of the backbone by a lookup array, the higher voltage side bus of the LV transformer is dropped.
+2. The zones (and the sgen names) of each LV feeder are shifted after the zones already in the network.
+3. Each LV feeder is connected to its coupling point (ccp) on the backbone by a 20kV/0.4kV transformer.
+4. The lines with tiny impedance are lengthened so that r and x are not close to 0 (one of the tests in pp.diagnostic).
+5. The loads at the same bus are merged.
+All the tables are concatenated once at the end, so the composition is linear in the number of feeders.
+"""
+
+import numpy as np
+import pandas as pd
+import pandapower as pp
+from copy import deepcopy
+from profiling import span, timed
+
+"""
+Functions
+"""
+
+def zone_number(zone):
+    """
+    TARGET:
+        Return the mask of the names in the form of zone{K} and the number K of these names
+    """
+    zone = pd.Series(zone).astype(str)
+    is_zone = zone.str.match(r'^zone\d+$').values
+    return is_zone, zone[is_zone].str[4:].astype(int).values
+
+def zone_count(zone):
+    """
+    TARGET:
+        Return the number of distinct zone{K} names
+    """
+    is_zone, _ = zone_number(zone)
+    return len(set(np.asarray(zone)[is_zone]))
+
+def next_index(table):
+    """
+    TARGET:
+        Return the first free index of a pandapower table
+    """
+    return table.index.max() + 1 if table.shape[0] > 0 else 0
+
+def shift_zone(zone, offset):
+    """
+    TARGET:
+        Return the zone names with zone{K} replaced by zone{K+offset}, other names (e.g. main) are unchanged
+    """
+    zone = pd.Series(zone).astype(object).values.copy()
+    is_zone, number = zone_number(zone)
+    zone[is_zone] = [f'zone{i}' for i in number + offset]
+    return zone
+
+def clamp_impedance(line, min_ohm = 0.001, target_ohm = 0.002):
+    """
+    TARGET:
+        Lengthen the lines whose resistance or reactance is below min_ohm, so that both are at least target_ohm
+    """
+    length = line['length_km'].values
+    r = line['r_ohm_per_km'].values
+    x = line['x_ohm_per_km'].values
+    short = (length * r < min_ohm) | (length * x < min_ohm)
+    line['length_km'] = np.where(short, np.maximum(target_ohm / r, target_ohm / x), length)
+    return line
+
+def merge_load(load):
+    """
+    TARGET:
+        Combine all the loads at a bus: the p_mw and q_mvar are summed, the other columns are taken from the first load
+        The merged loads are sorted by bus and reindexed from 0
+    """
+    grouped = load.groupby('bus', sort = True)
+    merged = grouped.first()
+    merged[['p_mw', 'q_mvar']] = grouped[['p_mw', 'q_mvar']].sum()
+    merged = merged.reset_index()[load.columns]
+    return merged
+
+@timed()
+def compose_network(mv_backbone, lv_feeders, ccp, trafo_std_type = "0.4 MVA 20/0.4 kV", trafo_sn_mva = 5, combine_load = True):
+    """
+    TARGET:
+        Return a new network with lv_feeders[i] connected to the backbone bus ccp[i]
+        The backbone is not modified
+    """
+    assert len(lv_feeders) == len(ccp), 'each LV feeder needs one coupling point'
+    net = deepcopy(mv_backbone)
+
+    bus_offset = next_index(net.bus)
+    line_offset = next_index(net.line)
+    load_offset = next_index(net.load)
+    sgen_offset = next_index(net.sgen)
+    zone_offset = zone_count(net.bus['zone'].values)
+
+    bus_frames, line_frames, load_frames, sgen_frames = [], [], [], []
+    trafo_lv_bus = []
+    for LV_net in lv_feeders:
+        with span('attach_lv'):
+            # renumber the buses: drop the higher voltage side of the transformer
+            LV_bus = LV_net.bus
+            keep = ~LV_bus.index.isin(LV_net.trafo['hv_bus'].values)
+            lookup = np.full(LV_bus.index.max() + 1, -1, dtype = int)
+            lookup[LV_bus.index.values[keep]] = bus_offset + np.arange(keep.sum())
+
+            append_bus = LV_bus[keep].copy(deep = True)
+            append_bus.index = pd.Index(lookup[append_bus.index.values])
+            append_bus['name'] = 'LV bus'
+            append_bus['type'] = 'n'
+            append_bus['min_vm_pu'] = 0.95
+            append_bus['max_vm_pu'] = 1.05
+            append_bus['zone'] = shift_zone(append_bus['zone'], zone_offset)
+            bus_frames.append(append_bus[['name', 'vn_kv', 'type', 'zone', 'in_service', 'min_vm_pu', 'max_vm_pu']])
+
+            trafo_lv_bus.append(lookup[LV_net.trafo['lv_bus'].values[0]])
+
+            append_line = clamp_impedance(LV_net.line.copy(deep = True))
+            append_line['from_bus'] = lookup[append_line['from_bus'].values]
+            append_line['to_bus'] = lookup[append_line['to_bus'].values]
+            append_line['name'] = 'LV_line'
+            append_line.index = pd.Index(line_offset + np.arange(append_line.shape[0]))
+            line_frames.append(append_line)
+
+            append_load = LV_net.load.copy(deep = True)
+            append_load['bus'] = lookup[append_load['bus'].values]
+            append_load['name'] = 'LV_load'
+            append_load.index = pd.Index(load_offset + np.arange(append_load.shape[0]))
+            load_frames.append(append_load.reindex(columns = net.load.columns))
+
+            append_sgen = LV_net.sgen.copy(deep = True)
+            append_sgen['bus'] = lookup[append_sgen['bus'].values]
+            append_sgen['name'] = shift_zone(append_sgen['name'], zone_offset)
+            append_sgen.index = pd.Index(sgen_offset + np.arange(append_sgen.shape[0]))
+            sgen_frames.append(append_sgen)
+
+            # update the cumulation
+            bus_offset += keep.sum()
+            line_offset += append_line.shape[0]
+            load_offset += append_load.shape[0]
+            sgen_offset += append_sgen.shape[0]
+            zone_offset += zone_count(LV_bus['zone'].values[keep])
+
+    net.bus = pd.concat([net.bus] + bus_frames)
+    net.line = pd.concat([net.line] + line_frames)
+    net.load = pd.concat([net.load] + load_frames)
+    net.load['sn_mva'] = np.nan
+    net.sgen = pd.concat([net.sgen] + sgen_frames)
+    net.sgen['sn_mva'] = np.nan
+
+    # transformers: create the first one by the std_type and copy it for the others
+    if len(lv_feeders) > 0:
+        first = pp.create_transformer(net, ccp[0], trafo_lv_bus[0], name = "20kV/0.4kV transformer", std_type = trafo_std_type)
+        append_trafo = net.trafo.loc[[first] * len(lv_feeders)].copy()
+        append_trafo['hv_bus'] = np.asarray(ccp, dtype = int)
+        append_trafo['lv_bus'] = np.asarray(trafo_lv_bus, dtype = int)
+        # increase the transformer rated power to cope the large PV penetration
+        append_trafo['sn_mva'] = trafo_sn_mva
+        append_trafo.index = pd.Index(first + np.arange(len(lv_feeders)))
+        net.trafo = pd.concat([net.trafo.drop(first), append_trafo])
+
+    if combine_load:
+        net.load = merge_load(net.load)
+
+    return net
+
+def clean_network(net, ext_grid_limit = 1000):
+    """
+    TARGET:
+        Clean the tables of a composed network and prepare it for opf
+        The sgens are controllable with the same poly cost as the ext_grid, so the opf is actually minimizing the power loss
+    """
+    net.ext_grid['max_p_mw'] = ext_grid_limit
+    net.ext_grid['min_p_mw'] = -ext_grid_limit
+    net.ext_grid['max_q_mvar'] = ext_grid_limit
+    net.ext_grid['min_q_mvar'] = -ext_grid_limit
+    net.load = net.load[['name','bus','p_mw','q_mvar','const_z_percent','const_i_percent','scaling','in_service','type']]
+    net.load['controllable'] = False # the load is not controllable
+    net.sgen = net.sgen[['name','bus','p_mw','q_mvar','scaling','max_p_mw','min_p_mw','max_q_mvar','min_q_mvar','in_service']]
+    net.sgen['controllable'] = True
+
+    # poly cost: create the first sgen cost and copy it for the others
+    pp.create_poly_cost(net, net.ext_grid.index[0], 'ext_grid', 1)
+    if net.sgen.shape[0] > 0:
+        first = pp.create_poly_cost(net, net.sgen.index[0], 'sgen', 1)
+        append_cost = net.poly_cost.loc[[first] * net.sgen.shape[0]].copy()
+        append_cost['element'] = net.sgen.index.values
+        append_cost.index = pd.Index(first + np.arange(net.sgen.shape[0]))
+        net.poly_cost = pd.concat([net.poly_cost.drop(first), append_cost])
+
+    return net
@@ -0,0 +1,142 @@
+"""
+Resumable sharded dataset of power flow samples (PV/load injections -> bus voltages) for surrogate models
+
+1. The samples are random scenarios around the sgen capacities and base loads of a case (scenarios.random_scenarios).
+2. The dataset is split into shards of shard_size samples, shard k is sampled from the random generator seeded by (seed, k),
+   so any shard can be (re)generated alone and gives the same samples.
+3. Each worker of a process pool loads the network once, solves its shards by PowerFlowRunner and writes them as npz files (float32 columns).
+4. A shard is written to a temporary file and renamed, then recorded in manifest.json (also replaced atomically),
+   so a crashed job restarted with the same arguments only generates the shards missing in the manifest.
+"""
+
+import os
+import json
+import time
+import numpy as np
+import pandapower as pp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from power_flow import PowerFlowRunner
+from scenarios import random_scenarios
+from atomic_file import write_atomic
+
+FORMAT_VERSION = 1
+COLUMNS = ['sgen_p', 'sgen_q', 'load_p', 'load_q', 'vm_pu', 'va_degree', 'converged']
+
+"""
+Functions
+"""
+
+def shard_name(k):
+    return f'shard_{k:06d}.npz'
+
+def load_manifest(out_dir, params):
+    """
+    TARGET:
+        Return the manifest of the dataset directory, a new one if there is none
+        Raise an error if the existing dataset was generated with other parameters
+    """
+    path = os.path.join(out_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {'format_version': FORMAT_VERSION, 'params': params, 'columns': COLUMNS, 'shards': {}}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest['params'] != params:
+        raise ValueError(f"{out_dir} was generated with {manifest['params']}, not {params}")
+    # only the recorded shards whose file exists are complete
+    manifest['shards'] = {k: shard for k, shard in manifest['shards'].items() if os.path.exists(os.path.join(out_dir, shard['file']))}
+    return manifest
+
+def save_manifest(out_dir, manifest):
+    write_atomic(os.path.join(out_dir, 'manifest.json'), lambda f: f.write(json.dumps(manifest, indent = 1).encode()))
+
+"""
+Workers
+"""
+
+WORKER = {}
+
+def init_worker(case):
+    net = pp.from_pickle(f'{case}.p')
+    WORKER['net'] = net
+    WORKER['runner'] = PowerFlowRunner(net)
+
+def generate_shard(out_dir, k, n_sample, seed):
+    """
+    TARGET:
+        Sample, solve and write shard k, return its record for the manifest
+    """
+    start = time.perf_counter()
+    rng = np.random.default_rng([seed, k])
+    sgen_p, sgen_q, load_p, load_q = random_scenarios(WORKER['net'], n_sample, rng)
+    vm_pu, va_degree, converged = WORKER['runner'].run(sgen_p, sgen_q, load_p, load_q)
+
+    data = {'sgen_p': sgen_p, 'sgen_q': sgen_q, 'load_p': load_p, 'load_q': load_q, 'vm_pu': vm_pu, 'va_degree': va_degree}
+    data = {name: value.astype(np.float32) for name, value in data.items()}
+    data['converged'] = converged
+    write_atomic(os.path.join(out_dir, shard_name(k)), lambda f: np.savez(f, **data))
+    return {'file': shard_name(k), 'samples': n_sample, 'converged': int(converged.sum()), 'time': time.perf_counter() - start}
+
+"""
+Dataset
+"""
+
+def generate_dataset(case, out_dir, n_samples, shard_size = 10000, seed = 0, n_workers = None, log_every = 10):
+    """
+    TARGET:
+        Generate (or resume) the dataset of n_samples of the saved network case in out_dir
+        Return the manifest
+    """
+    os.makedirs(out_dir, exist_ok = True)
+    params = {'case': case, 'n_samples': n_samples, 'shard_size': shard_size, 'seed': seed}
+    manifest = load_manifest(out_dir, params)
+    n_shard = -(-n_samples // shard_size)
+    todo = [k for k in range(n_shard) if str(k) not in manifest['shards']]
+    print(f'{case}: {n_shard - len(todo)}/{n_shard} shards done, {len(todo)} to generate')
+    if len(todo) == 0:
+        return manifest
+
+    n_workers = n_workers or os.cpu_count()
+    start = time.time()
+    n_done = 0
+    with ProcessPoolExecutor(n_workers, initializer = init_worker, initargs = (case,)) as executor:
+        futures = {executor.submit(generate_shard, out_dir, k, min(shard_size, n_samples - k * shard_size), seed): k for k in todo}
+        for i, future in enumerate(as_completed(futures)):
+            manifest['shards'][str(futures[future])] = future.result()
+            save_manifest(out_dir, manifest)
+            n_done += manifest['shards'][str(futures[future])]['samples']
+            if (i + 1) % log_every == 0 or i + 1 == len(todo):
+                rate = n_done / (time.time() - start)
+                print(f'{i + 1}/{len(todo)} shards, {rate:.0f} samples/s ({rate / n_workers:.0f} per core)')
+    return manifest
+
+def load_dataset(out_dir, columns = COLUMNS):
+    """
+    TARGET:
+        Yield the columns of each completed shard in the shard order
+    """
+    with open(os.path.join(out_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    for k in sorted(manifest['shards'], key = int):
+        with np.load(os.path.join(out_dir, manifest['shards'][k]['file'])) as shard:
+            yield {name: shard[name] for name in columns}
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name under test")
+    parser.add_argument("--samples", type = int, default = 100000, help = "number of samples")
+    parser.add_argument("--shard_size", type = int, default = 10000, help = "samples per shard")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes")
+    parser.add_argument("--output", default = None, help = "dataset directory (default dataset_<bus>)")
+    args = parser.parse_args()
+
+    manifest = generate_dataset(args.bus, args.output or f'dataset_{args.bus}', args.samples, args.shard_size, args.seed, args.workers)
+    shards = manifest['shards'].values()
+    print(f"{sum(shard['samples'] for shard in shards)} samples, converged: {sum(shard['converged'] for shard in shards)}")
@@ -0,0 +1,257 @@
+"""
+Zone-decomposed power flow: the main trunk and the zone subtrees are solved as separate problems which only exchange boundary values
+
+1. Every control zone (zone{K}) is a subtree attached to one bus of main (the attachment bus, e.g. the LV side of a ccp transformer in bus322).
+2. Zone problem: the zone buses with the attachment bus as its slack bus at the boundary voltage given by main,
+   its Ybus is the exact rows of the zone buses (all their branches are inside the zone or go to the attachment bus).
+3. Main problem: the buses outside the control zones, the attachment branches are removed from the Ybus and replaced by
+   the boundary power drawn by each zone at its attachment bus.
+4. Boundary iteration: solve main -> solve all the zones at their boundary voltage (concurrently) -> update the boundary powers,
+   until the boundary powers change by less than the tolerance. Each problem is a Newton-Raphson warm-started by its last solution.
+5. The zones run on a thread pool by default (parallel = 'thread', no copies, the sparse solves overlap but the jacobian assembly holds the GIL)
+   or a process pool (parallel = 'process', the zone data is sent once to each worker by the initializer, then only the zone injections and voltages of each iteration),
+   which only pays off when the zones are large enough to outweigh that per-iteration transfer.
+6. The pool is shut down by close(), at the end of a with block, or when the solver is garbage collected.
+The size of each problem is the main trunk or one zone, so the solve time follows the largest zone instead of the total number of buses.
+The PV buses inside a zone keep their voltage control (the pv/pq split of the runner is carried into each zone problem).
+"""
+
+import os
+import weakref
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from scipy.sparse import diags
+from pandapower.pypower.idx_brch import F_BUS, T_BUS, BR_STATUS
+from power_flow import newton, mismatch, branch_admittance
+from radial_sweep import radial_tree
+from compose import zone_number
+
+"""
+Zone problems
+"""
+
+def solve_zone(zone, Sbus_zone, V_zone, max_iteration, tolerance_mva):
+    """
+    TARGET:
+        Solve one zone (injection and voltage of [attach, zone buses]) at the boundary voltage V_zone[0]
+        Return the zone voltage, the power drawn at the boundary and the convergence flag
+    """
+    V_zone, converged, _ = newton(zone['Ybus'], Sbus_zone, V_zone, zone['pvpq'], zone['pq'], max_iteration, tolerance_mva)
+    S_boundary = V_zone[0] * np.conj(zone['Ypp'] * V_zone[0] + zone['Ypc'] * V_zone[zone['top_position']])
+    return V_zone[1:], S_boundary, converged
+
+WORKER = {}
+
+def init_worker(zones, max_iteration, tolerance_mva):
+    WORKER['zones'] = zones
+    WORKER['max_iteration'] = max_iteration
+    WORKER['tolerance_mva'] = tolerance_mva
+
+def solve_zone_worker(k, Sbus_zone, V_zone):
+    return solve_zone(WORKER['zones'][k], Sbus_zone, V_zone, WORKER['max_iteration'], WORKER['tolerance_mva'])
+
+"""
+Solver
+"""
+
+class DecomposedPowerFlow:
+    """
+    TARGET:
+        Zone-decomposed power flow on the ppc of a PowerFlowRunner (the same injection columns and bus order)
+        bus_zone: the zone of each row of net.bus
+    """
+    def __init__(self, runner, bus_zone, n_workers = None, max_outer = 50, parallel = 'thread'):
+        self.runner = runner
+        self.max_outer = max_outer
+        self.parallel = parallel
+        if parallel not in ('process', 'thread'):
+            raise ValueError(f'unknown parallel {parallel}, use process or thread')
+
+        ppc = runner.ppc
+        Ybus = runner.Ybus
+        n_bus = Ybus.shape[0]
+        root = int(runner.ref[0])
+        branch = np.asarray(ppc['branch'])
+        branch = branch[branch[:, BR_STATUS].real > 0]
+        f_bus = branch[:, F_BUS].real.astype(int)
+        t_bus = branch[:, T_BUS].real.astype(int)
+        Yff, Yft, Ytf, Ytt = branch_admittance(branch)
+        _, parent, parent_branch = radial_tree(f_bus, t_bus, n_bus, root)
+
+        # zone code of each ppc bus, -1 for main (and the labels which are not control zones)
+        zone = np.asarray(bus_zone).astype(str)
+        names = sorted(set(zone[zone_number(zone)[0]]))
+        code = np.full(n_bus, -1, dtype = int)
+        for k, name in enumerate(names):
+            code[runner.bus_ppc[zone == name]] = k
+
+        self.main = np.nonzero(code < 0)[0]
+        position = np.full(n_bus, -1, dtype = int)
+        position[self.main] = np.arange(len(self.main))
+        Y_main_correction = np.zeros(len(self.main), dtype = complex)
+
+        self.zones = []
+        for k, name in enumerate(names):
+            buses = np.nonzero(code == k)[0]
+            if root in buses:
+                raise ValueError(f'{name} contains the slack bus')
+            top = buses[code[parent[buses]] != k]
+            if len(top) != 1 or code[parent[top[0]]] >= 0:
+                raise ValueError(f'{name} is not one subtree attached to main')
+            top = top[0]
+            attach = parent[top]
+
+            # the attachment branch seen from the attachment bus (p) to the top bus of the zone (c)
+            b = parent_branch[top]
+            Ypp, Ypc = (Yff[b], Yft[b]) if f_bus[b] == attach else (Ytt[b], Ytf[b])
+            Y_main_correction[position[attach]] += Ypp
+
+            # the attachment bus is the slack of the zone, the other buses keep their pv/pq type
+            index = np.r_[attach, buses]
+            is_pq = np.isin(buses, runner.pq)
+            self.zones.append({'name': name, 'attach': attach, 'attach_main': position[attach], 'top': top, 'buses': buses,
+                               'index': index, 'Ybus': Ybus[index][:, index].tocsr(),
+                               'pvpq': np.r_[1 + np.nonzero(~is_pq)[0], 1 + np.nonzero(is_pq)[0]], 'pq': 1 + np.nonzero(is_pq)[0],
+                               'top_position': 1 + np.searchsorted(buses, top),
+                               'Ypp': Ypp, 'Ypc': Ypc})
+
+        # main: the attachment branches are removed, the zones are loads at their attachment buses
+        self.Y_main = (Ybus[self.main][:, self.main] - diags(Y_main_correction)).tocsr()
+        in_main = code < 0
+        self.main_pv = position[runner.pv[in_main[runner.pv]]]
+        self.main_pq = position[runner.pq[in_main[runner.pq]]]
+        self.main_pvpq = np.r_[self.main_pv, self.main_pq]
+
+        if parallel == 'process':
+            self.executor = ProcessPoolExecutor(n_workers, initializer = init_worker,
+                                                initargs = (self.zones, runner.max_iteration, runner.tolerance_mva))
+            self.chunksize = max(1, len(self.zones) // (4 * (n_workers or os.cpu_count())))
+        else:
+            self.executor = ThreadPoolExecutor(n_workers)
+        # the pool is shut down even if close is never called
+        self.finalizer = weakref.finalize(self, self.executor.shutdown, wait = False)
+
+    def solve_zones(self, Sbus, V):
+        """
+        TARGET:
+            Solve all the zones at the boundary voltages of V, return the list of (zone voltage, boundary power, convergence flag)
+        """
+        runner = self.runner
+        if self.parallel == 'process':
+            Sbus_zones = [Sbus[zone['index']] for zone in self.zones]
+            V_zones = [V[zone['index']] for zone in self.zones]
+            return list(self.executor.map(solve_zone_worker, range(len(self.zones)), Sbus_zones, V_zones, chunksize = self.chunksize))
+        return list(self.executor.map(lambda zone: solve_zone(zone, Sbus[zone['index']], V[zone['index']], runner.max_iteration, runner.tolerance_mva),
+                                      self.zones))
+
+    def solve(self, Sbus, V0 = None):
+        """
+        TARGET:
+            Solve one power flow (bus injection in p.u., ppc order) by the boundary iteration
+            Return the complex voltage, the convergence flag and the number of boundary iterations
+        """
+        runner = self.runner
+        V = np.array(runner.V_base if V0 is None else V0, dtype = complex)
+        # first guess of the boundary powers: the zone loads without losses
+        boundary = np.array([-Sbus[zone['buses']].sum() for zone in self.zones])
+        attach_main = np.array([zone['attach_main'] for zone in self.zones], dtype = int)
+
+        outer = 0
+        converged = False
+        while outer < self.max_outer:
+            outer += 1
+            S_main = Sbus[self.main].copy()
+            np.subtract.at(S_main, attach_main, boundary)
+            V_main, main_converged, _ = newton(self.Y_main, S_main, V[self.main], self.main_pvpq, self.main_pq,
+                                               runner.max_iteration, runner.tolerance_mva)
+            V[self.main] = V_main
+
+            results = self.solve_zones(Sbus, V)
+            for zone, (V_zone, _, _) in zip(self.zones, results):
+                V[zone['buses']] = V_zone
+            new_boundary = np.array([result[1] for result in results])
+            change = np.abs(new_boundary - boundary).max(initial = 0)
+            boundary = new_boundary
+            if not main_converged or not all(result[2] for result in results):
+                break
+            if change < runner.tolerance_mva:
+                converged = True
+                break
+
+        # the decomposed solution is checked on the full network
+        if converged:
+            converged = np.abs(mismatch(runner.Ybus, V, Sbus, runner.pvpq, runner.pq)).max(initial = 0) < 10 * runner.tolerance_mva
+        return V, converged, outer
+
+    def run(self, sgen_p = None, sgen_q = None, load_p = None, load_q = None):
+        """
+        TARGET:
+            Solve S scenarios as in PowerFlowRunner.run, each one warm-started by the previous converged one
+            Return vm_pu (S x n_bus), va_degree (S x n_bus) and the convergence flag (S,)
+        """
+        runner = self.runner
+        S = next(np.shape(value)[0] for value in (sgen_p, sgen_q, load_p, load_q) if value is not None)
+        sgen_p = np.broadcast_to(runner.sgen_p if sgen_p is None else sgen_p, (S, len(runner.sgen_p)))
+        sgen_q = np.broadcast_to(runner.sgen_q if sgen_q is None else sgen_q, (S, len(runner.sgen_p)))
+        load_p = np.broadcast_to(runner.load_p if load_p is None else load_p, (S, len(runner.load_p)))
+        load_q = np.broadcast_to(runner.load_q if load_q is None else load_q, (S, len(runner.load_p)))
+        Sbus = runner.Sbus(sgen_p, sgen_q, load_p, load_q)
+
+        vm_pu = np.empty((S, len(runner.bus_ppc)))
+        va_degree = np.empty((S, len(runner.bus_ppc)))
+        converged = np.zeros(S, dtype = bool)
+        V = runner.V_base
+        for s in range(S):
+            V_s, converged[s], _ = self.solve(Sbus[s], V)
+            if converged[s]:
+                V = V_s
+            vm_pu[s] = np.abs(V_s[runner.bus_ppc])
+            va_degree[s] = np.angle(V_s[runner.bus_ppc], deg = True)
+        return vm_pu, va_degree, converged
+
+    def close(self):
+        self.finalizer.detach()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+    from power_flow import PowerFlowRunner
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name under test")
+    parser.add_argument("--scenarios", type = int, default = 100, help = "number of scenarios")
+    parser.add_argument("--workers", type = int, default = None, help = "number of processes/threads for the zones")
+    parser.add_argument("--parallel", default = 'thread', choices = ['process', 'thread'], help = "pool of the zones")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+    sgen_p = runner.sgen_p * rng.uniform(0, 1, (args.scenarios, len(runner.sgen_p)))
+
+    with DecomposedPowerFlow(runner, net.bus['zone'].values, args.workers, parallel = args.parallel) as solver:
+        sizes = [len(zone['buses']) for zone in solver.zones]
+        print(f'main: {len(solver.main)} buses, {len(sizes)} zones, largest zone: {max(sizes)} buses')
+
+        start = time.time()
+        vm_decomposed, _, converged = solver.run(sgen_p)
+        time_decomposed = time.time() - start
+    start = time.time()
+    vm_full, _, _ = runner.run(sgen_p)
+    time_full = time.time() - start
+
+    print(f'decomposed ({args.parallel}): {time_decomposed:.3f}s, full: {time_full:.3f}s, converged: {converged.sum()}/{args.scenarios}')
+    print(f'max vm difference: {np.abs(vm_decomposed - vm_full).max():.2e} pu')
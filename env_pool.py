@@ -0,0 +1,233 @@
+"""
+Pool of worker processes which run the power flow of many environments in parallel, the results are shared without copies
+
+1. The setpoints (sgen/load) and the results (vm_pu, va_degree, line loading_percent, convergence) are preallocated numpy arrays in shared memory.
+2. Each worker loads the network once and owns a contiguous slice of the environments.
+3. A step only sends a short command to each worker: the worker reads its setpoints from the shared buffer, solves them (warm-started by the previous step of the same environment) and writes the results in place.
+4. The driver reads the results as numpy views of the shared buffers, no DataFrame is pickled between processes.
+"""
+
+import traceback
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import pandapower as pp
+from power_flow import PowerFlowRunner
+
+"""
+Functions
+"""
+
+def buffer_layout(n_env, n_sgen, n_load, n_bus, n_line):
+    """
+    TARGET:
+        Return the name, shape and dtype of each shared buffer
+    """
+    return {'sgen_p': ((n_env, n_sgen), np.float64),
+            'sgen_q': ((n_env, n_sgen), np.float64),
+            'load_p': ((n_env, n_load), np.float64),
+            'load_q': ((n_env, n_load), np.float64),
+            'vm_pu': ((n_env, n_bus), np.float64),
+            'va_degree': ((n_env, n_bus), np.float64),
+            'loading_percent': ((n_env, n_line), np.float64),
+            'converged': ((n_env,), np.bool_)}
+
+def attach(shm_names, layout):
+    """
+    TARGET:
+        Return the shared memories and the numpy views on them
+    """
+    shms, arrays = {}, {}
+    for name, (shape, dtype) in layout.items():
+        shms[name] = shared_memory.SharedMemory(name = shm_names[name])
+        arrays[name] = np.ndarray(shape, dtype = dtype, buffer = shms[name].buf)
+    return shms, arrays
+
+def worker(case, shm_names, layout, start, stop, conn):
+    """
+    TARGET:
+        Worker loop: solve the environments [start, stop) on every 'step' command until None is received
+        An exception is sent back to the driver as ('error', traceback) and ends the worker
+    """
+    shms, arrays = {}, {}
+    try:
+        shms, arrays = attach(shm_names, layout)
+        runner = PowerFlowRunner(pp.from_pickle(f'{case}.p'))
+        V = np.tile(runner.V_base, (stop - start, 1))
+        conn.send('ready')
+
+        while True:
+            command = conn.recv()
+            if command is None:
+                break
+            if command == 'reset':
+                V[:] = runner.V_base
+                conn.send('done')
+                continue
+
+            rows = slice(start, stop)
+            Sbus = runner.Sbus(arrays['sgen_p'][rows], arrays['sgen_q'][rows], arrays['load_p'][rows], arrays['load_q'][rows])
+            for k in range(stop - start):
+                V_k, converged, _ = runner.solve(Sbus[k], V[k])
+                if converged:
+                    V[k] = V_k
+                arrays['converged'][start + k] = converged
+                arrays['vm_pu'][start + k] = np.abs(V_k[runner.bus_ppc])
+                arrays['va_degree'][start + k] = np.angle(V_k[runner.bus_ppc], deg = True)
+                arrays['loading_percent'][start + k] = runner.line_loading(V_k)
+            conn.send('done')
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        del arrays
+        for shm in shms.values():
+            shm.close()
+        conn.close()
+
+"""
+Pool
+"""
+
+class EnvPool:
+    """
+    TARGET:
+        n_env copies of a saved network (e.g. bus141, bus322) stepped by n_workers processes
+        The results of step are views of the shared buffers, they are overwritten by the next step
+    """
+    def __init__(self, case, n_env, n_workers = None):
+        net = pp.from_pickle(f'{case}.p')
+        n_workers = min(n_env, n_workers or mp.cpu_count())
+        self.layout = buffer_layout(n_env, net.sgen.shape[0], net.load.shape[0], net.bus.shape[0], net.line.shape[0])
+
+        self.shms, self.arrays = {}, {}
+        for name, (shape, dtype) in self.layout.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            self.shms[name] = shared_memory.SharedMemory(create = True, size = size)
+            self.arrays[name] = np.ndarray(shape, dtype = dtype, buffer = self.shms[name].buf)
+        shm_names = {name: shm.name for name, shm in self.shms.items()}
+
+        # default setpoints: the values of the net
+        self.arrays['sgen_p'][:] = net.sgen['p_mw'].values
+        self.arrays['sgen_q'][:] = net.sgen['q_mvar'].values
+        self.arrays['load_p'][:] = net.load['p_mw'].values
+        self.arrays['load_q'][:] = net.load['q_mvar'].values
+
+        # one contiguous slice of environments per worker
+        bounds = np.linspace(0, n_env, n_workers + 1).astype(int)
+        self.connections, self.processes = [], []
+        for i in range(n_workers):
+            parent_conn, child_conn = mp.Pipe()
+            process = mp.Process(target = worker, args = (case, shm_names, self.layout, bounds[i], bounds[i+1], child_conn), daemon = True)
+            process.start()
+            # only the worker holds the child end, so the driver gets EOF if the worker dies
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+        try:
+            self.receive('ready')
+        except RuntimeError:
+            self.close()
+            raise
+
+    def receive(self, expected, poll = 1.0):
+        """
+        TARGET:
+            Wait for the expected message of every worker (all of them, so no reply is left in a pipe)
+            Raise a RuntimeError with the traceback of a failed worker, or if a worker exited without replying
+        """
+        errors = []
+        for i, (conn, process) in enumerate(zip(self.connections, self.processes)):
+            while not conn.poll(poll) and process.is_alive():
+                pass
+            try:
+                message = conn.recv() if conn.poll() else None
+            except EOFError:
+                message = None
+            if message is None:
+                errors.append(f'worker {i} exited with code {process.exitcode} without replying')
+            elif isinstance(message, tuple) and message[0] == 'error':
+                errors.append(f'worker {i} failed:\n{message[1]}')
+            elif message != expected:
+                errors.append(f'worker {i} replied {message!r} instead of {expected!r}')
+        if errors:
+            raise RuntimeError('\n'.join(errors))
+
+    def broadcast(self, command):
+        for i, (conn, process) in enumerate(zip(self.connections, self.processes)):
+            try:
+                conn.send(command)
+            except OSError:
+                # the pipe of a dead worker is broken, report it as receive does
+                process.join(timeout = 1)
+                raise RuntimeError(f'worker {i} exited with code {process.exitcode}, the pool cannot be used anymore')
+        self.receive('done')
+
+    def step(self, sgen_p = None, sgen_q = None, load_p = None, load_q = None):
+        """
+        TARGET:
+            Write the setpoints of all the environments (n_env x n_sgen, n_env x n_load; None keeps the previous ones) and solve them
+            Return the shared result arrays: vm_pu, va_degree, loading_percent and converged
+        """
+        for name, value in (('sgen_p', sgen_p), ('sgen_q', sgen_q), ('load_p', load_p), ('load_q', load_q)):
+            if value is not None:
+                np.copyto(self.arrays[name], value)
+        self.broadcast('step')
+        return {name: self.arrays[name] for name in ('vm_pu', 'va_degree', 'loading_percent', 'converged')}
+
+    def reset(self):
+        """
+        TARGET:
+            Restart the warm start of every environment from the base solution
+        """
+        self.broadcast('reset')
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(None)
+            except OSError:
+                # the worker already exited
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join(timeout = 10)
+            if process.is_alive():
+                process.terminate()
+        self.connections, self.processes = [], []
+        self.arrays = {}
+        for shm in self.shms.values():
+            shm.close()
+            shm.unlink()
+        self.shms = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus141', help = "specify the bus name under test")
+    parser.add_argument("--envs", type = int, default = 64, help = "number of environments")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes")
+    parser.add_argument("--steps", type = int, default = 100, help = "number of steps")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with EnvPool(args.bus, args.envs, args.workers) as pool:
+        sgen_p = pool.arrays['sgen_p'].copy()
+        start = time.time()
+        for t in range(args.steps):
+            result = pool.step(sgen_p = sgen_p * rng.uniform(0, 1, sgen_p.shape))
+        elapsed = time.time() - start
+        print(f'{args.steps} steps x {args.envs} envs in {elapsed:.3f}s ({args.steps * args.envs / elapsed:.0f} power flows/s)')
+        print(f"converged: {result['converged'].sum()}/{args.envs}, max vm_pu: {result['vm_pu'].max():.4f}")
@@ -0,0 +1,136 @@
+"""
+Generate large synthetic networks (e.g. bus1000, bus10k) by attaching many randomized low-voltage feeders to a long MV backbone
+
+1. The MV backbone is built in the same way as bus322: a 110kV/20kV transformer and a line of MV buses with two random line types.
+2. The MV loads are sampled from the MV loads of bus322.p.
+3. The LV feeders are copied from lv_network/LV*.p (run generate_lv_net.py first) until the target bus number is reached.
+4. Each copy is randomized: the line lengths are scaled and each PV is moved to a random bus in its zone, so every zone still has a sgen (as in determine_sgen).
+5. The feeders are attached to the coupling points (ccp) in turn by compose_network.
+"""
+
+import argparse
+import numpy as np
+import pandapower as pp
+from copy import deepcopy
+from compose import compose_network, clean_network
+from robust_power_flow import run_net
+from validate import check_network
+
+"""
+Functions
+"""
+
+def create_mv_backbone(no_bus_MV, rng, load_pool):
+    """
+    TARGET:
+        Return the MV backbone with no_bus_MV buses of 20kV connected to the 110kV external grid (bus 0)
+        Each MV bus after the transformer has a load sampled from load_pool (n x 2 array of p_mw and q_mvar)
+    """
+    net = pp.create_empty_network()
+
+    # External bus and MV buses
+    pp.create_bus(net, vn_kv=110, type='n', name = 'ext_grid', zone = 'main', max_vm_pu = 1.05, min_vm_pu = 0.95)
+    pp.create_buses(net, no_bus_MV, vn_kv=20, type='n', name = 'MV bus', zone = 'main', max_vm_pu = 1.05, min_vm_pu = 0.95)
+
+    # External grid: 110kv
+    pp.create_ext_grid(net, 0, vm_pu=1.00, va_degree = 0, in_service = True, name = 'ext_grid')
+
+    # Transformer: ext_grid(110kv) to MV(20kv) with high power capacity
+    pp.create_transformer(net, 0, 1, name="110kV/20kV transformer", std_type="63 MVA 110/20 kV")
+
+    # Lines: mv, two types of line specification with random lengths
+    from_bus = np.arange(1, no_bus_MV)
+    cable = from_bus % 2 == 0
+    pp.create_lines(net, from_bus[cable], from_bus[cable] + 1, length_km = 0.4 + rng.random(cable.sum()),
+                    std_type="NA2XS2Y 1x70 RM/25 12/20 kV", name = 'MV_line')
+    pp.create_lines(net, from_bus[~cable], from_bus[~cable] + 1, length_km = 3 + 2 * rng.random((~cable).sum()),
+                    std_type='70-AL1/11-ST1A 20.0', name = 'MV_line')
+    net.line.sort_values('from_bus', inplace = True)
+    net.line.reset_index(drop = True, inplace = True)
+
+    # Loads: one sampled load at each MV bus
+    load_bus = np.arange(2, no_bus_MV + 1)
+    sample = load_pool[rng.integers(0, load_pool.shape[0], len(load_bus))]
+    pp.create_loads(net, load_bus, p_mw = sample[:, 0], q_mvar = sample[:, 1], name = 'MV_load')
+
+    return net
+
+def randomize_feeder(LV_net, rng, length_range = (0.8, 1.2)):
+    """
+    TARGET:
+        Return a randomized copy of the LV feeder
+        The line lengths are scaled within length_range and each sgen is moved to a random bus of its zone
+    """
+    feeder = deepcopy(LV_net)
+    feeder.line['length_km'] = feeder.line['length_km'].values * rng.uniform(*length_range, feeder.line.shape[0])
+
+    zone = feeder.bus['zone'].values
+    for name, index in feeder.sgen.groupby('name').groups.items():
+        zone_bus = feeder.bus.index.values[zone == name]
+        if len(zone_bus) > 0:
+            feeder.sgen.loc[index, 'bus'] = rng.choice(zone_bus, len(index))
+
+    return feeder
+
+def generate_network(n_bus, no_bus_MV, n_ccp, seed, LV_nets, load_pool, length_range = (0.8, 1.2)):
+    """
+    TARGET:
+        Return a zoned network with about n_bus buses (at least n_bus when the feeders are enough)
+        n_ccp coupling points are randomly chosen on the MV backbone and the feeders are attached to them in turn
+    """
+    assert n_ccp <= no_bus_MV - 1, 'the coupling points should be on the MV buses after the transformer'
+    rng = np.random.default_rng(seed)
+    backbone = create_mv_backbone(no_bus_MV, rng, load_pool)
+
+    # ccp: MV to LV coupling point bus index
+    ccp = np.sort(rng.choice(np.arange(2, no_bus_MV + 1), n_ccp, replace = False))
+
+    # Replicate the LV feeders until the target bus number is reached (the hv bus of each LV trafo is dropped)
+    feeders = []
+    total_bus = backbone.bus.shape[0]
+    while total_bus < n_bus:
+        feeder = randomize_feeder(LV_nets[rng.integers(len(LV_nets))], rng, length_range)
+        feeders.append(feeder)
+        total_bus += feeder.bus.shape[0] - feeder.trafo.shape[0]
+
+    feeder_ccp = ccp[np.arange(len(feeders)) % n_ccp]
+    net = compose_network(backbone, feeders, feeder_ccp)
+
+    # the ccp buses feed the LV networks instead of a MV load
+    net.load = net.load[~net.load['bus'].isin(ccp)].reset_index(drop = True)
+
+    return clean_network(net)
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_bus", type = int, default = 1000, help = "target bus number")
+    parser.add_argument("--no_bus_MV", type = int, default = 25, help = "number of MV buses on the backbone")
+    parser.add_argument("--n_ccp", type = int, default = 3, help = "number of MV to LV coupling points")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed")
+    parser.add_argument("--html", action = 'store_true', help = "also plot the network to html")
+    args = parser.parse_args()
+
+    print(f'pandapower version: {pp.__version__}')
+
+    LV_nets = [pp.from_pickle(f'lv_network/LV{i}.p') for i in range(6)]
+    bus322 = pp.from_pickle('bus322.p')
+    MV_load = bus322.load[bus322.bus.loc[bus322.load['bus'], 'vn_kv'].values == 20]
+    load_pool = MV_load[['p_mw', 'q_mvar']].values
+
+    net = generate_network(args.n_bus, args.no_bus_MV, args.n_ccp, args.seed, LV_nets, load_pool)
+
+    check_network(net)
+    result = run_net(net, max_iteration = 30)
+    print(f"converged: {result['converged']}, stage: {result['stage']}, iterations: {result['iterations']}")
+    print(f'the bus number is {net.bus.shape[0]}')
+    print(f'the zone number is {len(set(net.bus["zone"])) - 1}')
+    print(f'the sgen number is {net.sgen.shape[0]}')
+
+    pp.to_pickle(net, filename = f'bus{args.n_bus}.p')
+    if args.html:
+        pp.plotting.to_html(net, filename = f'bus{args.n_bus}.html', show_tables=(False))
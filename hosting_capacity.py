@@ -0,0 +1,166 @@
+"""
+Parallel PV hosting capacity of the zones
+
+1. A scenario is a PV sizing (a weight of each sgen, so the PV of a zone is shared unevenly between its sgens) and a load level.
+2. For each scenario and zone, the PV of the zone is scaled by alpha (the other zones stay at their weights) and
+   the largest alpha without violation is found by bisection:
+   a violation is a voltage above max_vm_pu of the bus (1.05), a line or transformer loading above max_loading_percent, or a diverged power flow.
+   The bisection stops early if alpha_max is feasible or the first step already violates, each power flow is warm-started by the last feasible one.
+3. The hosting capacity of the zone is alpha times the installed PV (sum of the weighted sgen p_mw of the zone), the binding constraint is recorded.
+4. The scenarios are split into chunks solved by a process pool, each worker loads the network once.
+"""
+
+import numpy as np
+import pandapower as pp
+from concurrent.futures import ProcessPoolExecutor
+from power_flow import PowerFlowRunner
+from zone_index import ZoneIndex
+
+LIMITS = ['none', 'vm', 'line', 'trafo', 'diverged']
+
+"""
+Functions
+"""
+
+def violation(runner, V, converged, max_vm_pu, max_loading_percent):
+    """
+    TARGET:
+        Return the index in LIMITS of the first violated limit (0 if there is none)
+    """
+    if not converged:
+        return LIMITS.index('diverged')
+    if (np.abs(V[runner.bus_ppc]) > max_vm_pu).any():
+        return LIMITS.index('vm')
+    if (runner.line_loading(V) > max_loading_percent).any():
+        return LIMITS.index('line')
+    if (runner.trafo_loading(V) > max_loading_percent).any():
+        return LIMITS.index('trafo')
+    return 0
+
+def zone_capacity(runner, sgen_p, zone_sgen, load_p, load_q, max_vm_pu, max_loading_percent, alpha_max, tolerance):
+    """
+    TARGET:
+        Return the largest alpha of the zone sgens (alpha * sgen_p[zone_sgen]) without violation and the binding limit
+    """
+    sgen_q = runner.sgen_q
+    V = runner.V_base
+
+    def evaluate(alpha):
+        p = sgen_p.copy()
+        p[zone_sgen] *= alpha
+        V_alpha, converged, _ = runner.solve(runner.Sbus(p, sgen_q, load_p, load_q), V)
+        return V_alpha, violation(runner, V_alpha, converged, max_vm_pu, max_loading_percent)
+
+    # early termination at both ends
+    _, limit = evaluate(alpha_max)
+    if limit == 0:
+        return alpha_max, 0
+    V_low, low_limit = evaluate(0.0)
+    if low_limit != 0:
+        return 0.0, low_limit
+
+    low, high = 0.0, alpha_max
+    V = V_low
+    while high - low > tolerance:
+        alpha = (low + high) / 2
+        V_alpha, alpha_limit = evaluate(alpha)
+        if alpha_limit == 0:
+            low, V = alpha, V_alpha
+        else:
+            high, limit = alpha, alpha_limit
+    return low, limit
+
+def random_scenarios(n_sgen, n_scenario, rng, weight_range = (0.5, 1.5), load_range = (0.2, 1.0)):
+    """
+    TARGET:
+        Return the sgen weights (S x n_sgen) and the load levels (S,) of random scenarios
+    """
+    return rng.uniform(*weight_range, (n_scenario, n_sgen)), rng.uniform(*load_range, n_scenario)
+
+"""
+Workers
+"""
+
+WORKER = {}
+
+def init_worker(case):
+    net = pp.from_pickle(f'{case}.p')
+    WORKER['runner'] = PowerFlowRunner(net)
+    WORKER['index'] = ZoneIndex.from_net(net)
+    WORKER['max_vm_pu'] = net.bus['max_vm_pu'].fillna(np.inf).values
+
+def solve_chunk(sgen_weight, load_level, zones, max_vm_pu, max_loading_percent, alpha_max, tolerance):
+    """
+    TARGET:
+        Return the alpha and the binding limit (chunk x zone) of a chunk of scenarios
+    """
+    runner, index = WORKER['runner'], WORKER['index']
+    if max_vm_pu is None:
+        max_vm_pu = WORKER['max_vm_pu']
+    alpha = np.zeros((len(load_level), len(zones)))
+    limit = np.zeros((len(load_level), len(zones)), dtype = int)
+    for s in range(len(load_level)):
+        sgen_p = runner.sgen_p * sgen_weight[s]
+        load_p = runner.load_p * load_level[s]
+        load_q = runner.load_q * load_level[s]
+        for k, zone in enumerate(zones):
+            alpha[s, k], limit[s, k] = zone_capacity(runner, sgen_p, index.index('sgen', zone), load_p, load_q,
+                                                     max_vm_pu, max_loading_percent, alpha_max, tolerance)
+    return alpha, limit
+
+"""
+Sweep
+"""
+
+def hosting_capacity(case, sgen_weight, load_level, max_vm_pu = None, max_loading_percent = 100,
+                     alpha_max = 20.0, tolerance = 0.01, n_workers = None, chunk = 8):
+    """
+    TARGET:
+        Return the hosting capacity of every zone of the saved network case (e.g. bus322) for each scenario
+        max_vm_pu: None uses the max_vm_pu column of the buses
+        Return {'zones', 'alpha' (S x zone), 'capacity_mw' (S x zone), 'limit' (S x zone, index in LIMITS)}
+    """
+    net = pp.from_pickle(f'{case}.p')
+    index = ZoneIndex.from_net(net)
+    zones = index.agent_zones()
+    installed = np.stack([(net.sgen['p_mw'].values * sgen_weight)[:, index.index('sgen', zone)].sum(axis = 1) for zone in zones], axis = 1)
+
+    S = len(load_level)
+    bounds = list(range(0, S, chunk)) + [S]
+    with ProcessPoolExecutor(n_workers, initializer = init_worker, initargs = (case,)) as executor:
+        futures = [executor.submit(solve_chunk, sgen_weight[a:b], load_level[a:b], zones, max_vm_pu, max_loading_percent, alpha_max, tolerance)
+                   for a, b in zip(bounds[:-1], bounds[1:])]
+        results = [future.result() for future in futures]
+
+    alpha = np.concatenate([result[0] for result in results])
+    limit = np.concatenate([result[1] for result in results])
+    return {'zones': zones, 'alpha': alpha, 'capacity_mw': alpha * installed, 'limit': limit}
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name under test")
+    parser.add_argument("--scenarios", type = int, default = 1000, help = "number of PV sizing scenarios")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed of the scenarios")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n_sgen = pp.from_pickle(f'{args.bus}.p').sgen.shape[0]
+    sgen_weight, load_level = random_scenarios(n_sgen, args.scenarios, rng)
+
+    start = time.time()
+    result = hosting_capacity(args.bus, sgen_weight, load_level, n_workers = args.workers)
+    print(f'{args.scenarios} scenarios x {len(result["zones"])} zones in {time.time() - start:.1f}s')
+    for k, zone in enumerate(result['zones']):
+        capacity = result['capacity_mw'][:, k]
+        limit = np.bincount(result['limit'][:, k], minlength = len(LIMITS))
+        binding = ', '.join(f'{name} {count}' for name, count in zip(LIMITS, limit) if count > 0)
+        print(f'{zone}: min {capacity.min():.2f} MW, median {np.median(capacity):.2f} MW, mean {capacity.mean():.2f} MW ({binding})')
@@ -0,0 +1,140 @@
+"""
+LinDistFlow surrogate of the power flow for fast (approximate) voltage estimation
+
+1. The tree of the network is the same as in radial_sweep.py, each bus has one branch to its parent.
+2. The path matrix T (T[i, j] = 1 if bus j is on the path from the slack bus to bus i) gives the common path resistance R = T diag(r) T' and reactance X = T diag(x) T'.
+3. LinDistFlow: vm^2 = vm_slack^2 + 2 R p + 2 X q, where p and q are the bus injections (p.u.).
+4. The sensitivities are mapped to the sgen and load columns once, so the squared voltages of a batch are a single matrix multiply.
+The line charging, bus shunts, transformer taps and the losses are neglected, error_report compares the estimation with the full power flow.
+"""
+
+import numpy as np
+from scipy.sparse import csc_matrix, diags, identity
+from scipy.sparse.linalg import spsolve
+from pandapower.pypower.idx_brch import F_BUS, T_BUS, BR_R, BR_X, BR_STATUS
+from power_flow import PowerFlowRunner
+from radial_sweep import radial_tree
+
+"""
+Functions
+"""
+
+def path_matrix(parent):
+    """
+    TARGET:
+        Return the sparse path matrix T = (I - A)^-1 where A[c, parent[c]] = 1
+        Row i of T marks bus i and all its ancestors (the slack bus has no branch, so its impedance is 0)
+    """
+    n_bus = len(parent)
+    child = np.nonzero(parent >= 0)[0]
+    A = csc_matrix((np.ones(len(child)), (child, parent[child])), shape = (n_bus, n_bus))
+    return csc_matrix(spsolve(csc_matrix(identity(n_bus) - A), identity(n_bus, format = 'csc')))
+
+"""
+Surrogate
+"""
+
+class LinDistFlow:
+    """
+    TARGET:
+        LinDistFlow voltage estimation on the ppc of a PowerFlowRunner (the same injection columns and bus order)
+    """
+    def __init__(self, runner):
+        self.runner = runner
+        ppc = runner.ppc
+        branch = np.asarray(ppc['branch'])
+        branch = branch[branch[:, BR_STATUS].real > 0]
+        f_bus = branch[:, F_BUS].real.astype(int)
+        t_bus = branch[:, T_BUS].real.astype(int)
+        n_bus = runner.Ybus.shape[0]
+        root = int(runner.ref[0])
+
+        _, parent, parent_branch = radial_tree(f_bus, t_bus, n_bus, root)
+        r = np.zeros(n_bus)
+        x = np.zeros(n_bus)
+        child = parent >= 0
+        r[child] = branch[parent_branch[child], BR_R].real
+        x[child] = branch[parent_branch[child], BR_X].real
+        T = path_matrix(parent)
+
+        # sensitivity of the squared voltage w.r.t. the element power: 2 T diag(r) T' C
+        def sensitivity(C, z):
+            return (2 * (T @ diags(z)) @ (C.T @ T).T).toarray()[runner.bus_ppc]
+
+        self.vm_slack = np.abs(runner.V_base[root])
+        # (2 n_sgen + 2 n_load) x n_bus, the rows follow [sgen_p, sgen_q, load_p, load_q]
+        self.K = np.vstack([sensitivity(runner.C_sgen, r).T,
+                            sensitivity(runner.C_sgen, x).T,
+                            -sensitivity(runner.C_load, r).T,
+                            -sensitivity(runner.C_load, x).T])
+
+    def estimate(self, sgen_p, sgen_q, load_p = None, load_q = None):
+        """
+        TARGET:
+            Return the estimated vm_pu (B x n_bus) of a batch of sgen (B x n_sgen) and load (B x n_load) injections in MW/Mvar
+            Missing load arrays are kept at the values of the net
+        """
+        runner = self.runner
+        B = np.shape(sgen_p)[0]
+        load_p = np.broadcast_to(runner.load_p if load_p is None else load_p, (B, len(runner.load_p)))
+        load_q = np.broadcast_to(runner.load_q if load_q is None else load_q, (B, len(runner.load_q)))
+        injection = np.hstack([sgen_p, sgen_q, load_p, load_q])
+        return np.sqrt(self.vm_slack ** 2 + injection @ self.K)
+
+    def error_report(self, sgen_p, sgen_q, load_p = None, load_q = None, threshold = 0.005):
+        """
+        TARGET:
+            Compare the estimation with the Newton-Raphson power flow of the runner
+            Return the error statistics (p.u.) of all the buses, of each bus and the buses where the max error is below threshold
+        """
+        estimate = self.estimate(sgen_p, sgen_q, load_p, load_q)
+        vm_pu, _, converged = self.runner.run(sgen_p, sgen_q, load_p, load_q)
+        error = np.abs(estimate - vm_pu)[converged]
+        if error.shape[0] == 0:
+            # no converged scenario to compare with
+            nan = np.full(vm_pu.shape[1], np.nan)
+            return {'scenarios': 0, 'max': np.nan, 'mean': np.nan, 'p95': np.nan,
+                    'bus_max': nan, 'bus_mean': nan, 'safe_bus': np.array([], dtype = int)}
+        bus_max = error.max(axis = 0)
+        return {'scenarios': int(converged.sum()),
+                'max': float(error.max()),
+                'mean': float(error.mean()),
+                'p95': float(np.percentile(error, 95)),
+                'bus_max': bus_max,
+                'bus_mean': error.mean(axis = 0),
+                'safe_bus': np.nonzero(bus_max < threshold)[0]}
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus33bw', help = "specify the bus name under test")
+    parser.add_argument("--scenarios", type = int, default = 1000, help = "number of scenarios")
+    parser.add_argument("--threshold", type = float, default = 0.005, help = "error threshold (p.u.) of a safe bus")
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+    model = LinDistFlow(runner)
+
+    sgen_p = runner.sgen_p * np.random.uniform(0, 1, (args.scenarios, net.sgen.shape[0]))
+    sgen_q = runner.sgen_q * np.random.uniform(-1, 1, (args.scenarios, net.sgen.shape[0]))
+
+    start = time.time()
+    model.estimate(sgen_p, sgen_q)
+    print(f'estimation of {args.scenarios} scenarios: {1000 * (time.time() - start):.3f}ms')
+
+    report = model.error_report(sgen_p, sgen_q, threshold = args.threshold)
+    print(f"error (p.u.): max {report['max']:.2e}, mean {report['mean']:.2e}, p95 {report['p95']:.2e}")
+    zone = net.bus['zone'].values
+    for name in sorted(set(zone)):
+        print(f"{name}: max error {report['bus_max'][zone == name].max():.2e}")
+    print(f"{len(report['safe_bus'])}/{net.bus.shape[0]} buses below {args.threshold} p.u.")
@@ -0,0 +1,146 @@
+"""
+Batched optimal power flow of the saved networks prepared for opf (bus322: controllable sgens, ext_grid limits and poly costs, see compose.clean_network)
+
+1. Each worker loads the network once and keeps it: a scenario only writes the load p/q and the sgen limits (max_p_mw, the available PV)
+   into the existing tables, the costs, limits and topology are not rebuilt.
+2. Each scenario is warm-started from the solution of the previous scenario of the same worker (init = 'results'),
+   a scenario which fails from the warm start is retried from the power flow initialization (init = 'pf').
+3. The scenarios are split into contiguous chunks solved by a process pool.
+4. The setpoints (sgen p/q, ext_grid p/q), the voltages, the objective, the convergence flag and the solve time are returned as arrays.
+"""
+
+import os
+import time
+import numpy as np
+import pandapower as pp
+from pandapower.optimal_powerflow import OPFNotConverged
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Functions
+"""
+
+def solve_scenarios(net, load_p, load_q, sgen_max_p, init = 'pf'):
+    """
+    TARGET:
+        Solve the opf of S scenarios on the net (S x n_load, S x n_sgen in MW/Mvar; None keeps the values of the net)
+        Return the dict of result arrays
+    """
+    S = next(np.shape(value)[0] for value in (load_p, load_q, sgen_max_p) if value is not None)
+    n_sgen, n_ext_grid = net.sgen.shape[0], net.ext_grid.shape[0]
+    result = {'sgen_p': np.full((S, n_sgen), np.nan),
+              'sgen_q': np.full((S, n_sgen), np.nan),
+              'ext_grid_p': np.full((S, n_ext_grid), np.nan),
+              'ext_grid_q': np.full((S, n_ext_grid), np.nan),
+              'vm_pu': np.full((S, net.bus.shape[0]), np.nan),
+              'objective': np.full(S, np.nan),
+              'converged': np.zeros(S, dtype = bool),
+              'warm': np.zeros(S, dtype = bool),
+              'time': np.zeros(S)}
+
+    # the setpoints of the net are restored at the end, the scenarios are clipped against the base sgen power
+    base_p = net.sgen['p_mw'].values.copy()
+    base_max_p = net.sgen['max_p_mw'].values.copy() if 'max_p_mw' in net.sgen else None
+    base_load = net.load[['p_mw', 'q_mvar']].copy()
+    try:
+        for s in range(S):
+            if load_p is not None:
+                net.load['p_mw'] = load_p[s]
+            if load_q is not None:
+                net.load['q_mvar'] = load_q[s]
+            if sgen_max_p is not None:
+                net.sgen['max_p_mw'] = sgen_max_p[s]
+                net.sgen['p_mw'] = np.minimum(base_p, sgen_max_p[s])
+
+            start = time.perf_counter()
+            for attempt in ([init] if init != 'results' else ['results', 'pf']):
+                try:
+                    pp.runopp(net, init = attempt)
+                    result['converged'][s] = True
+                    result['warm'][s] = attempt == 'results'
+                    break
+                except OPFNotConverged:
+                    continue
+            result['time'][s] = time.perf_counter() - start
+
+            if result['converged'][s]:
+                result['sgen_p'][s] = net.res_sgen['p_mw'].values
+                result['sgen_q'][s] = net.res_sgen['q_mvar'].values
+                result['ext_grid_p'][s] = net.res_ext_grid['p_mw'].values
+                result['ext_grid_q'][s] = net.res_ext_grid['q_mvar'].values
+                result['vm_pu'][s] = net.res_bus['vm_pu'].values
+                result['objective'][s] = net.res_cost
+                # the next scenario starts from this solution
+                init = 'results'
+    finally:
+        net.sgen['p_mw'] = base_p
+        if base_max_p is not None:
+            net.sgen['max_p_mw'] = base_max_p
+        elif 'max_p_mw' in net.sgen:
+            net.sgen.drop(columns = 'max_p_mw', inplace = True)
+        net.load[['p_mw', 'q_mvar']] = base_load
+    return result
+
+"""
+Workers
+"""
+
+WORKER = {}
+
+def init_worker(case):
+    WORKER['net'] = pp.from_pickle(f'{case}.p')
+
+def solve_chunk(load_p, load_q, sgen_max_p):
+    return solve_scenarios(WORKER['net'], load_p, load_q, sgen_max_p)
+
+def chunk_of(value, a, b):
+    return None if value is None else value[a:b]
+
+"""
+Batch
+"""
+
+def batch_opf(case, load_p = None, load_q = None, sgen_max_p = None, n_workers = None):
+    """
+    TARGET:
+        Solve the opf of S scenarios of the saved network case on a process pool, one contiguous chunk of scenarios per worker
+        Return the result arrays of solve_scenarios in the scenario order
+    """
+    S = next(np.shape(value)[0] for value in (load_p, load_q, sgen_max_p) if value is not None)
+    n_workers = min(S, n_workers or os.cpu_count())
+    bounds = np.linspace(0, S, n_workers + 1).astype(int)
+    with ProcessPoolExecutor(n_workers, initializer = init_worker, initargs = (case,)) as executor:
+        futures = [executor.submit(solve_chunk, chunk_of(load_p, a, b), chunk_of(load_q, a, b), chunk_of(sgen_max_p, a, b))
+                   for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        results = [future.result() for future in futures]
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name under test")
+    parser.add_argument("--scenarios", type = int, default = 100, help = "number of scenarios")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed of the scenarios")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    net = pp.from_pickle(f'{args.bus}.p')
+    level = rng.uniform(0.5, 1.2, (args.scenarios, 1))
+    load_p = net.load['p_mw'].values * level
+    load_q = net.load['q_mvar'].values * level
+    sgen_max_p = net.sgen['max_p_mw'].values * rng.uniform(0, 1, (args.scenarios, net.sgen.shape[0]))
+
+    start = time.time()
+    result = batch_opf(args.bus, load_p, load_q, sgen_max_p, args.workers)
+    elapsed = time.time() - start
+    converged = result['converged']
+    print(f'{args.scenarios} scenarios in {elapsed:.1f}s, converged: {converged.sum()}/{args.scenarios}, warm-started: {result["warm"].sum()}')
+    print(f'solve time per scenario: mean {result["time"].mean():.3f}s, max {result["time"].max():.3f}s')
+    print(f'objective: mean {np.nanmean(result["objective"]):.4f}, max vm_pu: {np.nanmax(result["vm_pu"]):.4f}')
@@ -0,0 +1,152 @@
+"""
+Sparse zone partition of the low-voltage networks
+
+1. The leaf buses are the buses connected to only one line, found by the node degrees of the line list.
+2. A single BFS from the low-voltage side of the transformer gives the parent of every bus.
+3. The zone of a bus is the initial bus (child of the transformer bus) at the top of its branch.
+4. Only the buses on the path from the transformer to a leaf bus are assigned, the same as the union of the shortest paths.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order
+from profiling import timed
+
+"""
+Functions
+"""
+
+def bus_adjacency(net):
+    """
+    TARGET:
+        Return the sparse adjacency matrix of the buses (row order of net.bus) and the lookup from bus index to row
+        In-service lines and transformers are included, lines with an open switch and closed bus-bus switches are considered
+    """
+    bus_index = net.bus.index.values
+    lookup = np.full(bus_index.max() + 1, -1, dtype = int)
+    lookup[bus_index] = np.arange(len(bus_index))
+
+    line = net.line[net.line['in_service'].values.astype(bool)]
+    if 'switch' in net and net.switch.shape[0] > 0:
+        switch = net.switch
+        open_line = switch.loc[(switch['et'] == 'l') & ~switch['closed'].astype(bool), 'element'].values
+        line = line[~line.index.isin(open_line)]
+        bus_switch = switch[(switch['et'] == 'b') & switch['closed'].astype(bool)]
+    else:
+        bus_switch = None
+    trafo = net.trafo[net.trafo['in_service'].values.astype(bool)]
+
+    from_bus = [line['from_bus'].values, trafo['hv_bus'].values]
+    to_bus = [line['to_bus'].values, trafo['lv_bus'].values]
+    if bus_switch is not None:
+        from_bus.append(bus_switch['bus'].values)
+        to_bus.append(bus_switch['element'].values)
+    from_bus = lookup[np.concatenate(from_bus).astype(int)]
+    to_bus = lookup[np.concatenate(to_bus).astype(int)]
+
+    n_bus = len(bus_index)
+    rows = np.r_[from_bus, to_bus]
+    cols = np.r_[to_bus, from_bus]
+    adjacency = csr_matrix((np.ones(len(rows)), (rows, cols)), shape = (n_bus, n_bus))
+
+    return adjacency, lookup
+
+def tree_traversal(adjacency, start):
+    """
+    TARGET:
+        Return the BFS order (rows reachable from start) and the parent of every row (-1 for the start and unreachable rows)
+    """
+    order, parent = breadth_first_order(adjacency, start, directed = False, return_predecessors = True)
+    parent = np.where(parent < 0, -1, parent)
+    return order, parent
+
+@timed()
+def determine_leaf_bus(LV_bus, LV_line):
+    """
+    TARGET:
+        Return the leaf buses which are connected to only one line, the higher voltage side of the transformer is excluded
+    """
+    bus_index = LV_bus.index.values[LV_bus['vn_kv'].values != 20]
+
+    # duplicated lines with the same direction are counted once (the same as the directed graph)
+    edges = np.unique(LV_line[['from_bus', 'to_bus']].values.astype(int), axis = 0)
+    degree = np.bincount(edges.ravel(), minlength = bus_index.max() + 1)
+
+    return bus_index[degree[bus_index] == 1]
+
+@timed()
+def determine_zone(LV_net, bus_initial, ext_bus_index, leaf_bus):
+    """
+    TARGET:
+        Return the zone allocation of the grid: zone{i+1} contains the buses of the branch starting from bus_initial[i]
+        Only the buses on the path from the transformer to a leaf bus are in the zones
+    """
+    adjacency, lookup = bus_adjacency(LV_net)
+    bus_index = LV_net.bus.index.values
+    start = lookup[ext_bus_index]
+    order, parent = tree_traversal(adjacency, start)
+
+    # Top-down: the branch of a bus is the branch of its parent, the branch of an initial bus is itself
+    branch = np.full(len(bus_index), -1, dtype = int)
+    parent_list = parent.tolist()
+    branch_list = branch.tolist()
+    for row in order.tolist()[1:]:
+        branch_list[row] = row if parent_list[row] == start else branch_list[parent_list[row]]
+    branch = np.array(branch_list, dtype = int)
+
+    # Bottom-up: mark the buses on the path from a leaf bus to the transformer
+    on_path = np.zeros(len(bus_index), dtype = bool)
+    on_path[lookup[np.asarray(leaf_bus, dtype = int)]] = True
+    on_path_list = on_path.tolist()
+    for row in reversed(order.tolist()[1:]):
+        if on_path_list[row]:
+            on_path_list[parent_list[row]] = True
+    on_path = np.array(on_path_list, dtype = bool)
+    on_path[start] = False
+
+    # the branches reached by a leaf should start from an initial bus
+    initial_row = lookup[np.asarray(bus_initial, dtype = int)]
+    assert set(branch[on_path]) <= set(initial_row), 'a zone does not start from the initial bus'
+
+    new_zone = {}
+    for i, row in enumerate(initial_row):
+        new_zone[f'zone{i+1}'] = list(bus_index[on_path & (branch == row)])
+
+    return new_zone
+
+@timed()
+def assign_zone(LV_bus, new_zone, ext_bus_index, high_bus_index):
+    """
+    TARGET:
+        Write the zone allocation into the zone column of the bus table
+    """
+    LV_bus.loc[ext_bus_index, 'zone'] = 'main'        # the lower voltage side of the transformer
+    LV_bus.loc[high_bus_index, 'zone'] = 'delete'     # the higher voltage side of the transformer
+    for name, buses in new_zone.items():
+        LV_bus.loc[buses, 'zone'] = name
+
+    return LV_bus
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    # Check the partition against the zones saved in lv_network/LV*.p
+    import time
+    import pandapower as pp
+    from generate_lv_net import determine_initial_bus
+
+    for LV_index in range(6):
+        LV_net = pp.from_pickle(f'lv_network/LV{LV_index}.p')
+
+        start = time.time()
+        bus_initial, high_bus_index, ext_bus_index = determine_initial_bus(LV_net.trafo, LV_net.line)
+        leaf_bus = determine_leaf_bus(LV_net.bus, LV_net.line)
+        new_zone = determine_zone(LV_net, bus_initial, ext_bus_index, leaf_bus)
+        elapsed = time.time() - start
+
+        saved_zone = LV_net.bus['zone']
+        same = all(set(buses) == set(saved_zone[saved_zone == name].index) for name, buses in new_zone.items())
+        print(f'LV{LV_index}: {len(new_zone)} zones in {1000 * elapsed:.2f}ms, identical to saved zones: {same}')
@@ -0,0 +1,362 @@
+"""
+Batched time-series power flow on the saved networks (bus33bw.p, bus141.p, bus322.p)
+
+1. The internal ppc/Ybus is built once by a single pp.runpp on the loaded net.
+2. Each timestep only changes the sgen and load injections, so the bus injection Sbus is rebuilt by sparse matrix products.
+3. The Newton-Raphson of each timestep is warm-started from the voltage of the previous timestep.
+4. The loads are treated as constant power loads (const_z_percent = const_i_percent = 0 in all the saved networks).
+"""
+
+import numpy as np
+import pandapower as pp
+from scipy.sparse import csr_matrix, diags, hstack, vstack
+from scipy.sparse.linalg import spsolve
+from pandapower.pypower.idx_brch import F_BUS, T_BUS, BR_R, BR_X, BR_B, TAP, SHIFT, BR_STATUS
+from pandapower.pypower.idx_bus import BASE_KV
+from profiling import span, timed
+
+"""
+Functions
+"""
+
+def dSbus_dV(Ybus, V):
+    """
+    TARGET:
+        Return the partial derivatives of the bus injection w.r.t. the voltage magnitude and angle (polar form)
+    """
+    Ibus = Ybus @ V
+    diagV = diags(V)
+    diagIbus = diags(Ibus)
+    diagVnorm = diags(V / np.abs(V))
+
+    dS_dVm = diagV @ (Ybus @ diagVnorm).conj() + diagIbus.conj() @ diagVnorm
+    dS_dVa = 1j * diagV @ (diagIbus - Ybus @ diagV).conj()
+
+    return dS_dVm, dS_dVa
+
+def jacobian(Ybus, V, pvpq, pq):
+    """
+    TARGET:
+        Return the Newton-Raphson jacobian with the unknowns [Va(pvpq), Vm(pq)]
+    """
+    dS_dVm, dS_dVa = dSbus_dV(Ybus, V)
+    dS_dVm = dS_dVm.tocsr()
+    dS_dVa = dS_dVa.tocsr()
+
+    J11 = dS_dVa[pvpq][:, pvpq].real
+    J12 = dS_dVm[pvpq][:, pq].real
+    J21 = dS_dVa[pq][:, pvpq].imag
+    J22 = dS_dVm[pq][:, pq].imag
+
+    return vstack([hstack([J11, J12]), hstack([J21, J22])], format = 'csc')
+
+def mismatch(Ybus, V, Sbus, pvpq, pq):
+    """
+    TARGET:
+        Return the stacked power mismatch [dP(pvpq), dQ(pq)]
+    """
+    mis = V * np.conj(Ybus @ V) - Sbus
+    return np.r_[mis[pvpq].real, mis[pq].imag]
+
+@timed()
+def newton(Ybus, Sbus, V0, pvpq, pq, max_iteration = 30, tolerance_mva = 1e-8):
+    """
+    TARGET:
+        Solve one power flow by Newton-Raphson starting from V0
+        Return the complex voltage, the convergence flag and the number of iterations
+    """
+    V = V0.copy()
+    Va = np.angle(V)
+    Vm = np.abs(V)
+    n_pvpq = len(pvpq)
+
+    F = mismatch(Ybus, V, Sbus, pvpq, pq)
+    converged = np.linalg.norm(F, np.inf) < tolerance_mva
+    iteration = 0
+    while not converged and iteration < max_iteration:
+        iteration += 1
+        with span('jacobian'):
+            J = jacobian(Ybus, V, pvpq, pq)
+        with span('spsolve'):
+            dx = -spsolve(J, F)
+
+        Va[pvpq] += dx[:n_pvpq]
+        Vm[pq] += dx[n_pvpq:]
+        V = Vm * np.exp(1j * Va)
+
+        with span('mismatch'):
+            F = mismatch(Ybus, V, Sbus, pvpq, pq)
+        converged = np.linalg.norm(F, np.inf) < tolerance_mva
+
+    return V, converged, iteration
+
+def injection_matrix(bus_lookup, element, n_bus, baseMVA):
+    """
+    TARGET:
+        Return the sparse (ppc bus x element) matrix which maps the element power (MW/Mvar) to the bus injection (p.u.)
+        The scaling and in_service of the element are included in the matrix
+    """
+    rows = bus_lookup[element['bus'].values]
+    cols = np.arange(element.shape[0])
+    data = element['scaling'].values * element['in_service'].values / baseMVA
+    return csr_matrix((data.astype(float), (rows, cols)), shape = (n_bus, element.shape[0]))
+
+def branch_admittance(branch):
+    """
+    TARGET:
+        Return the from/to admittances (Yff, Yft, Ytf, Ytt) of the pi-model branches (the same model as makeYbus)
+    """
+    stat = branch[:, BR_STATUS].real
+    Ys = stat / (branch[:, BR_R] + 1j * branch[:, BR_X])
+    Bc = stat * branch[:, BR_B]
+    tap = np.ones(branch.shape[0], dtype = complex)
+    has_tap = branch[:, TAP].real != 0
+    tap[has_tap] = branch[has_tap, TAP].real
+    tap = tap * np.exp(1j * np.pi / 180 * branch[:, SHIFT].real)
+
+    Ytt = Ys + 1j * Bc / 2
+    Yff = Ytt / (tap * np.conj(tap))
+    Yft = -Ys / np.conj(tap)
+    Ytf = -Ys / tap
+    return Yff, Yft, Ytf, Ytt
+
+@timed()
+def ppc_arrays(net, max_iteration = 30):
+    """
+    TARGET:
+        Build the internal ppc by a single pp.runpp and return the arrays needed by the runner
+        bus_lookup: pandapower bus index -> ppc bus index, bus_ppc: ppc bus index of each row of net.bus
+        bus and branch are the internal ppc bus and branch matrices
+        line_branch: internal ppc branch of each row of net.line (-1 if out of service, pandapower drops these branches from the internal ppc),
+        line_i_max_ka: the current limit of each line (max_i_ka * df * parallel)
+        trafo_branch: internal ppc branch of each row of net.trafo (-1 if out of service), trafo_i_max_hv_ka/trafo_i_max_lv_ka: the rated currents of the two sides (times df * parallel)
+    """
+    pp.runpp(net, max_iteration = max_iteration)
+    internal = net._ppc['internal']
+    bus_lookup = net._pd2ppc_lookups['bus']
+    line_start, line_end = net._pd2ppc_lookups['branch'].get('line', (0, 0))
+    trafo_start, trafo_end = net._pd2ppc_lookups['branch'].get('trafo', (0, 0))
+    # the lookups index the full ppc, the internal ppc only keeps the branches in service (in the same order)
+    in_service = net._ppc['branch'][:, BR_STATUS].real > 0
+    internal_branch = np.where(in_service, np.cumsum(in_service) - 1, -1)
+    trafo_s_max = (net.trafo['sn_mva'] * net.trafo['df'] * net.trafo['parallel']).values.astype(float)
+
+    return {'baseMVA': internal['baseMVA'],
+            'Ybus': internal['Ybus'].tocsr(),
+            'ref': internal['ref'],
+            'pv': internal['pv'],
+            'pq': internal['pq'],
+            'V': internal['V'].copy(),
+            'Sbus': internal['Sbus'].copy(),
+            'bus': internal['bus'].copy(),
+            'branch': internal['branch'].copy(),
+            'bus_lookup': bus_lookup,
+            'bus_ppc': bus_lookup[net.bus.index.values],
+            'line_branch': internal_branch[line_start:line_end],
+            'line_i_max_ka': (net.line['max_i_ka'] * net.line['df'] * net.line['parallel']).values.astype(float),
+            'trafo_branch': internal_branch[trafo_start:trafo_end],
+            'trafo_i_max_hv_ka': trafo_s_max / (np.sqrt(3) * net.trafo['vn_hv_kv'].values.astype(float)),
+            'trafo_i_max_lv_ka': trafo_s_max / (np.sqrt(3) * net.trafo['vn_lv_kv'].values.astype(float))}
+
+def branch_rows(branch, index):
+    """
+    TARGET:
+        Return the from/to buses and the admittances (Yff, Yft, Ytf, Ytt) of the branches index (-1: out of service, zero admittance)
+    """
+    in_service = np.asarray(index) >= 0
+    rows = np.asarray(branch)[np.where(in_service, index, 0)]
+    f = rows[:, F_BUS].real.astype(int)
+    t = rows[:, T_BUS].real.astype(int)
+    return f, t, tuple(Y * in_service for Y in branch_admittance(rows))
+
+"""
+Runner
+"""
+
+class PowerFlowRunner:
+    """
+    TARGET:
+        Run many power flows on the same network where only the sgen and load injections change
+        The columns of the injection arrays follow the row order of net.sgen and net.load
+        The columns of the voltage arrays follow the row order of net.bus
+    """
+    def __init__(self, net, max_iteration = 30, tolerance_mva = 1e-8):
+        self.net = net
+        self.setup(ppc_arrays(net, max_iteration), net.sgen, net.load, max_iteration, tolerance_mva)
+
+    @classmethod
+    def from_arrays(cls, ppc, sgen, load, max_iteration = 30, tolerance_mva = 1e-8):
+        """
+        TARGET:
+            Build the runner from saved ppc arrays (see ppc_arrays) without converting the net again
+        """
+        runner = cls.__new__(cls)
+        runner.net = None
+        runner.setup(ppc, sgen, load, max_iteration, tolerance_mva)
+        return runner
+
+    @timed('runner_setup')
+    def setup(self, ppc, sgen, load, max_iteration, tolerance_mva):
+        self.ppc = ppc
+        self.max_iteration = max_iteration
+        self.tolerance_mva = tolerance_mva
+
+        self.baseMVA = ppc['baseMVA']
+        self.Ybus = ppc['Ybus'].tocsr()
+        self.ref = np.asarray(ppc['ref'])
+        self.pv = np.asarray(ppc['pv'])
+        self.pq = np.asarray(ppc['pq'])
+        self.pvpq = np.r_[self.pv, self.pq]
+        self.V_base = np.array(ppc['V'])
+        self.bus_ppc = np.asarray(ppc['bus_ppc'])
+        n_bus = self.Ybus.shape[0]
+
+        # ppc bus of each sgen and load
+        self.sgen_bus = ppc['bus_lookup'][sgen['bus'].values]
+        self.load_bus = ppc['bus_lookup'][load['bus'].values]
+        self.C_sgen = injection_matrix(ppc['bus_lookup'], sgen, n_bus, self.baseMVA)
+        self.C_load = injection_matrix(ppc['bus_lookup'], load, n_bus, self.baseMVA)
+
+        # the sgen and load values of the net are the default injections
+        self.sgen_p = sgen['p_mw'].values.astype(float)
+        self.sgen_q = sgen['q_mvar'].values.astype(float)
+        self.load_p = load['p_mw'].values.astype(float)
+        self.load_q = load['q_mvar'].values.astype(float)
+        # the injection which does not come from sgen and load (ext_grid, gen, ...)
+        self.S_const = ppc['Sbus'] - self.injection(self.sgen_p, self.sgen_q, self.load_p, self.load_q)
+
+        # line currents: the branch admittances of the lines and the base current (kA) of their from/to buses
+        self.line_f, self.line_t, self.line_Y = branch_rows(ppc['branch'], ppc['line_branch'])
+        base_kv = np.asarray(ppc['bus'])[:, BASE_KV].real
+        self.line_i_base_f = self.baseMVA / (np.sqrt(3) * base_kv[self.line_f])
+        self.line_i_base_t = self.baseMVA / (np.sqrt(3) * base_kv[self.line_t])
+        self.line_i_max_ka = np.asarray(ppc['line_i_max_ka'])
+
+        # transformer currents: the same branch model, the rated currents of the hv (from) and lv (to) sides
+        self.trafo_f, self.trafo_t, self.trafo_Y = branch_rows(ppc['branch'], ppc['trafo_branch'])
+        self.trafo_i_base_f = self.baseMVA / (np.sqrt(3) * base_kv[self.trafo_f])
+        self.trafo_i_base_t = self.baseMVA / (np.sqrt(3) * base_kv[self.trafo_t])
+        self.trafo_i_max_hv_ka = np.asarray(ppc['trafo_i_max_hv_ka'])
+        self.trafo_i_max_lv_ka = np.asarray(ppc['trafo_i_max_lv_ka'])
+
+    def injection(self, sgen_p, sgen_q, load_p, load_q):
+        """
+        TARGET:
+            Return the bus injection of the sgens and loads in p.u.
+            The inputs are either vectors of one timestep or (T x n) arrays, the output follows the same layout
+        """
+        S_sgen = self.C_sgen @ (np.asarray(sgen_p).T + 1j * np.asarray(sgen_q).T)
+        S_load = self.C_load @ (np.asarray(load_p).T + 1j * np.asarray(load_q).T)
+        return (S_sgen - S_load).T
+
+    @timed('runner_Sbus')
+    def Sbus(self, sgen_p, sgen_q, load_p, load_q):
+        """
+        TARGET:
+            Return the (T x n_bus) bus injection in p.u. in the ppc bus order
+        """
+        return self.S_const + self.injection(sgen_p, sgen_q, load_p, load_q)
+
+    def line_loading(self, V):
+        """
+        TARGET:
+            Return the loading_percent of the lines (row order of net.line) for the voltage V (ppc order, one vector or a batch)
+            The same definition as pandapower: the larger current of the two line ends over max_i_ka * df * parallel
+        """
+        Yff, Yft, Ytf, Ytt = self.line_Y
+        V_f = V[..., self.line_f]
+        V_t = V[..., self.line_t]
+        i_f = np.abs(Yff * V_f + Yft * V_t) * self.line_i_base_f
+        i_t = np.abs(Ytf * V_f + Ytt * V_t) * self.line_i_base_t
+        return np.maximum(i_f, i_t) / self.line_i_max_ka * 100
+
+    def trafo_loading(self, V):
+        """
+        TARGET:
+            Return the loading_percent of the transformers (row order of net.trafo) for the voltage V (ppc order, one vector or a batch)
+            The current loading of pandapower: the larger of the hv and lv currents over the rated currents sn_mva / (sqrt(3) * vn_kv)
+        """
+        Yff, Yft, Ytf, Ytt = self.trafo_Y
+        V_f = V[..., self.trafo_f]
+        V_t = V[..., self.trafo_t]
+        i_hv = np.abs(Yff * V_f + Yft * V_t) * self.trafo_i_base_f
+        i_lv = np.abs(Ytf * V_f + Ytt * V_t) * self.trafo_i_base_t
+        return np.maximum(i_hv / self.trafo_i_max_hv_ka, i_lv / self.trafo_i_max_lv_ka) * 100
+
+    def solve(self, Sbus, V0 = None):
+        """
+        TARGET:
+            Solve a single power flow with the given bus injection (p.u., ppc bus order)
+        """
+        if V0 is None:
+            V0 = self.V_base
+        return newton(self.Ybus, Sbus, V0, self.pvpq, self.pq, self.max_iteration, self.tolerance_mva)
+
+    @timed('runner_run')
+    def run(self, sgen_p = None, sgen_q = None, load_p = None, load_q = None, V0 = None):
+        """
+        TARGET:
+            Run the power flow of T timesteps
+            sgen_p, sgen_q: (T x n_sgen) in MW/Mvar; load_p, load_q: (T x n_load) in MW/Mvar
+            Missing arrays are kept at the values of the net
+            Return vm_pu (T x n_bus), va_degree (T x n_bus) and the convergence flag (T,)
+        """
+        T = None
+        for value in (sgen_p, sgen_q, load_p, load_q):
+            if value is not None:
+                T = np.shape(value)[0]
+                break
+        assert T is not None, 'at least one of the injection arrays should be given'
+
+        n_sgen = len(self.sgen_p)
+        n_load = len(self.load_p)
+        sgen_p = np.broadcast_to(self.sgen_p if sgen_p is None else sgen_p, (T, n_sgen))
+        sgen_q = np.broadcast_to(self.sgen_q if sgen_q is None else sgen_q, (T, n_sgen))
+        load_p = np.broadcast_to(self.load_p if load_p is None else load_p, (T, n_load))
+        load_q = np.broadcast_to(self.load_q if load_q is None else load_q, (T, n_load))
+        Sbus = self.Sbus(sgen_p, sgen_q, load_p, load_q)
+
+        vm_pu = np.empty((T, len(self.bus_ppc)))
+        va_degree = np.empty((T, len(self.bus_ppc)))
+        converged = np.zeros(T, dtype = bool)
+
+        # warm start: initialise each timestep by the solution of the previous one
+        V = self.V_base if V0 is None else V0
+        for t in range(T):
+            V_t, converged[t], _ = self.solve(Sbus[t], V)
+            if converged[t]:
+                V = V_t
+            with span('write_back'):
+                vm_pu[t] = np.abs(V_t[self.bus_ppc])
+                va_degree[t] = np.angle(V_t[self.bus_ppc], deg = True)
+
+        return vm_pu, va_degree, converged
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus33bw', help = "specify the bus name under test")
+    parser.add_argument("--steps", type = int, default = 100, help = "number of timesteps")
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+
+    # randomly perturb the sgen and load around the values of the net
+    sgen_p = runner.sgen_p * np.random.uniform(0, 1, (args.steps, net.sgen.shape[0]))
+    sgen_q = runner.sgen_q * np.random.uniform(-1, 1, (args.steps, net.sgen.shape[0]))
+    load_p = runner.load_p * np.random.uniform(0.8, 1.2, (args.steps, net.load.shape[0]))
+    load_q = runner.load_q * np.random.uniform(0.8, 1.2, (args.steps, net.load.shape[0]))
+
+    start = time.time()
+    vm_pu, va_degree, converged = runner.run(sgen_p, sgen_q, load_p, load_q)
+    print(f'{args.steps} timesteps in {time.time() - start:.3f}s, converged: {converged.sum()}/{args.steps}')
+    print(f'vm_pu range: [{vm_pu.min():.4f}, {vm_pu.max():.4f}]')
@@ -0,0 +1,206 @@
+"""
+PV and load profiles streamed from a memory-mapped file, for long time-series power flow (e.g. one year at 1-minute resolution)
+
+1. A profile file is a directory (e.g. year.profile) with data.npy (timestep x column, float32) and columns.json (the column names and the time resolution).
+   Each column is one time series in p.u. of the peak power, the file is written chunk by chunk and read by memory map, so the year is never loaded at once.
+2. Each row of net.sgen/net.load is mapped to one column by its zone (the sgen name, the zone of the load bus) or by its bus ('bus{index}'),
+   the rows without a matching column use the default column.
+3. The injection of an element is its profile times its setpoint in the net (p_mw, q_mvar at a constant power factor).
+4. ProfileStream.chunks yields the injection arrays (chunk x n_sgen, chunk x n_load) in MW/Mvar for PowerFlowRunner.run,
+   the arrays are preallocated once and overwritten by the next chunk.
+"""
+
+import os
+import json
+import numpy as np
+
+"""
+Functions
+"""
+
+def write_profiles(path, columns, chunks, n_step, resolution_minutes = 1):
+    """
+    TARGET:
+        Write the profile file path from an iterable of (chunk x n_column) blocks which cover n_step timesteps
+    """
+    os.makedirs(path, exist_ok = True)
+    data = np.lib.format.open_memmap(os.path.join(path, 'data.npy'), mode = 'w+', dtype = np.float32, shape = (n_step, len(columns)))
+    t = 0
+    for block in chunks:
+        data[t:t + len(block)] = block
+        t += len(block)
+    assert t == n_step, f'{t} timesteps written, {n_step} expected'
+    data.flush()
+    del data
+
+    with open(os.path.join(path, 'columns.json'), 'w') as f:
+        json.dump({'columns': list(columns), 'resolution_minutes': resolution_minutes}, f, indent = 1)
+
+def synthetic_profiles(columns, pv_columns, n_step, resolution_minutes = 1, chunk = 1440, seed = 0):
+    """
+    TARGET:
+        Yield random profile blocks: a clear-sky PV curve with cloud noise for the pv_columns, a daily load curve for the others
+    """
+    rng = np.random.default_rng(seed)
+    is_pv = np.isin(columns, pv_columns)
+    for t in range(0, n_step, chunk):
+        hour = (np.arange(t, min(t + chunk, n_step)) * resolution_minutes / 60) % 24
+        pv = np.clip(np.sin(np.pi * (hour - 6) / 12), 0, None)[:, None] * rng.uniform(0.6, 1, (len(hour), len(columns)))
+        load = (0.6 + 0.3 * np.sin(np.pi * (hour - 8) / 12) ** 2)[:, None] * rng.uniform(0.9, 1.1, (len(hour), len(columns)))
+        yield np.where(is_pv, pv, load)
+
+def map_columns(keys, columns, default = None):
+    """
+    TARGET:
+        Return the column index of each key, the keys without a column use the default column
+    """
+    position = {name: i for i, name in enumerate(columns)}
+    missing = sorted({key for key in keys if key not in position})
+    if len(missing) > 0 and default is None:
+        raise KeyError(f'no profile column for {missing[:5]} and no default column')
+    if len(missing) > 0 and default not in position:
+        raise KeyError(f'no profile column for {missing[:5]} and the default column {default} is not in the profiles')
+    return np.array([position.get(key, position.get(default)) for key in keys], dtype = int)
+
+def reactive_model(element):
+    """
+    TARGET:
+        Return the peak active power, the q/p ratio (0 where p is 0) and the constant q (where p is 0) of the rows of net.sgen or net.load
+    """
+    p = element['p_mw'].values.astype(float)
+    q = element['q_mvar'].values.astype(float)
+    ratio = np.divide(q, p, out = np.zeros_like(q), where = p != 0)
+    return p, ratio, np.where(p == 0, q, 0.0)
+
+def element_keys(net, table, by):
+    """
+    TARGET:
+        Return the profile key of each row of net.sgen or net.load: the zone ('zone') or 'bus{index}' ('bus')
+    """
+    element = net[table]
+    if by == 'bus':
+        return [f'bus{bus}' for bus in element['bus'].values]
+    if by == 'zone':
+        if table == 'sgen':
+            return list(element['name'].values)
+        return list(net.bus.loc[element['bus'].values, 'zone'].values)
+    raise ValueError(f'unknown mapping {by}, use bus or zone')
+
+"""
+Profiles
+"""
+
+class ProfileSet:
+    """
+    TARGET:
+        Read-only memory map of a profile file
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'columns.json')) as f:
+            meta = json.load(f)
+        self.columns = meta['columns']
+        self.resolution_minutes = meta['resolution_minutes']
+        self.data = np.load(os.path.join(path, 'data.npy'), mmap_mode = 'r')
+        self.n_step = self.data.shape[0]
+
+    def column(self, name):
+        return self.data[:, self.columns.index(name)]
+
+class ProfileStream:
+    """
+    TARGET:
+        Map the columns of a ProfileSet onto the sgens and loads of a net and stream the injections in chunks
+    """
+    def __init__(self, profiles, net, sgen_by = 'zone', load_by = 'zone', sgen_default = None, load_default = None, chunk = 1440):
+        self.profiles = profiles
+        self.chunk = chunk
+        self.sgen_column = map_columns(element_keys(net, 'sgen', sgen_by), profiles.columns, sgen_default)
+        self.load_column = map_columns(element_keys(net, 'load', load_by), profiles.columns, load_default)
+
+        # the setpoints of the net are the peak powers (the scaling of the net is applied by the runner),
+        # q follows p by the q/p ratio of the net, an element without active power keeps its constant q
+        self.sgen_peak, self.sgen_ratio, self.sgen_q_const = reactive_model(net.sgen)
+        self.load_peak, self.load_ratio, self.load_q_const = reactive_model(net.load)
+
+        # preallocated buffers of one chunk
+        n_sgen, n_load = len(self.sgen_column), len(self.load_column)
+        self.raw = np.empty((chunk, len(profiles.columns)))
+        self.sgen_p = np.empty((chunk, n_sgen))
+        self.sgen_q = np.empty((chunk, n_sgen))
+        self.load_p = np.empty((chunk, n_load))
+        self.load_q = np.empty((chunk, n_load))
+
+    def chunks(self, start = 0, stop = None):
+        """
+        TARGET:
+            Yield (first timestep, sgen_p, sgen_q, load_p, load_q) of each chunk in [start, stop)
+            The arrays are views of the preallocated buffers, copy them to keep a chunk
+        """
+        stop = self.profiles.n_step if stop is None else min(stop, self.profiles.n_step)
+        for t in range(start, stop, self.chunk):
+            n = min(self.chunk, stop - t)
+            raw = self.raw[:n]
+            np.copyto(raw, self.profiles.data[t:t + n])
+            np.take(raw, self.sgen_column, axis = 1, out = self.sgen_p[:n])
+            np.take(raw, self.load_column, axis = 1, out = self.load_p[:n])
+            self.sgen_p[:n] *= self.sgen_peak
+            self.load_p[:n] *= self.load_peak
+            np.multiply(self.sgen_p[:n], self.sgen_ratio, out = self.sgen_q[:n])
+            np.multiply(self.load_p[:n], self.load_ratio, out = self.load_q[:n])
+            self.sgen_q[:n] += self.sgen_q_const
+            self.load_q[:n] += self.load_q_const
+            yield t, self.sgen_p[:n], self.sgen_q[:n], self.load_p[:n], self.load_q[:n]
+
+    def run(self, runner, start = 0, stop = None):
+        """
+        TARGET:
+            Yield (first timestep, vm_pu, va_degree, converged) of each chunk solved by the runner, warm-started across the chunks
+        """
+        V0 = runner.V_base.copy()
+        for t, sgen_p, sgen_q, load_p, load_q in self.chunks(start, stop):
+            vm_pu, va_degree, converged = runner.run(sgen_p, sgen_q, load_p, load_q, V0 = V0)
+            # the last converged solution of the chunk in the ppc order (a chunk without one keeps the previous start)
+            last = np.nonzero(converged)[0]
+            if len(last) > 0:
+                V0[runner.bus_ppc] = vm_pu[last[-1]] * np.exp(1j * np.deg2rad(va_degree[last[-1]]))
+            yield t, vm_pu, va_degree, converged
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+    from power_flow import PowerFlowRunner
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus141', help = "specify the bus name under test")
+    parser.add_argument("--profile", default = 'year.profile', help = "profile file, a synthetic one is written if it does not exist")
+    parser.add_argument("--steps", type = int, default = 525600, help = "number of timesteps of the synthetic profile")
+    parser.add_argument("--chunk", type = int, default = 1440, help = "timesteps per chunk")
+    parser.add_argument("--stop", type = int, default = 10080, help = "number of timesteps to solve")
+    args = parser.parse_args()
+
+    net = pp.from_pickle(f'{args.bus}.p')
+    if not os.path.exists(args.profile):
+        # one PV column per zone and one load column for all the loads
+        pv_columns = sorted(set(net.sgen['name']))
+        columns = pv_columns + ['load']
+        write_profiles(args.profile, columns, synthetic_profiles(columns, pv_columns, args.steps), args.steps)
+
+    profiles = ProfileSet(args.profile)
+    stream = ProfileStream(profiles, net, load_default = 'load', chunk = args.chunk)
+    runner = PowerFlowRunner(net)
+
+    start = time.time()
+    n_step, n_converged, vm_max = 0, 0, 0
+    for t, vm_pu, _, converged in stream.run(runner, stop = args.stop):
+        n_step += len(converged)
+        n_converged += converged.sum()
+        vm_max = max(vm_max, vm_pu.max())
+    elapsed = time.time() - start
+    print(f'{n_step} timesteps in {elapsed:.2f}s ({n_step / elapsed:.0f} steps/s), converged: {n_converged}/{n_step}, max vm_pu: {vm_max:.4f}')
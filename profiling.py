@@ -0,0 +1,208 @@
+"""
+Opt-in instrumentation of the network generation and the power flow
+
+1. The instrumented code is wrapped in span('name') blocks (or the @timed decorator), the spans nest into call paths.
+2. Nothing is measured until enable() is called or the environment variable GEN_PROFILE is set to a report path,
+   a disabled span only checks one flag.
+3. Each span records its wall time, the time spent outside its child spans (self time) and, with memory = True (GEN_PROFILE_MEMORY=1),
+   the net memory allocated in the span by tracemalloc.
+4. The spans are aggregated by name: count, total/min/max time, a log2 histogram of the durations in microseconds and the allocated bytes.
+5. write_report writes the aggregate as JSON and the self time of each call path in the folded stack format of flamegraph.pl / speedscope (.folded).
+   With GEN_PROFILE set, every process writes its report when it exits, including the pool workers (which skip atexit):
+   a {pid} in the path is replaced by the process id, a worker process without {pid} writes to <path>.<pid>.json.
+6. The open spans are kept per thread (the zones of decomposed.py and the batches of service.py run in threads), the aggregate of all the threads is shared under a lock.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import tracemalloc
+import multiprocessing
+from multiprocessing import util
+from math import inf, log2
+
+N_BUCKET = 32
+
+ENABLED = False
+MEMORY = False
+LOCAL = threading.local()   # LOCAL.stack: open spans of the thread, [name, start, child time, memory at the start]
+LOCK = threading.Lock()     # guards STATS and FOLDED, the spans of all the threads are aggregated together
+STATS = {}                  # name -> aggregate
+FOLDED = {}                 # call path -> self time (s)
+
+"""
+Control
+"""
+
+def enable(memory = False):
+    global ENABLED, MEMORY
+    ENABLED = True
+    MEMORY = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+def reset():
+    LOCAL.stack = []
+    with LOCK:
+        STATS.clear()
+        FOLDED.clear()
+
+def stack():
+    if not hasattr(LOCAL, 'stack'):
+        LOCAL.stack = []
+    return LOCAL.stack
+
+"""
+Spans
+"""
+
+class span:
+    """
+    TARGET:
+        Context manager which measures the enclosed block under the given name
+    """
+    __slots__ = ['name', 'active']
+
+    def __init__(self, name):
+        self.name = name
+        self.active = False
+
+    def __enter__(self):
+        if ENABLED:
+            self.active = True
+            memory = tracemalloc.get_traced_memory()[0] if MEMORY else 0
+            stack().append([self.name, time.perf_counter(), 0.0, memory])
+        return self
+
+    def __exit__(self, *args):
+        if not self.active:
+            return False
+        end = time.perf_counter()
+        frames = stack()
+        path = ';'.join(frame[0] for frame in frames)
+        name, start, child, memory = frames.pop()
+        elapsed = end - start
+        allocated = tracemalloc.get_traced_memory()[0] - memory if MEMORY else 0
+        if frames:
+            frames[-1][2] += elapsed
+        record(name, path, elapsed, elapsed - child, allocated)
+        self.active = False
+        return False
+
+def timed(name = None):
+    """
+    TARGET:
+        Decorator which wraps every call of the function in a span (default name: the function name)
+    """
+    def decorator(function):
+        label = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with span(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record(name, path, elapsed, self_time, allocated):
+    bucket = min(int(log2(max(elapsed * 1e6, 1))), N_BUCKET - 1)
+    with LOCK:
+        stats = STATS.get(name)
+        if stats is None:
+            stats = STATS[name] = {'count': 0, 'total': 0.0, 'self': 0.0, 'min': inf, 'max': 0.0,
+                                   'allocated': 0, 'histogram': [0] * N_BUCKET}
+        stats['count'] += 1
+        stats['total'] += elapsed
+        stats['self'] += self_time
+        stats['min'] = min(stats['min'], elapsed)
+        stats['max'] = max(stats['max'], elapsed)
+        stats['allocated'] += allocated
+        stats['histogram'][bucket] += 1
+        FOLDED[path] = FOLDED.get(path, 0.0) + self_time
+
+"""
+Report
+"""
+
+def report():
+    """
+    TARGET:
+        Return the aggregate of the spans, sorted by total time
+        histogram[k] is the number of spans which took [2^k, 2^(k+1)) microseconds
+    """
+    spans = {}
+    with LOCK:
+        items = sorted(((name, dict(stats, histogram = list(stats['histogram']))) for name, stats in STATS.items()),
+                       key = lambda item: -item[1]['total'])
+    for name, stats in items:
+        spans[name] = {'count': stats['count'],
+                       'total_s': stats['total'],
+                       'self_s': stats['self'],
+                       'mean_s': stats['total'] / stats['count'],
+                       'min_s': stats['min'],
+                       'max_s': stats['max'],
+                       'allocated_bytes': int(stats['allocated']),
+                       'histogram_log2_us': stats['histogram'][:max(k + 1 for k, n in enumerate(stats['histogram']) if n > 0)]}
+    return {'memory': MEMORY, 'spans': spans}
+
+def write_report(path):
+    """
+    TARGET:
+        Write the JSON report to path and the folded stacks (self time in microseconds) to path without .json + .folded
+    """
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent = 1)
+    with LOCK:
+        folded = sorted(FOLDED.items())
+    with open(os.path.splitext(path)[0] + '.folded', 'w') as f:
+        for path_name, self_time in folded:
+            f.write(f'{path_name} {int(round(self_time * 1e6))}\n')
+
+"""
+Environment
+"""
+
+FLUSHED = []
+
+def report_path(path):
+    """
+    TARGET:
+        Return the report path of this process: {pid} is replaced, a worker process gets its pid appended if there is no {pid}
+    """
+    if '{pid}' in path:
+        return path.replace('{pid}', str(os.getpid()))
+    if multiprocessing.parent_process() is not None:
+        root, ext = os.path.splitext(path)
+        return f'{root}.{os.getpid()}{ext}'
+    return path
+
+def flush():
+    """
+    TARGET:
+        Write the report of GEN_PROFILE once per process
+    """
+    if os.getpid() in FLUSHED or not STATS:
+        return
+    FLUSHED.append(os.getpid())
+    write_report(report_path(os.environ['GEN_PROFILE']))
+
+def after_fork(module):
+    # a forked worker starts without the spans of its parent, and its finalizers were cleared by multiprocessing
+    reset()
+    util.Finalize(None, flush, exitpriority = 0)
+
+if os.environ.get('GEN_PROFILE'):
+    enable(memory = os.environ.get('GEN_PROFILE_MEMORY') == '1')
+    # atexit for the main process, Finalize for the multiprocessing workers which leave by os._exit after running the finalizers
+    atexit.register(flush)
+    util.Finalize(None, flush, exitpriority = 0)
+    util.register_after_fork(sys.modules[__name__], after_fork)
@@ -0,0 +1,208 @@
+"""
+Vectorized backward/forward sweep power flow for the radial networks (bus33bw, bus141, bus322 and the generated ones)
+
+1. The tree (parent of each bus and the bus levels from the slack bus) is built once from the in-service branches of the ppc (the lines and transformers of the net).
+2. Each branch is the pi-model with an ideal transformer (tap ratio and phase shift) of the ppc, so the sweep gives the same solution as runpp.
+3. Backward sweep: from the deepest level to the slack, the current drawn by each subtree is summed into its parent.
+4. Forward sweep: from the slack to the deepest level, the voltage of each bus is updated from its parent voltage and subtree current.
+5. All the scenarios are solved at once: the voltages and currents are (scenario x bus) matrices.
+Only PQ buses are supported besides the slack bus (no gen in the saved networks).
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from scipy.sparse.csgraph import breadth_first_order
+from pandapower.pypower.idx_brch import F_BUS, T_BUS, BR_STATUS
+from pandapower.pypower.idx_bus import GS, BS
+from power_flow import PowerFlowRunner, branch_admittance
+from profiling import timed
+
+"""
+Functions
+"""
+
+def radial_tree(f_bus, t_bus, n_bus, root):
+    """
+    TARGET:
+        Return the BFS order, the parent bus and the branch to the parent of every bus in a radial network
+        Raise an error if the network is not radial and connected
+    """
+    n_branch = len(f_bus)
+    if n_branch != n_bus - 1:
+        raise ValueError(f'the network is not radial: {n_branch} branches for {n_bus} buses')
+
+    # adjacency with the (branch index + 1) as the data, so the branch of each tree edge can be read back
+    adjacency = csr_matrix((np.r_[np.arange(n_branch), np.arange(n_branch)] + 1, (np.r_[f_bus, t_bus], np.r_[t_bus, f_bus])), shape = (n_bus, n_bus))
+    order, parent = breadth_first_order(adjacency, root, directed = False, return_predecessors = True)
+    if len(order) != n_bus:
+        raise ValueError(f'the network is not connected: {n_bus - len(order)} buses are not reachable from the slack bus')
+
+    child = order[1:]
+    parent_branch = np.full(n_bus, -1, dtype = int)
+    parent_branch[child] = np.asarray(adjacency[parent[child], child]).ravel().astype(int) - 1
+    parent = np.where(parent < 0, -1, parent)
+
+    return order, parent, parent_branch
+
+"""
+Solver
+"""
+
+class RadialSweep:
+    """
+    TARGET:
+        Batched backward/forward sweep on the ppc of a PowerFlowRunner (the injections and the bus order are the same as the runner)
+    """
+    def __init__(self, runner, max_iteration = 100, tolerance_mva = 1e-8):
+        self.runner = runner
+        self.max_iteration = max_iteration
+        self.tolerance_mva = tolerance_mva
+
+        ppc = runner.ppc
+        if len(runner.pv) > 0 or len(runner.ref) != 1:
+            raise ValueError('the radial sweep only supports one slack bus and PQ buses')
+        self.root = int(runner.ref[0])
+
+        branch = np.asarray(ppc['branch'])
+        branch = branch[branch[:, BR_STATUS].real > 0]
+        f_bus = branch[:, F_BUS].real.astype(int)
+        t_bus = branch[:, T_BUS].real.astype(int)
+        n_bus = runner.Ybus.shape[0]
+        Yff, Yft, Ytf, Ytt = branch_admittance(branch)
+
+        # bus shunt admittance (p.u.)
+        bus = np.asarray(ppc['bus'])
+        self.Ysh = (bus[:, GS].real + 1j * bus[:, BS].real) / ppc['baseMVA']
+
+        # the branch model should rebuild the Ybus of pandapower
+        n_branch = branch.shape[0]
+        Cf = csr_matrix((np.ones(n_branch), (np.arange(n_branch), f_bus)), shape = (n_branch, n_bus))
+        Ct = csr_matrix((np.ones(n_branch), (np.arange(n_branch), t_bus)), shape = (n_branch, n_bus))
+        Ybus = Cf.T @ (diags(Yff) @ Cf + diags(Yft) @ Ct) + Ct.T @ (diags(Ytf) @ Cf + diags(Ytt) @ Ct) + diags(self.Ysh)
+        if abs(Ybus - runner.Ybus).max() > 1e-6 * abs(runner.Ybus).max():
+            raise ValueError('the branch model does not match the Ybus of pandapower')
+
+        order, parent, parent_branch = radial_tree(f_bus, t_bus, n_bus, self.root)
+
+        # orient the branch admittances from the parent (p) to the child (c)
+        child = order[1:]
+        k = parent_branch[child]
+        from_parent = f_bus[k] == parent[child]
+        Ypp = np.where(from_parent, Yff[k], Ytt[k])
+        Ypc = np.where(from_parent, Yft[k], Ytf[k])
+        Ycp = np.where(from_parent, Ytf[k], Yft[k])
+        Ycc = np.where(from_parent, Ytt[k], Yff[k])
+
+        # the levels: the buses with the same distance to the slack bus
+        depth = np.zeros(n_bus, dtype = int)
+        depth_list = depth.tolist()
+        parent_list = parent.tolist()
+        for c in child.tolist():
+            depth_list[c] = depth_list[parent_list[c]] + 1
+        depth = np.array(depth_list, dtype = int)
+
+        self.levels = []
+        child_depth = depth[child]
+        for level in range(1, depth.max() + 1):
+            index = np.nonzero(child_depth == level)[0]
+            c = child[index]
+            p = parent[c]
+            # sum the children currents into the (unique) parents by a sparse matrix
+            unique_parent, position = np.unique(p, return_inverse = True)
+            to_parent = csr_matrix((np.ones(len(c)), (position, np.arange(len(c)))), shape = (len(unique_parent), len(c)))
+            self.levels.append({'child': c, 'parent': p, 'unique_parent': unique_parent, 'to_parent': to_parent,
+                                'Ypp': Ypp[index], 'Ypc': Ypc[index], 'Ycp': Ycp[index], 'Ycc': Ycc[index]})
+
+        self.pq = runner.pq
+
+    def solve(self, Sbus, V0 = None):
+        """
+        TARGET:
+            Solve the power flow of a batch of bus injections Sbus (scenario x ppc bus, p.u.)
+            V0 is one voltage vector for all the scenarios or one per scenario
+            Return the complex voltages (scenario x ppc bus), the convergence flags and the number of iterations
+        """
+        Sbus = np.atleast_2d(Sbus)
+        V = np.array(np.broadcast_to(self.runner.V_base if V0 is None else V0, Sbus.shape), dtype = complex)
+        Ybus = self.runner.Ybus
+
+        converged = np.zeros(Sbus.shape[0], dtype = bool)
+        iteration = 0
+        while True:
+            # mismatch of the PQ buses (the same criterion as newton), also checked after the last sweep
+            mis = V * np.conj((Ybus @ V.T).T) - Sbus
+            error = np.maximum(np.abs(mis[:, self.pq].real), np.abs(mis[:, self.pq].imag)).max(axis = 1, initial = 0)
+            converged = error < self.tolerance_mva
+            if converged.all() or iteration >= self.max_iteration:
+                break
+            iteration += 1
+
+            # current injected into the network at each bus
+            I_inj = np.conj(Sbus / V) - self.Ysh * V
+
+            # backward sweep: J is the current drawn by the subtree of each bus from its parent branch
+            J = -I_inj
+            for level in reversed(self.levels):
+                c, p = level['child'], level['parent']
+                V_c = (-J[:, c] - level['Ycp'] * V[:, p]) / level['Ycc']
+                I_p = level['Ypp'] * V[:, p] + level['Ypc'] * V_c
+                J[:, level['unique_parent']] += (level['to_parent'] @ I_p.T).T
+
+            # forward sweep
+            for level in self.levels:
+                c, p = level['child'], level['parent']
+                V[:, c] = (-J[:, c] - level['Ycp'] * V[:, p]) / level['Ycc']
+
+        return V, converged, iteration
+
+    @timed('radial_sweep_run')
+    def run(self, sgen_p = None, sgen_q = None, load_p = None, load_q = None):
+        """
+        TARGET:
+            Solve S scenarios at once, the inputs are (S x n_sgen) and (S x n_load) in MW/Mvar as in PowerFlowRunner.run
+            Return vm_pu (S x n_bus), va_degree (S x n_bus) and the convergence flag (S,)
+        """
+        runner = self.runner
+        S = next(np.shape(value)[0] for value in (sgen_p, sgen_q, load_p, load_q) if value is not None)
+        sgen_p = np.broadcast_to(runner.sgen_p if sgen_p is None else sgen_p, (S, len(runner.sgen_p)))
+        sgen_q = np.broadcast_to(runner.sgen_q if sgen_q is None else sgen_q, (S, len(runner.sgen_p)))
+        load_p = np.broadcast_to(runner.load_p if load_p is None else load_p, (S, len(runner.load_p)))
+        load_q = np.broadcast_to(runner.load_q if load_q is None else load_q, (S, len(runner.load_p)))
+
+        V, converged, _ = self.solve(runner.Sbus(sgen_p, sgen_q, load_p, load_q))
+        V = V[:, runner.bus_ppc]
+        return np.abs(V), np.angle(V, deg = True), converged
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name under test")
+    parser.add_argument("--scenarios", type = int, default = 1000, help = "number of scenarios")
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+    sweep = RadialSweep(runner)
+
+    sgen_p = runner.sgen_p * np.random.uniform(0, 1, (args.scenarios, net.sgen.shape[0]))
+    sgen_q = runner.sgen_q * np.random.uniform(-1, 1, (args.scenarios, net.sgen.shape[0]))
+
+    start = time.time()
+    vm_sweep, va_sweep, converged = sweep.run(sgen_p, sgen_q)
+    time_sweep = time.time() - start
+
+    start = time.time()
+    vm_nr, va_nr, _ = runner.run(sgen_p, sgen_q)
+    time_nr = time.time() - start
+
+    print(f'sweep: {time_sweep:.3f}s, newton: {time_nr:.3f}s, speedup: {time_nr / time_sweep:.1f}x, converged: {converged.sum()}/{args.scenarios}')
+    print(f'max vm difference: {np.abs(vm_sweep - vm_nr).max():.2e} pu, max va difference: {np.abs(va_sweep - va_nr).max():.2e} degree')
@@ -0,0 +1,268 @@
+"""
+Power flow with a fallback sequence and convergence diagnostics
+
+1. Every call is warm-started: run_net uses the previous results of the net (init = 'results'), RobustSolver the previous voltage.
+2. A case which does not converge is retried by the fallback stages in order:
+   damped Newton-Raphson (iwamoto_nr in pandapower, a backtracking step here), a flat (or dc) start with more iterations, the radial backward/forward sweep.
+3. The iteration count, the final mismatch (max |dS| in p.u.) and the solve time of each call are returned with the solution.
+4. PowerFlowStats aggregates them into counters (calls, attempts/successes per stage, iteration histogram, time and mismatch totals),
+   the counters of several workers are combined by merge and saved by as_dict.
+"""
+
+import time
+import numpy as np
+import pandapower as pp
+from pandapower.powerflow import LoadflowNotConverged
+from scipy.sparse.linalg import spsolve
+from power_flow import jacobian, mismatch, newton
+from profiling import timed
+
+"""
+Statistics
+"""
+
+class PowerFlowStats:
+    """
+    TARGET:
+        Counters of the power flow calls, cheap to update and to merge across millions of runs
+    """
+    def __init__(self, stages = ()):
+        self.calls = 0
+        self.converged = 0
+        self.attempts = {stage: 0 for stage in stages}
+        self.successes = {stage: 0 for stage in stages}
+        self.iterations = np.zeros(1, dtype = np.int64)   # histogram of the iterations of the converged calls
+        self.time_total = 0.0
+        self.time_max = 0.0
+        self.mismatch_max = 0.0
+
+    def attempt(self, stage, converged):
+        self.attempts[stage] = self.attempts.get(stage, 0) + 1
+        self.successes[stage] = self.successes.get(stage, 0) + int(converged)
+
+    def record(self, converged, iterations, mismatch_norm, elapsed):
+        self.calls += 1
+        self.converged += int(converged)
+        if converged:
+            if iterations >= len(self.iterations):
+                self.iterations = np.r_[self.iterations, np.zeros(iterations + 1 - len(self.iterations), dtype = np.int64)]
+            self.iterations[iterations] += 1
+        self.time_total += elapsed
+        self.time_max = max(self.time_max, elapsed)
+        if np.isfinite(mismatch_norm):
+            self.mismatch_max = max(self.mismatch_max, mismatch_norm)
+
+    def merge(self, other):
+        """
+        TARGET:
+            Add the counters of other (e.g. from another worker) into self
+        """
+        self.calls += other.calls
+        self.converged += other.converged
+        for stage in other.attempts:
+            self.attempts[stage] = self.attempts.get(stage, 0) + other.attempts[stage]
+            self.successes[stage] = self.successes.get(stage, 0) + other.successes[stage]
+        n = max(len(self.iterations), len(other.iterations))
+        self.iterations = np.pad(self.iterations, (0, n - len(self.iterations))) + np.pad(other.iterations, (0, n - len(other.iterations)))
+        self.time_total += other.time_total
+        self.time_max = max(self.time_max, other.time_max)
+        self.mismatch_max = max(self.mismatch_max, other.mismatch_max)
+        return self
+
+    def as_dict(self):
+        n_converged = max(self.iterations.sum(), 1)
+        return {'calls': self.calls,
+                'converged': self.converged,
+                'failed': self.calls - self.converged,
+                'attempts': dict(self.attempts),
+                'successes': dict(self.successes),
+                'iterations_mean': float((self.iterations * np.arange(len(self.iterations))).sum() / n_converged),
+                'iterations_histogram': self.iterations.tolist(),
+                'time_total': self.time_total,
+                'time_mean': self.time_total / max(self.calls, 1),
+                'time_max': self.time_max,
+                'mismatch_max': self.mismatch_max}
+
+"""
+pandapower net
+"""
+
+NET_STAGES = ['warm', 'damped', 'flat', 'dc', 'radial']
+
+def net_mismatch(net):
+    """
+    TARGET:
+        Return the max power mismatch (p.u.) of the last power flow of the net
+    """
+    internal = net._ppc['internal']
+    pvpq = np.r_[internal['pv'], internal['pq']]
+    F = mismatch(internal['Ybus'], internal['V'], internal['Sbus'], pvpq, internal['pq'])
+    return float(np.abs(F).max(initial = 0))
+
+@timed()
+def run_net(net, stats = None, max_iteration = 30, **kwargs):
+    """
+    TARGET:
+        pp.runpp with the fallback sequence, the net keeps the results of the first converged stage
+        Return the diagnostics {'converged', 'stage', 'iterations', 'mismatch', 'time'} of the call
+    """
+    warm = net.res_bus.shape[0] == net.bus.shape[0] and not net.res_bus['vm_pu'].isnull().any()
+    stages = [('warm', {'init': 'results' if warm else 'auto'}),
+              ('damped', {'algorithm': 'iwamoto_nr', 'init': 'auto'}),
+              ('flat', {'init': 'flat', 'max_iteration': 2 * max_iteration}),
+              ('dc', {'init': 'dc', 'max_iteration': 2 * max_iteration}),
+              ('radial', {'algorithm': 'bfsw', 'init': 'flat', 'max_iteration': 4 * max_iteration})]
+
+    start = time.perf_counter()
+    result = {'converged': False, 'stage': None, 'iterations': 0, 'mismatch': np.inf}
+    for stage, options in stages:
+        try:
+            pp.runpp(net, **{'max_iteration': max_iteration, **kwargs, **options})
+            converged = True
+        except LoadflowNotConverged:
+            converged = False
+        if stats is not None:
+            stats.attempt(stage, converged)
+        if converged:
+            result.update(converged = True, stage = stage, iterations = int(net._ppc['iterations']), mismatch = net_mismatch(net))
+            break
+    result['time'] = time.perf_counter() - start
+
+    if stats is not None:
+        stats.record(result['converged'], result['iterations'], result['mismatch'], result['time'])
+    return result
+
+"""
+Runner
+"""
+
+RUNNER_STAGES = ['warm', 'damped', 'flat', 'radial']
+
+def damped_newton(Ybus, Sbus, V0, pvpq, pq, max_iteration = 30, tolerance_mva = 1e-8, min_step = 1 / 64):
+    """
+    TARGET:
+        Newton-Raphson with a backtracking step: the step is halved until the mismatch decreases
+        Return the complex voltage, the convergence flag and the number of iterations
+    """
+    Va = np.angle(V0)
+    Vm = np.abs(V0)
+    V = V0.copy()
+    n_pvpq = len(pvpq)
+
+    F = mismatch(Ybus, V, Sbus, pvpq, pq)
+    norm = np.linalg.norm(F, np.inf)
+    iteration = 0
+    while norm >= tolerance_mva and iteration < max_iteration:
+        iteration += 1
+        dx = -spsolve(jacobian(Ybus, V, pvpq, pq), F)
+        step = 1.0
+        while True:
+            Va_new = Va.copy()
+            Vm_new = Vm.copy()
+            Va_new[pvpq] += step * dx[:n_pvpq]
+            Vm_new[pq] += step * dx[n_pvpq:]
+            V_new = Vm_new * np.exp(1j * Va_new)
+            F_new = mismatch(Ybus, V_new, Sbus, pvpq, pq)
+            norm_new = np.linalg.norm(F_new, np.inf)
+            if norm_new < norm or step <= min_step:
+                break
+            step /= 2
+        Va, Vm, V, F, norm = Va_new, Vm_new, V_new, F_new, norm_new
+
+    return V, norm < tolerance_mva, iteration
+
+class RobustSolver:
+    """
+    TARGET:
+        Warm-started power flow of a PowerFlowRunner with the fallback sequence and the diagnostics of each call
+        sweep: an optional RadialSweep of the same runner for the last stage
+    """
+    def __init__(self, runner, sweep = None, stats = None):
+        self.runner = runner
+        self.sweep = sweep
+        self.stats = PowerFlowStats(RUNNER_STAGES) if stats is None else stats
+        self.V = runner.V_base.copy()
+
+    def stages(self, Sbus):
+        runner = self.runner
+        args = (runner.Ybus, Sbus)
+        yield 'warm', lambda: newton(*args, self.V, runner.pvpq, runner.pq, runner.max_iteration, runner.tolerance_mva)
+        yield 'damped', lambda: damped_newton(*args, self.V, runner.pvpq, runner.pq, 2 * runner.max_iteration, runner.tolerance_mva)
+        yield 'flat', lambda: newton(*args, runner.V_base, runner.pvpq, runner.pq, 2 * runner.max_iteration, runner.tolerance_mva)
+        if self.sweep is not None:
+            def radial():
+                V, converged, iteration = self.sweep.solve(Sbus, runner.V_base)
+                return V[0], bool(converged[0]), iteration
+            yield 'radial', radial
+
+    def solve(self, Sbus):
+        """
+        TARGET:
+            Solve one power flow (bus injection in p.u., ppc order), the next call starts from the converged solution
+            Return the complex voltage (ppc order) and the diagnostics {'converged', 'stage', 'iterations', 'mismatch', 'time'}
+        """
+        runner = self.runner
+        start = time.perf_counter()
+        result = {'converged': False, 'stage': None, 'iterations': 0}
+        V = self.V
+        for stage, solve in self.stages(Sbus):
+            V, converged, iteration = solve()
+            result['iterations'] += iteration
+            self.stats.attempt(stage, converged)
+            if converged:
+                result.update(converged = True, stage = stage)
+                self.V = V
+                break
+        result['mismatch'] = float(np.abs(mismatch(runner.Ybus, V, Sbus, runner.pvpq, runner.pq)).max(initial = 0))
+        result['time'] = time.perf_counter() - start
+        self.stats.record(result['converged'], result['iterations'], result['mismatch'], result['time'])
+        return V, result
+
+    def run(self, sgen_p, sgen_q, load_p, load_q):
+        """
+        TARGET:
+            Solve T timesteps ((T x n_sgen), (T x n_load) in MW/Mvar)
+            Return vm_pu (T x n_bus), va_degree (T x n_bus), the convergence flag (T,) and the stage of each timestep
+        """
+        runner = self.runner
+        Sbus = runner.Sbus(sgen_p, sgen_q, load_p, load_q)
+        T = Sbus.shape[0]
+        vm_pu = np.empty((T, len(runner.bus_ppc)))
+        va_degree = np.empty((T, len(runner.bus_ppc)))
+        converged = np.zeros(T, dtype = bool)
+        stage = []
+        for t in range(T):
+            V, result = self.solve(Sbus[t])
+            vm_pu[t] = np.abs(V[runner.bus_ppc])
+            va_degree[t] = np.angle(V[runner.bus_ppc], deg = True)
+            converged[t] = result['converged']
+            stage.append(result['stage'])
+        return vm_pu, va_degree, converged, stage
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import json
+    import argparse
+    from power_flow import PowerFlowRunner
+    from radial_sweep import RadialSweep
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus141', help = "specify the bus name under test")
+    parser.add_argument("--steps", type = int, default = 1000, help = "number of timesteps")
+    parser.add_argument("--stress", type = float, default = 3.0, help = "max multiple of the sgen power")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+    solver = RobustSolver(runner, RadialSweep(runner))
+
+    T = args.steps
+    sgen_p = runner.sgen_p * rng.uniform(0, args.stress, (T, len(runner.sgen_p)))
+    solver.run(sgen_p, np.broadcast_to(runner.sgen_q, sgen_p.shape),
+               np.broadcast_to(runner.load_p, (T, len(runner.load_p))), np.broadcast_to(runner.load_q, (T, len(runner.load_q))))
+    print(json.dumps(solver.stats.as_dict(), indent = 1))
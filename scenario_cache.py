@@ -0,0 +1,209 @@
+"""
+Memoized power flow results of repeated scenarios (RL rollouts, sweeps over the same profiles and quantized actions)
+
+1. A scenario is keyed by the network key (a hash of the Ybus and injection matrices, the same in every process) and
+   the sgen/load setpoint vectors quantized to resolution_mw / resolution_mvar.
+2. The scenarios of a key are solved at their quantized setpoints, so a cached result is exactly the result of its key whichever scenario came first.
+3. The converged results (vm_pu, va_degree) are kept in memory with LRU eviction within max_bytes, a diverged scenario is solved again on its next query.
+4. With a cache directory, every solved scenario is also written (atomically) to <directory>/<network key>/<scenario key>.npz,
+   so the workers sharing the directory reuse each other's results and the cache survives the process.
+5. The cache counts the memory hits, disk hits, misses and evictions, and apart the scenarios repeated within a batch (batch_repeats),
+   which are solved once with their first occurrence but are not lookups of the cache, so they are left out of the hit rate.
+"""
+
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from atomic_file import write_atomic
+
+"""
+Functions
+"""
+
+def network_key(runner):
+    """
+    TARGET:
+        Return a hash of the network of a PowerFlowRunner (admittance, injection matrices, bus types and base voltage)
+    """
+    digest = hashlib.sha1()
+    for value in (runner.Ybus.data, runner.Ybus.indices, runner.Ybus.indptr,
+                  runner.C_sgen.data, runner.C_sgen.indices, runner.C_sgen.indptr, runner.C_sgen.shape,
+                  runner.C_load.data, runner.C_load.indices, runner.C_load.indptr, runner.C_load.shape,
+                  runner.pv, runner.pq, runner.V_base, runner.bus_ppc):
+        digest.update(np.ascontiguousarray(value).tobytes())
+    return digest.hexdigest()
+
+"""
+Cache
+"""
+
+class ScenarioCache:
+    """
+    TARGET:
+        LRU cache of the power flow results within max_bytes, optionally persisted in a directory shared by the workers
+    """
+    def __init__(self, max_bytes = 256 * 2**20, directory = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.batch_repeats = 0
+
+    def path(self, network, key):
+        return os.path.join(self.directory, network, f'{key}.npz')
+
+    def get(self, network, key):
+        entry = self.entries.get((network, key))
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end((network, key))
+            return entry
+        if self.directory is not None and os.path.exists(self.path(network, key)):
+            with np.load(self.path(network, key)) as data:
+                entry = (data['vm_pu'], data['va_degree'], bool(data['converged']))
+            self.disk_hits += 1
+            self.put(network, key, entry, persist = False)
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, network, key, entry, persist = True):
+        if (network, key) in self.entries:
+            return
+        self.entries[(network, key)] = entry
+        self.nbytes += entry[0].nbytes + entry[1].nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, (vm_pu, va_degree, _) = self.entries.popitem(last = False)
+            self.nbytes -= vm_pu.nbytes + va_degree.nbytes
+            self.evictions += 1
+        if persist and self.directory is not None:
+            os.makedirs(os.path.join(self.directory, network), exist_ok = True)
+            vm_pu, va_degree, converged = entry
+            write_atomic(self.path(network, key), lambda f: np.savez(f, vm_pu = vm_pu, va_degree = va_degree, converged = converged))
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'batch_repeats': self.batch_repeats,
+                'hit_rate': (self.hits + self.disk_hits) / max(lookups, 1)}
+
+"""
+Power flow
+"""
+
+class CachedPowerFlow:
+    """
+    TARGET:
+        PowerFlowRunner.run in front of a ScenarioCache: the repeated (quantized) scenarios return the stored voltages
+    """
+    def __init__(self, runner, cache = None, resolution_mw = 1e-4, resolution_mvar = 1e-4):
+        self.runner = runner
+        self.cache = ScenarioCache() if cache is None else cache
+        self.network = network_key(runner)
+        self.resolution = np.array([resolution_mw, resolution_mvar, resolution_mw, resolution_mvar])
+
+    def quantize(self, sgen_p, sgen_q, load_p, load_q):
+        """
+        TARGET:
+            Return the integer setpoints (S x (2 n_sgen + 2 n_load)) in units of the resolution
+        """
+        values = [np.round(np.asarray(value, dtype = float) / resolution).astype(np.int64)
+                  for value, resolution in zip((sgen_p, sgen_q, load_p, load_q), self.resolution)]
+        return np.hstack(values)
+
+    def run(self, sgen_p = None, sgen_q = None, load_p = None, load_q = None):
+        """
+        TARGET:
+            Same as PowerFlowRunner.run: return vm_pu (S x n_bus), va_degree (S x n_bus) and the convergence flag (S,)
+            Only the scenarios missing in the cache are solved (each distinct one once, warm-started in order)
+        """
+        runner = self.runner
+        S = next(np.shape(value)[0] for value in (sgen_p, sgen_q, load_p, load_q) if value is not None)
+        n_sgen = len(runner.sgen_p)
+        n_load = len(runner.load_p)
+        quantized = self.quantize(np.broadcast_to(runner.sgen_p if sgen_p is None else sgen_p, (S, n_sgen)),
+                                  np.broadcast_to(runner.sgen_q if sgen_q is None else sgen_q, (S, n_sgen)),
+                                  np.broadcast_to(runner.load_p if load_p is None else load_p, (S, n_load)),
+                                  np.broadcast_to(runner.load_q if load_q is None else load_q, (S, n_load)))
+        keys = [hashlib.sha1(row.tobytes()).hexdigest() for row in quantized]
+
+        vm_pu = np.empty((S, len(runner.bus_ppc)))
+        va_degree = np.empty((S, len(runner.bus_ppc)))
+        converged = np.zeros(S, dtype = bool)
+        missing = {}
+        for s, key in enumerate(keys):
+            if key in missing:
+                # repeated within the batch: solved once
+                missing[key].append(s)
+                self.cache.batch_repeats += 1
+                continue
+            entry = self.cache.get(self.network, key)
+            if entry is None:
+                missing.setdefault(key, []).append(s)
+            else:
+                vm_pu[s], va_degree[s], converged[s] = entry
+
+        if missing:
+            first = np.array([rows[0] for rows in missing.values()])
+            # the setpoints of the key, in MW/Mvar
+            setpoints = quantized[first] * np.repeat(self.resolution, [n_sgen, n_sgen, n_load, n_load])
+            split = np.cumsum([n_sgen, n_sgen, n_load])
+            vm_new, va_new, converged_new = runner.run(*np.split(setpoints, split, axis = 1))
+            for i, (key, rows) in enumerate(missing.items()):
+                # a diverged scenario is not cached, it is solved again the next time (e.g. from another warm start)
+                if converged_new[i]:
+                    self.cache.put(self.network, key, (vm_new[i].copy(), va_new[i].copy(), True))
+                vm_pu[rows] = vm_new[i]
+                va_degree[rows] = va_new[i]
+                converged[rows] = converged_new[i]
+        return vm_pu, va_degree, converged
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+    from power_flow import PowerFlowRunner
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus141', help = "specify the bus name under test")
+    parser.add_argument("--steps", type = int, default = 2000, help = "number of rollout steps")
+    parser.add_argument("--levels", type = int, default = 5, help = "number of quantized reactive power actions")
+    parser.add_argument("--directory", default = None, help = "shared cache directory")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+    cached = CachedPowerFlow(runner, ScenarioCache(directory = args.directory))
+
+    # rollouts over the same PV day (hourly) with quantized reactive power actions
+    day = np.clip(np.sin(np.linspace(0, np.pi, 24)), 0, None)
+    hour = rng.integers(0, 24, args.steps)
+    action = rng.integers(0, args.levels, (args.steps, 1)) / (args.levels - 1) * 2 - 1
+    sgen_p = runner.sgen_p * day[hour][:, None]
+    sgen_q = 0.3 * sgen_p * action
+
+    start = time.time()
+    vm_cached, _, _ = cached.run(sgen_p, sgen_q)
+    time_cached = time.time() - start
+    start = time.time()
+    vm_full, _, _ = runner.run(sgen_p, sgen_q)
+    time_full = time.time() - start
+
+    print(f'cached: {time_cached:.3f}s, full: {time_full:.3f}s, {cached.cache.stats()}')
+    print(f'max vm difference: {np.abs(vm_cached - vm_full).max():.2e} pu')
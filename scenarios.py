@@ -0,0 +1,26 @@
+"""
+Random operating points around a saved case, shared by the benchmark and the dataset generation
+
+1. The PV active power is drawn in [0, 1] of the sgen value of the net, its reactive power in [-1, 1] of the sgen q.
+2. The loads are drawn in [0.8, 1.2] of their base values.
+3. The draws only use the given numpy generator, so a seeded generator always gives the same scenarios.
+"""
+
+import numpy as np
+
+"""
+Functions
+"""
+
+def random_scenarios(net, n_scenario, rng):
+    """
+    TARGET:
+        Return randomized sgen and load injections (n_scenario x n) around the values of the net
+        The PV active power is in [0, 1] of its value, the reactive power in [-1, 1] and the loads in [0.8, 1.2]
+    """
+    n_sgen, n_load = net.sgen.shape[0], net.load.shape[0]
+    sgen_p = net.sgen['p_mw'].values * rng.uniform(0, 1, (n_scenario, n_sgen))
+    sgen_q = net.sgen['q_mvar'].values * rng.uniform(-1, 1, (n_scenario, n_sgen))
+    load_p = net.load['p_mw'].values * rng.uniform(0.8, 1.2, (n_scenario, n_load))
+    load_q = net.load['q_mvar'].values * rng.uniform(0.8, 1.2, (n_scenario, n_load))
+    return sgen_p, sgen_q, load_p, load_q
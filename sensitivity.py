@@ -0,0 +1,220 @@
+"""
+Cached per-zone voltage sensitivities (dV/dP and dV/dQ) from the power flow jacobian
+
+1. The sgens are named after their control zones, so each agent needs the block (zone buses x zone sgens) of the sensitivity.
+2. At an operating point V, the jacobian J of the Newton-Raphson (power_flow.jacobian) is factorized once, the zone blocks are solved from the factorization on request.
+3. The factorizations are cached by (network, operating-point bucket) with LRU eviction, the bucket is the mean voltage of each zone rounded to vm_resolution.
+4. When the operating point drifts within a bucket, the jacobian change is approximated by its max_rank largest rows and applied by the Woodbury identity on the cached factorization.
+   The jacobian is only factorized again when the rows left out of the update are larger than drift_tolerance (relative).
+The sensitivities are in p.u. voltage per MW/Mvar of the sgen (the scaling of the sgen is included).
+"""
+
+import numpy as np
+from collections import OrderedDict
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse.linalg import splu
+from power_flow import jacobian
+
+"""
+Cache
+"""
+
+class SensitivityCache:
+    """
+    TARGET:
+        LRU cache of the factorized operating points, it can be shared by the sensitivities of several networks
+    """
+    def __init__(self, capacity = 32):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last = False)
+
+"""
+Sensitivity
+"""
+
+class ZoneSensitivity:
+    """
+    TARGET:
+        Per-zone dV/dP and dV/dQ blocks of a PowerFlowRunner network
+        bus_zone: zone of each row of net.bus, sgen_zone: zone (name) of each row of net.sgen
+    """
+    def __init__(self, runner, bus_zone, sgen_zone, cache = None, network_key = None,
+                 vm_resolution = 0.005, max_rank = 20, drift_tolerance = 0.05, refresh_tolerance = 1e-4):
+        self.runner = runner
+        self.cache = SensitivityCache() if cache is None else cache
+        self.network_key = id(runner) if network_key is None else network_key
+        self.vm_resolution = vm_resolution
+        self.max_rank = max_rank
+        self.drift_tolerance = drift_tolerance
+        self.refresh_tolerance = refresh_tolerance
+
+        n_ppc = runner.Ybus.shape[0]
+        n_pvpq = len(runner.pvpq)
+        # row of the P and Q mismatch of each ppc bus in the jacobian (-1 if there is none)
+        self.P_row = np.full(n_ppc, -1, dtype = int)
+        self.P_row[runner.pvpq] = np.arange(n_pvpq)
+        self.Q_row = np.full(n_ppc, -1, dtype = int)
+        self.Q_row[runner.pq] = n_pvpq + np.arange(len(runner.pq))
+
+        bus_zone = np.asarray(bus_zone)
+        sgen_zone = np.asarray(sgen_zone)
+        sgen_bus = runner.sgen_bus
+        sgen_scale = np.asarray(runner.C_sgen.sum(axis = 0)).ravel()
+
+        self.zones = {}
+        for zone in sorted(set(sgen_zone)):
+            bus_rows = np.nonzero(bus_zone == zone)[0]
+            sgen_rows = np.nonzero(sgen_zone == zone)[0]
+            self.zones[zone] = {'bus': bus_rows,
+                                'sgen': sgen_rows,
+                                'Vm_row': self.Q_row[runner.bus_ppc[bus_rows]],
+                                'P_row': self.P_row[sgen_bus[sgen_rows]],
+                                'Q_row': self.Q_row[sgen_bus[sgen_rows]],
+                                'scale': sgen_scale[sgen_rows]}
+        self.bucket_bus = {zone: runner.bus_ppc[value['bus']] for zone, value in self.zones.items()}
+
+    def bucket(self, V):
+        return tuple(int(np.round(np.abs(V[bus]).mean() / self.vm_resolution)) for bus in self.bucket_bus.values())
+
+    def factorize(self, V):
+        runner = self.runner
+        J = jacobian(runner.Ybus, V, runner.pvpq, runner.pq)
+        return {'V': V.copy(), 'J_anchor': J, 'J_norm': np.sqrt((abs(J.data) ** 2).sum()), 'lu': splu(J),
+                'update': None, 'blocks': {}, 'refactorizations': 1, 'updates': 0}
+
+    def refresh(self, entry, V):
+        """
+        TARGET:
+            Move the entry to the operating point V by a rank-limited update of the anchor factorization
+            Return False if the change of the jacobian is too large for the update (a new factorization is needed)
+        """
+        runner = self.runner
+        dJ = (jacobian(runner.Ybus, V, runner.pvpq, runner.pq) - entry['J_anchor']).tocsr()
+        row_norm = np.sqrt(np.asarray(dJ.multiply(dJ).sum(axis = 1)).ravel())
+        rows = np.argsort(row_norm)[::-1][:self.max_rank]
+        rows = rows[row_norm[rows] > 0]
+        rest = np.sqrt(max((row_norm ** 2).sum() - (row_norm[rows] ** 2).sum(), 0))
+        if rest > self.drift_tolerance * entry['J_norm']:
+            return False
+
+        # Woodbury: (J0 + E D)^-1 = J0^-1 - Z (I + D Z)^-1 D J0^-1, with Z = J0^-1 E
+        if len(rows) > 0:
+            D = dJ[rows]
+            E = np.zeros((dJ.shape[0], len(rows)))
+            E[rows, np.arange(len(rows))] = 1
+            Z = entry['lu'].solve(E)
+            entry['update'] = {'D': D, 'Z': Z, 'M': lu_factor(np.eye(len(rows)) + D @ Z)}
+        else:
+            entry['update'] = None
+        entry['V'] = V.copy()
+        entry['blocks'] = {}
+        entry['updates'] += 1
+        return True
+
+    def solve(self, entry, B):
+        Y = entry['lu'].solve(B)
+        update = entry['update']
+        if update is not None:
+            Y = Y - update['Z'] @ lu_solve(update['M'], update['D'] @ Y)
+        return Y
+
+    def entry(self, V):
+        """
+        TARGET:
+            Return the cached factorization of the operating point V, refreshed or factorized if needed
+        """
+        key = (self.network_key, self.bucket(V))
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self.factorize(V)
+            self.cache.put(key, entry)
+        elif np.abs(V - entry['V']).max() > self.refresh_tolerance:
+            if not self.refresh(entry, V):
+                refactorizations = entry['refactorizations']
+                entry = self.factorize(V)
+                entry['refactorizations'] += refactorizations
+                self.cache.put(key, entry)
+        return entry
+
+    def zone_block(self, V, zone):
+        """
+        TARGET:
+            Return dV/dP and dV/dQ (zone buses x zone sgens) at the operating point V (complex voltage in ppc order)
+            The row order is the order of the zone buses in net.bus, the column order is the order of the zone sgens in net.sgen
+        """
+        entry = self.entry(V)
+        if zone not in entry['blocks']:
+            info = self.zones[zone]
+            n_row = entry['J_anchor'].shape[0]
+            n_sgen = len(info['sgen'])
+
+            # unit injections at the P and Q rows of the zone sgens (no column for the slack bus)
+            E = np.zeros((n_row, 2 * n_sgen))
+            for column, row in enumerate(np.r_[info['P_row'], info['Q_row']]):
+                if row >= 0:
+                    E[row, column] = 1
+            X = self.solve(entry, E) * np.r_[info['scale'], info['scale']]
+
+            # the voltage of the slack and PV buses does not change
+            dV = np.zeros((len(info['bus']), 2 * n_sgen))
+            has_row = info['Vm_row'] >= 0
+            dV[has_row] = X[info['Vm_row'][has_row]]
+            entry['blocks'][zone] = (dV[:, :n_sgen], dV[:, n_sgen:])
+
+        return entry['blocks'][zone]
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+    from power_flow import PowerFlowRunner
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus141', help = "specify the bus name under test")
+    parser.add_argument("--steps", type = int, default = 200, help = "number of timesteps")
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+    sensitivity = ZoneSensitivity(runner, net.bus['zone'].values, net.sgen['name'].values)
+
+    # a slowly drifting PV profile
+    profile = np.clip(np.cumsum(np.random.normal(0, 0.02, (args.steps, 1)), axis = 0) + 0.5, 0, 1)
+    Sbus = runner.Sbus(runner.sgen_p * profile, np.broadcast_to(runner.sgen_q, (args.steps, net.sgen.shape[0])),
+                       np.broadcast_to(runner.load_p, (args.steps, net.load.shape[0])), np.broadcast_to(runner.load_q, (args.steps, net.load.shape[0])))
+
+    V = runner.V_base
+    start = time.time()
+    for t in range(args.steps):
+        V, _, _ = runner.solve(Sbus[t], V)
+        for zone in sensitivity.zones:
+            dV_dP, dV_dQ = sensitivity.zone_block(V, zone)
+    elapsed = time.time() - start
+
+    entries = sensitivity.cache.entries.values()
+    print(f'{args.steps} steps x {len(sensitivity.zones)} zones in {elapsed:.3f}s')
+    print(f'cache hits: {sensitivity.cache.hits}, misses: {sensitivity.cache.misses}, '
+          f'factorizations: {sum(entry["refactorizations"] for entry in entries)}, rank updates: {sum(entry["updates"] for entry in entries)}')
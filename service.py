@@ -0,0 +1,275 @@
+"""
+Local power flow service: the networks are loaded once and the concurrent requests are solved in micro-batches
+
+1. The server (asyncio) listens on a Unix socket or a localhost TCP port, the protocol is one JSON object per line.
+   Request: {"id": ..., "case": "bus141", "sgen_p": [...], "sgen_q": [...], "load_p": [...], "load_q": [...]} (missing arrays keep the values of the net)
+   Reply: {"id": ..., "vm_pu": [...], "va_degree": [...], "converged": true} or {"id": ..., "error": "..."}
+   {"metrics": true} returns the metrics of the service.
+2. Each case has a queue and a batcher task: the requests arriving within max_latency of the first one (at most max_batch) are solved together
+   by the batched radial sweep (or the Newton runner if the network is not radial), in a worker thread so the server keeps accepting requests.
+3. The metrics are the current and max queue depth, the number of requests and batches, the mean batch size and the request latency percentiles.
+"""
+
+import os
+import json
+import time
+import asyncio
+import socket
+import numpy as np
+import pandapower as pp
+from collections import deque
+from power_flow import PowerFlowRunner
+from radial_sweep import RadialSweep
+
+ARRAYS = ['sgen_p', 'sgen_q', 'load_p', 'load_q']
+
+"""
+Cases
+"""
+
+class Case:
+    """
+    TARGET:
+        One loaded network with its request queue and metrics
+    """
+    def __init__(self, name):
+        self.name = name
+        self.runner = PowerFlowRunner(pp.from_pickle(f'{name}.p'))
+        try:
+            self.sweep = RadialSweep(self.runner)
+        except ValueError:
+            self.sweep = None
+        self.queue = None    # created in the event loop of the service
+        self.requests = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.latency = deque(maxlen = 10000)
+
+    def defaults(self):
+        runner = self.runner
+        return {'sgen_p': runner.sgen_p, 'sgen_q': runner.sgen_q, 'load_p': runner.load_p, 'load_q': runner.load_q}
+
+    def validate(self, request):
+        """
+        TARGET:
+            Return the arrays of one request (the missing ones keep the values of the net)
+            Raise a ValueError if an array is not a flat list of numbers of the right length
+        """
+        arrays = {}
+        for name, default in self.defaults().items():
+            if name not in request:
+                arrays[name] = default
+                continue
+            try:
+                value = np.asarray(request[name], dtype = float)
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} should be a list of numbers')
+            if value.shape != default.shape:
+                raise ValueError(f'{name} should have shape {default.shape}, not {value.shape}')
+            if not np.isfinite(value).all():
+                raise ValueError(f'{name} should be finite')
+            arrays[name] = value
+        return arrays
+
+    def solve(self, batch):
+        """
+        TARGET:
+            Solve a batch of validated requests (list of dicts of arrays), return vm_pu, va_degree and converged (batch x n)
+        """
+        arrays = {name: np.stack([request[name] for request in batch]) for name in ARRAYS}
+        solver = self.sweep if self.sweep is not None else self.runner
+        return solver.run(arrays['sgen_p'], arrays['sgen_q'], arrays['load_p'], arrays['load_q'])
+
+    def metrics(self):
+        latency = np.array(self.latency) if len(self.latency) > 0 else np.zeros(1)
+        return {'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+                'max_queue_depth': self.max_depth,
+                'requests': self.requests,
+                'batches': self.batches,
+                'mean_batch_size': self.requests / max(self.batches, 1),
+                'latency_ms': {'p50': float(np.percentile(latency, 50) * 1000),
+                               'p95': float(np.percentile(latency, 95) * 1000),
+                               'max': float(latency.max() * 1000)}}
+
+"""
+Server
+"""
+
+class PowerFlowService:
+    """
+    TARGET:
+        asyncio server of the power flow of the saved networks (cases), with request micro-batching
+    """
+    def __init__(self, cases, max_batch = 64, max_latency = 0.005):
+        self.case_names = list(cases)
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.cases = {}
+        self.tasks = []
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for name in self.case_names:
+            # the networks are loaded in a thread, once per service
+            self.cases[name] = await loop.run_in_executor(None, Case, name)
+            self.cases[name].queue = asyncio.Queue()
+            self.tasks.append(asyncio.create_task(self.batcher(self.cases[name])))
+
+    async def batcher(self, case):
+        """
+        TARGET:
+            Collect the requests of a case within max_latency of the first one (at most max_batch) and solve them together
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await case.queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(case.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _, _ in items]
+            try:
+                vm_pu, va_degree, converged = await loop.run_in_executor(None, case.solve, requests)
+                replies = [{'vm_pu': vm_pu[i].tolist(), 'va_degree': va_degree[i].tolist(), 'converged': bool(converged[i])}
+                           for i in range(len(items))]
+            except Exception as error:
+                replies = [{'error': str(error)}] * len(items)
+
+            case.batches += 1
+            now = time.perf_counter()
+            for (_, future, arrival), reply in zip(items, replies):
+                case.latency.append(now - arrival)
+                if not future.done():
+                    future.set_result(reply)
+
+    async def handle(self, request):
+        if request.get('metrics'):
+            return {name: case.metrics() for name, case in self.cases.items()}
+        case = self.cases.get(request.get('case'))
+        if case is None:
+            return {'error': f"unknown case {request.get('case')}, the service has {list(self.cases)}"}
+        # a malformed request is rejected alone, it never reaches a batch
+        try:
+            arrays = case.validate(request)
+        except ValueError as error:
+            return {'error': str(error)}
+        future = asyncio.get_running_loop().create_future()
+        case.requests += 1
+        await case.queue.put((arrays, future, time.perf_counter()))
+        case.max_depth = max(case.max_depth, case.queue.qsize())
+        return await future
+
+    async def connection(self, reader, writer):
+        """
+        TARGET:
+            Serve one client: each line is a request, the replies are written as soon as they are ready (tagged by the request id)
+        """
+        lock = asyncio.Lock()
+
+        async def reply(line):
+            request_id = None
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError(f'a request should be a json object, not {type(request).__name__}')
+                request_id = request.get('id')
+                response = await self.handle(request)
+            except json.JSONDecodeError as error:
+                response = {'error': f'invalid json: {error}'}
+            except Exception as error:
+                # every line gets a reply, otherwise the client waits forever
+                response = {'error': f'{type(error).__name__}: {error}'}
+            response = dict(response, id = request_id)
+            async with lock:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+
+        pending = set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            task = asyncio.create_task(reply(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+        writer.close()
+
+    async def serve(self, path = None, host = '127.0.0.1', port = 8765):
+        await self.start()
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path)
+            server = await asyncio.start_unix_server(self.connection, path = path)
+        else:
+            server = await asyncio.start_server(self.connection, host, port)
+        print(f"serving {list(self.cases)} on {path or f'{host}:{port}'}")
+        async with server:
+            await server.serve_forever()
+
+"""
+Client
+"""
+
+class PowerFlowClient:
+    """
+    TARGET:
+        Blocking client of the service (one request at a time per client, use one client per thread/process)
+    """
+    def __init__(self, path = None, host = '127.0.0.1', port = 8765):
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port))
+        self.file = self.socket.makefile('rwb')
+        self.count = 0
+
+    def request(self, message):
+        self.count += 1
+        self.file.write((json.dumps(dict(message, id = self.count)) + '\n').encode())
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def solve(self, case, **arrays):
+        """
+        TARGET:
+            Return vm_pu, va_degree and converged of one scenario (sgen_p, sgen_q, load_p, load_q as keyword arrays)
+        """
+        reply = self.request(dict({name: np.asarray(value).tolist() for name, value in arrays.items()}, case = case))
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return np.array(reply['vm_pu']), np.array(reply['va_degree']), reply['converged']
+
+    def metrics(self):
+        return self.request({'metrics': True})
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", nargs = '+', default = ['bus141', 'bus322'], help = "the networks served")
+    parser.add_argument("--socket", default = None, help = "Unix socket path (default: localhost TCP)")
+    parser.add_argument("--port", type = int, default = 8765, help = "TCP port")
+    parser.add_argument("--max_batch", type = int, default = 64, help = "max requests per batch")
+    parser.add_argument("--max_latency", type = float, default = 0.005, help = "max wait (s) to fill a batch")
+    args = parser.parse_args()
+
+    service = PowerFlowService(args.bus, args.max_batch, args.max_latency)
+    asyncio.run(service.serve(args.socket, port = args.port))
@@ -0,0 +1,63 @@
+"""
+Local cache of the SimBench source grids
+
+1. The first sb.get_simbench_net of a grid parses the SimBench csv data, the net is then saved as a binary pickle in the cache directory.
+2. The following loads read the pickle only, simbench is not imported at all.
+3. The cache directory is .simbench_cache by default, or the SIMBENCH_CACHE environment variable.
+4. With SIMBENCH_OFFLINE=1 (e.g. on air-gapped machines and CI) a missing grid raises an error instead of calling simbench.
+The cache can be filled on another machine by `python simbench_cache.py <grid codes>` and copied over.
+"""
+
+import os
+import pickle
+from profiling import timed
+from atomic_file import write_atomic
+
+CACHE_DIR = os.environ.get('SIMBENCH_CACHE', '.simbench_cache')
+
+"""
+Functions
+"""
+
+def cache_file(code, cache_dir = None):
+    return os.path.join(cache_dir or CACHE_DIR, f'{code}.pkl')
+
+@timed()
+def get_simbench_net(code, cache_dir = None, offline = None):
+    """
+    TARGET:
+        Return the SimBench net of the grid code, from the cache if it is there
+    """
+    if offline is None:
+        offline = os.environ.get('SIMBENCH_OFFLINE', '0') == '1'
+    path = cache_file(code, cache_dir)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    if offline:
+        raise FileNotFoundError(f'{code} is not in the SimBench cache {os.path.dirname(path)} (offline mode)')
+
+    import simbench as sb
+    net = sb.get_simbench_net(code)
+
+    # write to a temporary file first, so parallel workers never read a partial cache file
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    write_atomic(path, lambda f: pickle.dump(net, f, protocol = pickle.HIGHEST_PROTOCOL))
+
+    return net
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("codes", nargs = '+', help = "SimBench grid codes to cache")
+    args = parser.parse_args()
+
+    for code in args.codes:
+        net = get_simbench_net(code, offline = False)
+        print(f'{code}: {net.bus.shape[0]} buses cached in {cache_file(code)}')
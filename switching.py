@@ -0,0 +1,347 @@
+"""
+Switching and outage scenarios (in_service of lines, transformers and sgens) without rebuilding the network
+
+1. The Ybus, the base voltage and the factorization of the jacobian at the base voltage are built once from a PowerFlowRunner.
+2. Toggling a line or a transformer adds or removes its pi-model admittances: a rank-2 change of the Ybus (rows and columns of its two buses).
+   Toggling a sgen only changes its injection (a mask on the sgen columns).
+3. A changed branch only changes the jacobian rows of its two buses, and the buses cut from the slack bus (islands) get identity rows,
+   so the jacobian of the switched network at the base voltage is the cached factorization plus a low-rank row update (Woodbury identity).
+   The power flow of the scenario runs Newton iterations with this jacobian (chord method) on the exact mismatch, so the solution is exact.
+   Only the changed rows of the jacobian are assembled (jacobian_rows), the full jacobian is only built when the rank is above max_rank and it is factorized again.
+   If the chord iterations stop decreasing the mismatch, the scenario falls back to a full Newton-Raphson from the same starting voltage.
+4. The islanded buses are de-energized (V = 0) as in pandapower, affected_zones reports the zones touched by the switching
+   and key identifies the switching state (e.g. as the network_key of ZoneSensitivity).
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, diags, hstack
+from scipy.sparse.csgraph import breadth_first_order
+from scipy.sparse.linalg import splu
+from scipy.linalg import lu_factor, lu_solve
+from pandapower.pypower.idx_brch import F_BUS, T_BUS, BR_STATUS
+from power_flow import jacobian, mismatch, newton, branch_admittance
+
+"""
+Functions
+"""
+
+def jacobian_rows(Ybus, V, pvpq, pq, rows):
+    """
+    TARGET:
+        Return the given rows of the Newton-Raphson jacobian (the layout of power_flow.jacobian) without assembling the others
+    """
+    n_pvpq = len(pvpq)
+    is_P = rows < n_pvpq
+    bus = np.empty(len(rows), dtype = int)
+    bus[is_P] = pvpq[rows[is_P]]
+    bus[~is_P] = pq[rows[~is_P] - n_pvpq]
+
+    # the rows of dSbus_dV of these buses
+    Y_rows = Ybus[bus]
+    I_rows = Y_rows @ V
+    V_norm = V / np.abs(V)
+    E = csr_matrix((np.ones(len(bus)), (np.arange(len(bus)), bus)), shape = (len(bus), len(V)))
+    dS_dVm = (diags(V[bus]) @ (Y_rows @ diags(V_norm)).conj() + diags(np.conj(I_rows) * V_norm[bus]) @ E).tocsr()
+    dS_dVa = (1j * diags(V[bus]) @ (diags(I_rows) @ E - Y_rows @ diags(V)).conj()).tocsr()
+
+    # P rows take the real part, Q rows the imaginary part
+    P, Q = diags(is_P.astype(float)), diags((~is_P).astype(float))
+    J_Va = P @ dS_dVa.real + Q @ dS_dVa.imag
+    J_Vm = P @ dS_dVm.real + Q @ dS_dVm.imag
+    return hstack([J_Va.tocsc()[:, pvpq], J_Vm.tocsc()[:, pq]], format = 'csr')
+
+"""
+Switching model
+"""
+
+class SwitchingModel:
+    """
+    TARGET:
+        Power flow of a PowerFlowRunner network under in_service toggles of lines, trafos and sgens
+        bus_zone: optional zone of each row of net.bus, for affected_zones
+    """
+    def __init__(self, runner, bus_zone = None, max_rank = 40, max_iteration = 50):
+        self.runner = runner
+        self.max_rank = max_rank
+        self.max_iteration = max_iteration
+        ppc = runner.ppc
+
+        branch = np.array(ppc['branch'])
+        self.f_bus = branch[:, F_BUS].real.astype(int)
+        self.t_bus = branch[:, T_BUS].real.astype(int)
+        self.base_status = branch[:, BR_STATUS].real > 0
+        # admittances of every branch as if it was in service
+        branch[:, BR_STATUS] = 1
+        self.Y_branch = branch_admittance(branch)
+        self.element_branch = {'line': np.asarray(ppc['line_branch']), 'trafo': np.asarray(ppc['trafo_branch'])}
+
+        self.Ybus_base = runner.Ybus.tocsr()
+        self.n_bus = self.Ybus_base.shape[0]
+        self.root = int(runner.ref[0])
+        self.V_base = runner.V_base
+        self.J_base = jacobian(self.Ybus_base, self.V_base, runner.pvpq, runner.pq).tocsr()
+        self.lu = splu(self.J_base.tocsc())
+
+        # jacobian rows of each ppc bus: the P row (pvpq) and the Q row (pq)
+        n_pvpq = len(runner.pvpq)
+        self.P_row = np.full(self.n_bus, -1, dtype = int)
+        self.P_row[runner.pvpq] = np.arange(n_pvpq)
+        self.Q_row = np.full(self.n_bus, -1, dtype = int)
+        self.Q_row[runner.pq] = n_pvpq + np.arange(len(runner.pq))
+
+        self.zone_ppc = None
+        if bus_zone is not None:
+            self.zone_ppc = np.full(self.n_bus, 'main', dtype = object)
+            self.zone_ppc[runner.bus_ppc] = np.asarray(bus_zone, dtype = object)
+
+        self.status = self.base_status.copy()
+        self.sgen_status = np.ones(len(runner.sgen_p))
+        self._state = None
+
+    """
+    Toggles
+    """
+
+    def set_in_service(self, element, index, in_service):
+        """
+        TARGET:
+            Set the in_service of the rows (positions in net.line/net.trafo/net.sgen) of an element
+            A line or trafo out of service in the base net has no branch in the internal ppc and cannot be switched on
+        """
+        index = np.atleast_1d(index)
+        if element == 'sgen':
+            self.sgen_status[index] = float(in_service)
+        elif element in self.element_branch:
+            branch = self.element_branch[element][index]
+            if (branch < 0).any():
+                raise ValueError(f'{element} {index[branch < 0].tolist()} out of service in the base net, set it in service and build a new PowerFlowRunner')
+            self.status[branch] = bool(in_service)
+            self._state = None
+        else:
+            raise ValueError(f'unknown element {element}, use line, trafo or sgen')
+
+    def reset(self):
+        self.status = self.base_status.copy()
+        self.sgen_status[:] = 1
+        self._state = None
+
+    @property
+    def changed(self):
+        return np.nonzero(self.status != self.base_status)[0]
+
+    @property
+    def key(self):
+        return tuple(self.changed.tolist()) + ('sgen',) + tuple(np.nonzero(self.sgen_status == 0)[0].tolist())
+
+    """
+    Switched network
+    """
+
+    def delta_Ybus(self, changed):
+        """
+        TARGET:
+            Return the sparse change of the Ybus of the changed branches (+ admittance if switched on, - if switched off)
+        """
+        sign = np.where(self.status[changed], 1.0, -1.0)
+        f, t = self.f_bus[changed], self.t_bus[changed]
+        Yff, Yft, Ytf, Ytt = (Y[changed] * sign for Y in self.Y_branch)
+        return coo_matrix((np.r_[Yff, Yft, Ytf, Ytt], (np.r_[f, f, t, t], np.r_[f, t, f, t])), shape = (self.n_bus, self.n_bus)).tocsr()
+
+    def islands(self):
+        """
+        TARGET:
+            Return the mask of the buses which are not connected to the slack bus by the in-service branches
+        """
+        f, t = self.f_bus[self.status], self.t_bus[self.status]
+        adjacency = coo_matrix((np.ones(len(f)), (f, t)), shape = (self.n_bus, self.n_bus)).tocsr()
+        connected = breadth_first_order(adjacency, self.root, directed = False, return_predecessors = False)
+        isolated = np.ones(self.n_bus, dtype = bool)
+        isolated[connected] = False
+        return isolated
+
+    def island_rows(self, isolated):
+        rows = np.r_[self.P_row[isolated], self.Q_row[isolated]]
+        return rows[rows >= 0]
+
+    def state(self):
+        """
+        TARGET:
+            Return the switched Ybus, the islanded buses and the low-rank update of the base jacobian (cached until the next toggle)
+        """
+        if self._state is not None:
+            return self._state
+
+        runner = self.runner
+        changed = self.changed
+        Ybus = (self.Ybus_base + self.delta_Ybus(changed)).tocsr()
+        isolated = self.islands()
+
+        # the jacobian rows which differ from the base: the buses of the changed branches and the islanded buses
+        buses = np.unique(np.r_[self.f_bus[changed], self.t_bus[changed], np.nonzero(isolated)[0]])
+        rows = np.r_[self.P_row[buses], self.Q_row[buses]]
+        rows = np.unique(rows[rows >= 0])
+
+        # the island rows are identity rows (no update of the de-energized buses),
+        # the other rows have no entry in the island columns since the branches to the islands are switched off
+        island_rows = self.island_rows(isolated)
+        n = self.J_base.shape[0]
+
+        state = {'Ybus': Ybus, 'isolated': isolated, 'rank': len(rows)}
+        if 0 < len(rows) <= self.max_rank:
+            # Woodbury: (J0 + E D)^-1 with E the unit columns of the rows and D = J[rows] - J0[rows]
+            is_island = np.isin(rows, island_rows)
+            J_rows = diags((~is_island).astype(float)) @ jacobian_rows(Ybus, self.V_base, runner.pvpq, runner.pq, rows)
+            J_rows = J_rows + csr_matrix((np.ones(is_island.sum()), (np.nonzero(is_island)[0], rows[is_island])), shape = (len(rows), n))
+            D = (J_rows - self.J_base[rows]).tocsr()
+            E = np.zeros((n, len(rows)))
+            E[rows, np.arange(len(rows))] = 1
+            Z = self.lu.solve(E)
+            state.update(D = D, Z = Z, M = lu_factor(np.eye(len(rows)) + D @ Z), lu = self.lu)
+        elif len(rows) > self.max_rank:
+            J = jacobian(Ybus, self.V_base, runner.pvpq, runner.pq).tolil()
+            for row in island_rows:
+                J.rows[row], J.data[row] = [row], [1.0]
+            state['lu'] = splu(J.tocsc())
+        else:
+            state['lu'] = self.lu
+        self._state = state
+        return state
+
+    def linear_solve(self, state, F):
+        x = state['lu'].solve(F)
+        if 'D' in state:
+            x = x - state['Z'] @ lu_solve(state['M'], state['D'] @ x)
+        return x
+
+    def solve(self, Sbus, V0 = None):
+        """
+        TARGET:
+            Solve the power flow of the switched network (bus injection in p.u., ppc order)
+            Return the complex voltage (0 at the islanded buses), the convergence flag and the number of iterations
+        """
+        runner = self.runner
+        state = self.state()
+        Ybus, isolated = state['Ybus'], state['isolated']
+        active = ~isolated
+        island_rows = self.island_rows(isolated)
+        pvpq = runner.pvpq[active[runner.pvpq]]
+        pq = runner.pq[active[runner.pq]]
+
+        V = np.array(self.V_base if V0 is None else V0, dtype = complex)
+        V[isolated] = self.V_base[isolated]
+        V_start = V.copy()
+        Va, Vm = np.angle(V), np.abs(V)
+        n_pvpq = len(runner.pvpq)
+
+        def full_mismatch(V):
+            F = mismatch(Ybus, V, Sbus, runner.pvpq, runner.pq)
+            F[island_rows] = 0
+            return F
+
+        # chord Newton with the updated base jacobian, stopped as soon as the mismatch grows
+        F = full_mismatch(V)
+        norm = np.abs(F).max(initial = 0)
+        iteration = 0
+        converged = norm < runner.tolerance_mva
+        while not converged and iteration < self.max_iteration:
+            iteration += 1
+            dx = -self.linear_solve(state, F)
+            Va[runner.pvpq] += dx[:n_pvpq]
+            Vm[runner.pq] += dx[n_pvpq:]
+            V = Vm * np.exp(1j * Va)
+            F = full_mismatch(V)
+            last_norm, norm = norm, np.abs(F).max(initial = 0)
+            converged = norm < runner.tolerance_mva
+            if not norm < last_norm:
+                break
+
+        if not converged:
+            # fallback: full Newton-Raphson on the energized buses, from the starting voltage (the chord iterate may have diverged)
+            V, converged, extra = newton(Ybus, Sbus, V_start, pvpq, pq, runner.max_iteration, runner.tolerance_mva)
+            iteration += extra
+
+        V = V.copy()
+        V[isolated] = 0
+        return V, converged, iteration
+
+    def run(self, sgen_p = None, sgen_q = None, load_p = None, load_q = None, V0 = None):
+        """
+        TARGET:
+            Solve T timesteps of the switched network as in PowerFlowRunner.run (the switched-off sgens inject nothing)
+            Return vm_pu (T x n_bus), va_degree (T x n_bus) and the convergence flag (T,)
+        """
+        runner = self.runner
+        T = next(np.shape(value)[0] for value in (sgen_p, sgen_q, load_p, load_q) if value is not None)
+        sgen_p = np.broadcast_to(runner.sgen_p if sgen_p is None else sgen_p, (T, len(runner.sgen_p))) * self.sgen_status
+        sgen_q = np.broadcast_to(runner.sgen_q if sgen_q is None else sgen_q, (T, len(runner.sgen_p))) * self.sgen_status
+        load_p = np.broadcast_to(runner.load_p if load_p is None else load_p, (T, len(runner.load_p)))
+        load_q = np.broadcast_to(runner.load_q if load_q is None else load_q, (T, len(runner.load_p)))
+        Sbus = runner.Sbus(sgen_p, sgen_q, load_p, load_q)
+
+        vm_pu = np.empty((T, len(runner.bus_ppc)))
+        va_degree = np.empty((T, len(runner.bus_ppc)))
+        converged = np.zeros(T, dtype = bool)
+        V = self.V_base if V0 is None else V0
+        for t in range(T):
+            V_t, converged[t], _ = self.solve(Sbus[t], V)
+            if converged[t]:
+                V = V_t
+            vm_pu[t] = np.abs(V_t[runner.bus_ppc])
+            va_degree[t] = np.angle(V_t[runner.bus_ppc], deg = True)
+        return vm_pu, va_degree, converged
+
+    def affected_zones(self):
+        """
+        TARGET:
+            Return {zone: {'branches': number of switched branches at the zone buses, 'isolated': number of islanded buses}}
+            for the zones touched by the current switching (bus_zone is needed)
+        """
+        assert self.zone_ppc is not None, 'bus_zone is needed to derive the zones'
+        state = self.state()
+        changed = self.changed
+        affected = {}
+        for bus in np.r_[self.f_bus[changed], self.t_bus[changed]]:
+            entry = affected.setdefault(self.zone_ppc[bus], {'branches': 0, 'isolated': 0})
+            entry['branches'] += 1
+        for bus in np.nonzero(state['isolated'])[0]:
+            entry = affected.setdefault(self.zone_ppc[bus], {'branches': 0, 'isolated': 0})
+            entry['isolated'] += 1
+        return affected
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+    from power_flow import PowerFlowRunner
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus141', help = "specify the bus name under test")
+    args = parser.parse_args()
+
+    net = pp.from_pickle(f'{args.bus}.p')
+    runner = PowerFlowRunner(net)
+    model = SwitchingModel(runner, net.bus['zone'].values)
+
+    # N-1 of every line: the solution of the switched model against pandapower
+    start = time.time()
+    results = []
+    for i in range(net.line.shape[0]):
+        model.set_in_service('line', i, False)
+        vm_pu, _, converged = model.run(sgen_p = runner.sgen_p[None])
+        results.append((i, vm_pu[0], converged[0], model.state()['rank']))
+        model.reset()
+    elapsed = time.time() - start
+    print(f'N-1 of {net.line.shape[0]} lines in {elapsed:.2f}s ({1000 * elapsed / net.line.shape[0]:.2f}ms per contingency)')
+
+    max_error = 0
+    for i, vm_pu, converged, _ in results[:20]:
+        net.line.loc[net.line.index[i], 'in_service'] = False
+        pp.runpp(net)
+        net.line.loc[net.line.index[i], 'in_service'] = True
+        max_error = max(max_error, np.nanmax(np.abs(net.res_bus['vm_pu'].fillna(0).values - vm_pu)))
+    print(f'max vm difference to pp.runpp (first 20 contingencies): {max_error:.2e} pu')
@@ -4,9 +4,12 @@ Test the network by running opf
 
 import argparse
 import pandapower as pp
+from robust_power_flow import run_net
+from opf import solve_scenarios
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--bus", help="specify the bus name under test")
+parser.add_argument("--opf", action = 'store_true', help = "also run the opf (the networks prepared by clean_network, e.g. bus322)")
 args = parser.parse_args()
 
 if args.bus == 'bus33bw':
@@ -17,8 +20,15 @@ elif args.bus == 'bus322':
     net = pp.from_pickle(f'bus322.p')
 
 print(net.load.shape[0])
-try:
-    pp.runpp(net, max_iteration = 30)
-    print('Converged!')
-except:
-    print('Did not converge')
\ No newline at end of file
+result = run_net(net, max_iteration = 30)
+if result['converged']:
+    print(f"Converged! stage: {result['stage']}, iterations: {result['iterations']}, mismatch: {result['mismatch']:.2e}, time: {result['time']:.3f}s")
+else:
+    print(f"Did not converge after all the fallback stages ({result['time']:.3f}s)")
+
+if args.opf:
+    result = solve_scenarios(net, net.load['p_mw'].values[None], None, None)
+    if result['converged'][0]:
+        print(f"OPF converged! objective: {result['objective'][0]:.4f}, time: {result['time'][0]:.3f}s")
+    else:
+        print('OPF did not converge')
@@ -0,0 +1,166 @@
+"""
+Sparse topology and zone validation of the generated networks
+
+1. The bus graph is the sparse adjacency of partition.bus_adjacency (in-service lines and transformers, switches considered).
+2. Topology: the network is connected from the ext_grid bus and radial (one branch less than the buses, parallel branches are counted once).
+3. Zones: each control zone (zone{K}, see compose.zone_number) is one connected subtree (connected components of the intra-zone edges) whose top bus hangs on a main bus.
+   The other labels (main, the SimBench zones of the LV buses off the zone paths) are not checked.
+4. Sgens: each control zone has at least one sgen, the sgen name is the zone of its bus.
+5. Index invariants: the indices of bus/line/trafo/load/sgen are 0..n-1 and every element refers to an existing bus.
+All the checks are vectorized, so they run on every build of large networks.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, triu
+from scipy.sparse.csgraph import connected_components
+from partition import bus_adjacency, tree_traversal
+from compose import zone_number
+
+ELEMENT_BUS = {'line': ['from_bus', 'to_bus'], 'trafo': ['hv_bus', 'lv_bus'], 'load': ['bus'], 'sgen': ['bus'], 'ext_grid': ['bus']}
+
+"""
+Functions
+"""
+
+def check_index(net):
+    """
+    TARGET:
+        Return the issues of the table indices and of the bus references
+    """
+    issues = []
+    for table in ['bus', 'line', 'trafo', 'load', 'sgen']:
+        index = net[table].index.values
+        if not np.array_equal(index, np.arange(len(index))):
+            issues.append(f'{table}: the index is not 0..{len(index) - 1}')
+    for table, columns in ELEMENT_BUS.items():
+        for column in columns:
+            unknown = ~np.isin(net[table][column].values, net.bus.index.values)
+            if unknown.any():
+                issues.append(f'{table}: {unknown.sum()} rows with an unknown {column}, e.g. row {net[table].index[unknown][0]}')
+    return issues
+
+def check_topology(adjacency, root):
+    """
+    TARGET:
+        Return the issues of connectivity and radiality, and the BFS parent of every bus
+    """
+    issues = []
+    n_bus = adjacency.shape[0]
+    order, parent = tree_traversal(adjacency, root)
+    if len(order) != n_bus:
+        issues.append(f'topology: {n_bus - len(order)} buses are not connected to the ext_grid bus')
+    n_edge = triu(adjacency, k = 1).nnz
+    if n_edge != n_bus - 1:
+        issues.append(f'topology: not radial, {n_edge} branches for {n_bus} buses')
+    return issues, parent
+
+def check_zone(adjacency, code, main, parent, zones):
+    """
+    TARGET:
+        Return the issues of the zones: every control zone is one connected subtree attached to a main bus
+    """
+    issues = []
+    n_zone = len(zones)
+    edge = triu(adjacency, k = 1).tocoo()
+    intra = code[edge.row] == code[edge.col]
+    subgraph = csr_matrix((np.ones(intra.sum()), (edge.row[intra], edge.col[intra])), shape = adjacency.shape)
+    _, label = connected_components(subgraph, directed = False)
+
+    # number of connected pieces of each zone
+    pieces = np.unique(np.c_[code, label], axis = 0)
+    n_piece = np.bincount(pieces[:, 0], minlength = n_zone)
+
+    # top buses: the buses whose parent is in another zone, their parent should be in main
+    child = np.nonzero((parent >= 0) & (code != main))[0]
+    top = child[code[parent[child]] != code[child]]
+    off_main = np.bincount(code[top[code[parent[top]] != main]], minlength = n_zone)
+    on_main = np.bincount(code[top[code[parent[top]] == main]], minlength = n_zone)
+
+    is_zone, _ = zone_number(zones)
+    for k in np.nonzero(is_zone)[0]:
+        zone = zones[k]
+        if n_piece[k] > 1:
+            issues.append(f'zone: {zone} is split into {n_piece[k]} pieces')
+        if off_main[k] > 0:
+            issues.append(f'zone: {zone} hangs on another zone')
+        elif on_main[k] == 0 and n_piece[k] > 0:
+            issues.append(f'zone: {zone} is not attached to main')
+    return issues
+
+def check_sgen(net, code, zones, lookup):
+    """
+    TARGET:
+        Return the issues of the sgens: every control zone has at least one sgen and the sgen name is the zone of its bus
+    """
+    issues = []
+    bus_zone = np.asarray(zones, dtype = object)[code[lookup[net.sgen['bus'].values]]]
+    wrong = net.sgen['name'].astype(str).values != bus_zone
+    if wrong.any():
+        issues.append(f'sgen: {wrong.sum()} sgens are not named after the zone of their bus, e.g. row {net.sgen.index[wrong][0]}')
+    is_zone, _ = zone_number(zones)
+    empty = sorted(set(np.asarray(zones)[is_zone]) - set(net.sgen['name'].values))
+    if len(empty) > 0:
+        issues.append(f'sgen: the zones {empty} have no sgen')
+    return issues
+
+def validate_network(net, sgen = True):
+    """
+    TARGET:
+        Return the list of the issues of the net (empty if it is valid)
+        sgen: also check the sgens of the zones (False before the sgens are created)
+    """
+    issues = check_index(net)
+    if len(issues) > 0:
+        return issues
+
+    adjacency, lookup = bus_adjacency(net)
+    zone = pd.Categorical(net.bus['zone'].astype(str))
+    zones = list(zone.categories)
+    code = zone.codes.astype(int)
+    main = zones.index('main') if 'main' in zones else -1
+    if main < 0:
+        issues.append('zone: there is no main zone')
+
+    root = lookup[net.ext_grid['bus'].values[0]]
+    topology_issues, parent = check_topology(adjacency, root)
+    issues += topology_issues
+    issues += check_zone(adjacency, code, main, parent, zones)
+    if sgen:
+        issues += check_sgen(net, code, zones, lookup)
+    return issues
+
+def check_network(net, sgen = True):
+    """
+    TARGET:
+        Raise an error listing all the issues of the net
+    """
+    issues = validate_network(net, sgen)
+    if len(issues) > 0:
+        raise ValueError('the network is not valid:\n' + '\n'.join(issues))
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import sys
+    import time
+    import argparse
+    import pandapower as pp
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs = '*', default = ['bus33bw.p', 'bus141.p', 'bus322.p'], help = "the saved networks")
+    args = parser.parse_args()
+
+    n_invalid = 0
+    for file in args.files:
+        net = pp.from_pickle(file)
+        start = time.time()
+        issues = validate_network(net)
+        print(f'{file}: {net.bus.shape[0]} buses, {len(issues)} issues ({1000 * (time.time() - start):.1f}ms)')
+        for issue in issues:
+            print(f'  {issue}')
+        n_invalid += len(issues) > 0
+    sys.exit(1 if n_invalid > 0 else 0)
@@ -0,0 +1,153 @@
+"""
+Zone index of a network: the integer rows of the buses, sgens, loads and lines of each zone, built once
+
+1. The zone column of net.bus is encoded as categorical codes, the zone names are the sorted categories (including main).
+2. The sgen zone is its name (the repo convention, see determine_sgen), the load zone is the zone of its bus.
+3. A line is in the zone of its end which is not main (the to_bus if both ends are in zones), so the line connecting a zone to main belongs to the zone.
+4. For each kind of element, the rows are sorted by zone (order) and the rows of zone k are order[ptr[k]:ptr[k+1]].
+   A result array gathered once by order (or used as it is if the rows are already sorted by zone) is split into per-zone numpy views by slices,
+   so the per-step extraction does not depend on the number of zones.
+"""
+
+import numpy as np
+import pandas as pd
+
+KINDS = ['bus', 'sgen', 'load', 'line']
+
+"""
+Functions
+"""
+
+def grouping(codes, n_zone):
+    """
+    TARGET:
+        Return the rows sorted by zone code (the rows without a zone, code -1, are left out), the zone pointer and
+        whether the rows are already sorted by zone (then the order is the identity)
+    """
+    codes = np.asarray(codes)
+    order = np.argsort(codes, kind = 'stable')
+    order = order[codes[order] >= 0]
+    ptr = np.searchsorted(codes[order], np.arange(n_zone + 1))
+    contiguous = len(order) == len(codes) and bool((order == np.arange(len(codes))).all())
+    return order, ptr, contiguous
+
+"""
+Zone index
+"""
+
+class ZoneIndex:
+    """
+    TARGET:
+        Integer index arrays of each zone for the bus/sgen/load/line tables (row positions, not pandapower indices)
+    """
+    def __init__(self, bus, sgen, load, line):
+        zone = pd.Categorical(bus['zone'])
+        self.zones = list(zone.categories)
+        self.code = {name: k for k, name in enumerate(self.zones)}
+        n_zone = len(self.zones)
+        bus_code = zone.codes.astype(int)
+
+        # pandapower bus index -> row of net.bus
+        lookup = np.full(bus.index.max() + 1, -1, dtype = int)
+        lookup[bus.index.values] = np.arange(bus.shape[0])
+
+        # sgen: the zone in the name, or the zone of the bus if the name is not a zone
+        sgen_code = np.array([self.code.get(name, -1) for name in sgen['name'].values], dtype = int)
+        sgen_code = np.where(sgen_code >= 0, sgen_code, bus_code[lookup[sgen['bus'].values]]) if sgen.shape[0] > 0 else sgen_code
+
+        load_code = bus_code[lookup[load['bus'].values]]
+
+        main = self.code.get('main', -1)
+        from_code = bus_code[lookup[line['from_bus'].values]]
+        to_code = bus_code[lookup[line['to_bus'].values]]
+        line_code = np.where(to_code == main, from_code, to_code)
+
+        self.codes = {'bus': bus_code, 'sgen': sgen_code, 'load': load_code, 'line': line_code}
+        self.order, self.ptr, self.contiguous, self.slices = {}, {}, {}, {}
+        for kind in KINDS:
+            self.order[kind], self.ptr[kind], self.contiguous[kind] = grouping(self.codes[kind], n_zone)
+            self.slices[kind] = [slice(self.ptr[kind][k], self.ptr[kind][k+1]) for k in range(n_zone)]
+
+    @classmethod
+    def from_net(cls, net):
+        return cls(net.bus, net.sgen, net.load, net.line)
+
+    def index(self, kind, zone):
+        """
+        TARGET:
+            Return the rows of the kind (bus, sgen, load, line) in the zone
+        """
+        return self.order[kind][self.slices[kind][self.code[zone]]]
+
+    def gather(self, kind, values):
+        """
+        TARGET:
+            Return the values (columns on the last axis) sorted by zone, without a copy if the rows are already sorted
+        """
+        if self.contiguous[kind]:
+            return values
+        return values[..., self.order[kind]]
+
+    def split(self, kind, values, zones = None):
+        """
+        TARGET:
+            Return {zone: view of the values of the zone}, the values are gathered once for all the zones
+        """
+        gathered = self.gather(kind, values)
+        zones = self.zones if zones is None else zones
+        return {zone: gathered[..., self.slices[kind][self.code[zone]]] for zone in zones}
+
+    def agent_zones(self):
+        """
+        TARGET:
+            Return the zones controlled by an agent (the zones with at least one sgen)
+        """
+        return [zone for k, zone in enumerate(self.zones) if self.ptr['sgen'][k+1] > self.ptr['sgen'][k]]
+
+    def observation(self, vm_pu, sgen_p, sgen_q):
+        """
+        TARGET:
+            Return the observation of each agent: the voltage of its buses and the power of its sgens (views of the gathered arrays)
+        """
+        zones = self.agent_zones()
+        vm = self.split('bus', vm_pu, zones)
+        p = self.split('sgen', sgen_p, zones)
+        q = self.split('sgen', sgen_q, zones)
+        return {zone: {'vm_pu': vm[zone], 'p_mw': p[zone], 'q_mvar': q[zone]} for zone in zones}
+
+    def action(self, actions, out):
+        """
+        TARGET:
+            Write the action of each agent ({zone: values of the zone sgens in the zone order}) into the sgen array out (columns on the last axis)
+        """
+        for zone, value in actions.items():
+            out[..., self.index('sgen', zone)] = value
+        return out
+
+"""
+main functions
+"""
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandapower as pp
+    from power_flow import PowerFlowRunner
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bus", default = 'bus322', help = "specify the bus name under test")
+    parser.add_argument("--steps", type = int, default = 1000, help = "number of steps")
+    args = parser.parse_args()
+
+    net = pp.from_pickle(f'{args.bus}.p')
+    index = ZoneIndex.from_net(net)
+    runner = PowerFlowRunner(net)
+    vm_pu, _, _ = runner.run(np.broadcast_to(runner.sgen_p, (1, net.sgen.shape[0])))
+
+    start = time.time()
+    for t in range(args.steps):
+        observation = index.observation(vm_pu[0], runner.sgen_p, runner.sgen_q)
+    elapsed = time.time() - start
+    print(f'{len(observation)} agents, contiguous: {index.contiguous}')
+    print(f'observation extraction: {1e6 * elapsed / args.steps:.1f}us per step')